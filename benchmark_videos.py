@@ -0,0 +1,277 @@
+#!/usr/bin/env python3
+"""用 ffmpeg testsrc/sine 合成测试片段，测量 process_videos.py 的吞吐（文件/分钟、实时倍数），输出可跨提交对比的 JSON 报告。"""
+
+from __future__ import annotations
+
+import argparse
+import datetime as dt
+import json
+import os
+import platform
+import random
+import shutil
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+from dataclasses import asdict, dataclass
+from pathlib import Path
+
+import process_videos
+from process_videos import METRICS_LOG_NAME, ensure_ffmpeg_tools, ffprobe_metadata, write_json_atomic
+
+SCRIPT_DIR = Path(__file__).resolve().parent
+REPORT_VERSION = 1
+
+
+@dataclass(frozen=True)
+class ClipSpec:
+    duration: float
+    width: int
+    height: int
+    fps: int = 30
+    audio: bool = True
+
+    @property
+    def name(self) -> str:
+        return f"testsrc_{self.width}x{self.height}_{self.fps}fps_{self.duration:g}s_{'a' if self.audio else 'na'}.mp4"
+
+
+def clip_matrix(durations: tuple[float, ...], sizes: tuple[tuple[int, int], ...]) -> list[ClipSpec]:
+    return [ClipSpec(d, w, h, audio=audio) for d in durations for w, h in sizes for audio in (True, False)]
+
+
+# 片段矩阵：时长 × 分辨率 × 有无音轨；≤15s 的 1080x1920 片段会走直通（remux），长片段走加速
+SCALES: dict[str, list[ClipSpec]] = {
+    "small": clip_matrix((4, 20), ((1280, 720), (1080, 1920))),
+    "medium": clip_matrix((5, 20, 60), ((1920, 1080), (1280, 720), (1080, 1920))),
+    "large": clip_matrix((10, 60, 180), ((3840, 2160), (1920, 1080), (1080, 1920))),
+}
+
+
+def default_scenarios() -> dict[str, list[str]]:
+    jobs = str(max(1, (os.cpu_count() or 1) // 2))
+    return {
+        "final_j1": ["-j", "1"],
+        f"final_j{jobs}": ["-j", jobs],
+        "fast": ["-p", "fast", "-j", jobs],
+        "preview": ["-p", "preview", "-j", jobs],
+        "renditions": ["--renditions", "final,720p", "-j", jobs],
+        "no_copy": ["--no-copy", "-j", jobs],
+        # 每次运行都清空输出目录，测到的是含首次分析的耗时
+        "smart_crop": ["--crop", "smart", "-j", jobs],
+    }
+
+
+def generate_clip(spec: ClipSpec, fixture_dir: Path) -> Path:
+    """合成一个测试片段；文件名包含全部参数，已存在则复用。"""
+    path = fixture_dir / spec.name
+    if path.exists():
+        return path
+    fixture_dir.mkdir(parents=True, exist_ok=True)
+    tmp_path = path.with_name(path.name + ".part")
+    cmd = [
+        "ffmpeg",
+        "-y",
+        "-v",
+        "error",
+        "-f",
+        "lavfi",
+        "-i",
+        f"testsrc=size={spec.width}x{spec.height}:rate={spec.fps}:duration={spec.duration:g}",
+    ]
+    if spec.audio:
+        cmd += ["-f", "lavfi", "-i", f"sine=frequency=440:sample_rate=48000:duration={spec.duration:g}"]
+    cmd += ["-c:v", "libx264", "-preset", "ultrafast", "-crf", "23", "-pix_fmt", "yuv420p", "-g", str(spec.fps * 2)]
+    if spec.audio:
+        cmd += ["-c:a", "aac", "-b:a", "128k", "-shortest"]
+    cmd += ["-f", "mp4", str(tmp_path)]
+    subprocess.run(cmd, check=True, text=True, capture_output=True)
+    os.replace(tmp_path, path)
+    return path
+
+
+def check_crop_paths(frames: int = 96, seed: int = 7) -> list[str]:
+    """智能裁剪分析的 numpy 与纯 Python 路径在同一批帧上必须逐位一致；返回不一致的项，未装 numpy 时为空。"""
+    if process_videos.np is None:
+        return []
+    frame_size = process_videos.ANALYSIS_WIDTH * process_videos.ANALYSIS_HEIGHT
+    rng = random.Random(seed)
+    # 随机噪声帧里夹一段全黑帧，覆盖无信号（None）的情况
+    batch = bytes(rng.randrange(256) for _ in range(frame_size * (frames - 8))) + bytes(frame_size * 8)
+    scores_np, _ = process_videos.column_scores_numpy(batch, None)
+    scores_py, _ = process_videos.column_scores_python(batch, None)
+    mismatches = []
+    if scores_np.tolist() != scores_py:
+        mismatches.append("column_scores")
+    for window_cols in (1, 31, 51, process_videos.ANALYSIS_WIDTH):
+        fast = process_videos.best_window_centers_numpy(scores_np, window_cols)
+        slow = [process_videos.best_window_center(column, window_cols) for column in scores_py]
+        if fast != slow:
+            mismatches.append(f"best_window_center(window_cols={window_cols})")
+    return mismatches
+
+
+def read_run_record(metrics_log: Path) -> dict:
+    records = [json.loads(line) for line in metrics_log.read_text(encoding="utf-8").splitlines() if line.strip()]
+    runs = [r for r in records if r.get("event") == "run"]
+    if not runs:
+        raise RuntimeError(f"指标日志中没有 run 记录: {metrics_log}")
+    return runs[-1]
+
+
+def run_scenario(fixture_dir: Path, work_dir: Path, extra_args: list[str], source_seconds: float) -> dict:
+    output_dir = work_dir / "output"
+    shutil.rmtree(output_dir, ignore_errors=True)
+    metrics_log = output_dir / METRICS_LOG_NAME
+    cmd = [
+        sys.executable,
+        str(SCRIPT_DIR / "process_videos.py"),
+        str(fixture_dir),
+        "-o",
+        str(output_dir),
+        "--force",
+        "--progress-interval",
+        "0",
+        "--metrics-log",
+        str(metrics_log),
+        *extra_args,
+    ]
+    started = time.perf_counter()
+    subprocess.run(cmd, check=True, text=True, capture_output=True)
+    wall = time.perf_counter() - started
+    record = read_run_record(metrics_log)
+    return {
+        "seconds": wall,
+        "files_per_minute": record["jobs_total"] / wall * 60,
+        # 源时长 / 墙钟时间：每秒墙钟处理多少秒素材
+        "realtime_factor": source_seconds / wall,
+        # ffmpeg 报告的输出时长 / 编码耗时（不含探测与进程启动）
+        "output_speed": record["speed"],
+        "fps": record["fps"],
+        "bytes": record["bytes"],
+        "jobs_failed": record["jobs_failed"],
+    }
+
+
+def median_result(runs: list[dict]) -> dict:
+    out = {name: round(statistics.median(r[name] for r in runs), 4) for name in runs[0]}
+    out["runs"] = [round(r["seconds"], 4) for r in runs]
+    return out
+
+
+def environment() -> dict:
+    def output(cmd: list[str]) -> str:
+        try:
+            return subprocess.run(cmd, cwd=SCRIPT_DIR, text=True, capture_output=True).stdout.strip()
+        except OSError:
+            return ""
+
+    return {
+        "commit": output(["git", "rev-parse", "HEAD"]) or None,
+        "dirty": bool(output(["git", "status", "--porcelain", "--", "process_videos.py"])),
+        "created_at": dt.datetime.now(dt.timezone.utc).isoformat(),
+        "host": platform.node(),
+        "platform": platform.platform(),
+        "python": platform.python_version(),
+        "cpu_count": os.cpu_count(),
+        "ffmpeg": output(["ffmpeg", "-version"]).splitlines()[0] if shutil.which("ffmpeg") else None,
+    }
+
+
+def compare(report: dict, baseline: dict, max_regression: float) -> list[str]:
+    """逐场景对比墙钟耗时，返回超出允许回退幅度的场景。"""
+    regressions = []
+    old = baseline.get("results", {})
+    print(f"{'场景':24} {'基线 s':>10} {'当前 s':>10} {'比值':>7} {'文件/分':>9}")
+    for name, cur in sorted(report["results"].items()):
+        if name not in old:
+            print(f"{name:24} {'-':>10} {cur['seconds']:10.2f} {'新增':>7} {cur['files_per_minute']:9.2f}")
+            continue
+        ratio = cur["seconds"] / max(old[name]["seconds"], 1e-9)
+        flag = ""
+        if ratio > 1 + max_regression:
+            regressions.append(name)
+            flag = "  << 变慢"
+        print(f"{name:24} {old[name]['seconds']:10.2f} {cur['seconds']:10.2f} {ratio:7.2f} {cur['files_per_minute']:9.2f}{flag}")
+    if baseline.get("scale") != report.get("scale"):
+        print(f"注意: 基线规模 {baseline.get('scale')} 与当前 {report.get('scale')} 不同")
+    return regressions
+
+
+def main() -> int:
+    parser = argparse.ArgumentParser(description="合成测试片段并测量 process_videos.py 的吞吐，输出 JSON 报告")
+    parser.add_argument("--scale", choices=sorted(SCALES), default="small", help="片段矩阵规模，默认 small")
+    parser.add_argument("--scenarios", help="逗号分隔的场景子集，默认全部：" + ",".join(default_scenarios()))
+    parser.add_argument("--repeat", type=int, default=3, help="每个场景运行次数，报告取中位数，默认 3")
+    parser.add_argument(
+        "--work-dir", default=str(Path(tempfile.gettempdir()) / "video-bench"), help="合成片段（复用）与临时输出目录"
+    )
+    parser.add_argument("--report", default="benchmark_videos.json", help="报告路径，默认 ./benchmark_videos.json")
+    parser.add_argument("--compare", help="与之对比的基线报告")
+    parser.add_argument("--max-regression", type=float, default=0.2, help="配合 --compare：任一场景变慢超过该比例则退出码为 1")
+    args = parser.parse_args()
+
+    mismatches = check_crop_paths()
+    if mismatches:
+        print(f"智能裁剪分析 numpy 与纯 Python 结果不一致: {', '.join(mismatches)}", file=sys.stderr)
+        return 1
+
+    try:
+        ensure_ffmpeg_tools()
+    except EnvironmentError as exc:
+        print(str(exc), file=sys.stderr)
+        return 1
+
+    scenarios = default_scenarios()
+    if args.scenarios:
+        names = [s.strip() for s in args.scenarios.split(",") if s.strip()]
+        unknown = set(names) - scenarios.keys()
+        if unknown:
+            print(f"未知场景: {', '.join(sorted(unknown))}（可选: {', '.join(scenarios)}）", file=sys.stderr)
+            return 1
+        scenarios = {name: scenarios[name] for name in names}
+
+    work_dir = Path(args.work_dir).resolve()
+    fixture_dir = work_dir / "fixtures" / args.scale
+    specs = SCALES[args.scale]
+    fixtures = []
+    started = time.perf_counter()
+    for spec in specs:
+        path = generate_clip(spec, fixture_dir)
+        fixtures.append({**asdict(spec), "file": spec.name, "bytes": path.stat().st_size})
+    source_seconds = sum(float(ffprobe_metadata(fixture_dir / spec.name)["format"]["duration"]) for spec in specs)
+    print(f"测试片段: {len(specs)} 个，总时长 {source_seconds:.1f}s（准备耗时 {time.perf_counter() - started:.1f}s）")
+
+    results: dict[str, dict] = {}
+    for name, extra_args in scenarios.items():
+        runs = [run_scenario(fixture_dir, work_dir, extra_args, source_seconds) for _ in range(max(1, args.repeat))]
+        results[name] = {"args": extra_args, **median_result(runs)}
+        print(
+            f"  - {name}: {results[name]['seconds']:.2f}s，{results[name]['files_per_minute']:.2f} 文件/分，"
+            f"{results[name]['realtime_factor']:.2f}x 实时"
+        )
+    shutil.rmtree(work_dir / "output", ignore_errors=True)
+
+    report = {
+        "version": REPORT_VERSION,
+        "suite": "video",
+        "scale": args.scale,
+        "repeat": args.repeat,
+        "environment": environment(),
+        "fixtures": fixtures,
+        "source_seconds": round(source_seconds, 3),
+        "results": results,
+    }
+    write_json_atomic(Path(args.report), report)
+    print(f"报告已写入: {args.report}")
+    if args.compare:
+        baseline = json.loads(Path(args.compare).read_text(encoding="utf-8"))
+        if compare(report, baseline, args.max_regression):
+            return 1
+    return 0
+
+
+if __name__ == "__main__":
+    raise SystemExit(main())
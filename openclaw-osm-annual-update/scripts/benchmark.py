@@ -0,0 +1,381 @@
+#!/usr/bin/env python3
+"""Throughput benchmarks for the OSM pipeline on synthetic inputs; writes a JSON report comparable across commits."""
+from __future__ import annotations
+
+import argparse
+import datetime as dt
+import hashlib
+import json
+import os
+import platform
+import random
+import shutil
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+from pathlib import Path
+from typing import Any, Callable, Dict, List, Optional
+
+from collect_changesets import changesets_table
+from columnar import ColumnTable
+from common import HttpClient, PackedGeometry, geometry_bbox, polygon_hash, write_json
+from metrics import PARTIALS_DIR, incremental_changeset_metrics
+from parse_osmchange import aggregate_downloads
+from polygon_index import PolygonIndex
+from render_bbox_map import render_local
+from run_pipeline import (
+    SCRIPTS_DIR,
+    add_pipeline_args,
+    render_stage,
+    resolve_stage,
+    stage_commands,
+    write_outputs,
+)
+from synthetic import CENTER, RADIUS_DEG, Fixture, StubOsmServer, star_polygon, synthetic_changesets
+
+try:
+    import numpy as np
+except ImportError:  # optional: recorded in the report, the pipeline falls back to pure Python
+    np = None
+
+REPORT_VERSION = 1
+SUITES = ("geometry", "metrics", "parse", "pipeline", "rerun")
+# Input sizes per scale; "small" finishes in seconds and is meant for quick before/after checks
+SCALES: Dict[str, Dict[str, int]] = {
+    "small": {"changesets": 300, "elements": 100, "vertices": 20_000, "points": 50_000, "rows": 50_000},
+    "medium": {"changesets": 2_000, "elements": 200, "vertices": 200_000, "points": 200_000, "rows": 300_000},
+    "large": {"changesets": 10_000, "elements": 500, "vertices": 1_000_000, "points": 1_000_000, "rows": 2_000_000},
+}
+
+
+def measure(fn: Callable[[], Any], repeat: int) -> Dict[str, Any]:
+    runs = []
+    for _ in range(repeat):
+        started = time.perf_counter()
+        fn()
+        runs.append(time.perf_counter() - started)
+    return {"seconds": statistics.median(runs), "runs": [round(r, 6) for r in runs]}
+
+
+def result(timing: Dict[str, Any], items: Optional[float] = None, unit: Optional[str] = None, **extra: Any) -> Dict[str, Any]:
+    out = {"seconds": round(timing["seconds"], 6), "runs": timing["runs"]}
+    if items is not None:
+        out.update({"items": items, "unit": unit, "per_second": round(items / max(timing["seconds"], 1e-9), 3)})
+    out.update(extra)
+    return out
+
+
+def check_geometry(geometry: Dict[str, Any], packed: PackedGeometry) -> None:
+    """Fail fast if the streaming bbox/hash disagree with the plain versions; timings of wrong code are worthless."""
+    cases = [
+        ({"type": "Point", "coordinates": [113.5, 22.1]}, (113.5, 22.1, 113.5, 22.1)),
+        ({"type": "LineString", "coordinates": [[113.5, 22.1], [113.6, 22.0]]}, (113.5, 22.0, 113.6, 22.1)),
+        ({"type": "MultiPoint", "coordinates": [[1, 2], [-3, 4]]}, (-3.0, 2.0, 1.0, 4.0)),
+        (geometry, packed.bbox()),
+    ]
+    for case, expected in cases:
+        got = geometry_bbox(case)
+        if got != expected:
+            raise RuntimeError(f"geometry_bbox({case['type']}) = {got}, expected {expected}")
+        raw = json.dumps(case, sort_keys=True, ensure_ascii=False).encode("utf-8")
+        if polygon_hash(case) != hashlib.sha256(raw).hexdigest()[:16]:
+            raise RuntimeError(f"polygon_hash({case['type']}) differs from the hash of the full JSON dump")
+
+
+def bench_geometry(scale: Dict[str, int], repeat: int, work_dir: Path) -> Dict[str, Any]:
+    geometry = star_polygon(scale["vertices"])
+    vertices = sum(len(ring) for ring in geometry["coordinates"])
+    packed = PackedGeometry.from_geometry(geometry)
+    check_geometry(geometry, packed)
+    rng = random.Random(7)
+    lons = [CENTER[0] + (rng.random() * 2 - 1) * RADIUS_DEG for _ in range(scale["points"])]
+    lats = [CENTER[1] + (rng.random() * 2 - 1) * RADIUS_DEG for _ in range(scale["points"])]
+    index = PolygonIndex(geometry)
+    region = {"bbox": {"final": list(geometry_bbox(geometry))}, "geometry": geometry, "polygon_hash": None}
+    out_png = work_dir / "render.png"
+    return {
+        "geometry.polygon_hash": result(measure(lambda: polygon_hash(geometry), repeat), vertices, "vertices"),
+        "geometry.bbox": result(measure(lambda: geometry_bbox(geometry), repeat), vertices, "vertices"),
+        "geometry.pack": result(measure(lambda: PackedGeometry.from_geometry(geometry), repeat), vertices, "vertices"),
+        "geometry.area": result(measure(packed.area_km2, repeat), vertices, "vertices"),
+        "geometry.simplify": result(measure(lambda: packed.simplify(1e-5), repeat), vertices, "vertices"),
+        "geometry.index_build": result(measure(lambda: PolygonIndex(geometry), repeat), vertices, "vertices"),
+        "geometry.contains_many": result(
+            measure(lambda: index.contains_many(lons, lats), repeat), scale["points"], "points"
+        ),
+        "geometry.render_local": result(measure(lambda: render_local(region, out_png), repeat), vertices, "vertices"),
+    }
+
+
+def bench_metrics(scale: Dict[str, int], repeat: int, work_dir: Path) -> Dict[str, Any]:
+    year = 2025
+    lon0, lat0 = CENTER
+    bbox = (lon0 - RADIUS_DEG, lat0 - RADIUS_DEG, lon0 + RADIUS_DEG, lat0 + RADIUS_DEG)
+    rows = synthetic_changesets(scale["rows"], year, bbox, users=max(100, scale["rows"] // 50))
+    table = changesets_table(rows)
+    col_dir = work_dir / "changesets.col"
+    table.save(col_dir)
+    n = len(rows)
+    # The summary's path: cold = every month regrouped (first run, --full), warm = all months reused
+    base_dir = work_dir / "metrics"
+    partials = base_dir / "stats" / PARTIALS_DIR / "changesets.json"
+
+    def cold() -> Dict[str, Any]:
+        if partials.exists():
+            partials.unlink()
+        return incremental_changeset_metrics(base_dir, table, year)
+
+    reference = cold()
+    warm = incremental_changeset_metrics(base_dir, table, year)
+    if warm["incremental"]["months_recomputed"] or {**warm, "incremental": None} != {**reference, "incremental": None}:
+        raise RuntimeError("warm changeset metrics differ from the cold run")
+    return {
+        "metrics.table_build": result(measure(lambda: changesets_table(rows), repeat), n, "changesets"),
+        "metrics.table_save": result(measure(lambda: table.save(col_dir), repeat), n, "changesets"),
+        "metrics.table_load": result(measure(lambda: ColumnTable.load(col_dir), repeat), n, "changesets"),
+        "metrics.changesets_cold": result(measure(cold, repeat), n, "changesets"),
+        "metrics.changesets_warm": result(
+            measure(lambda: incremental_changeset_metrics(base_dir, table, year), repeat), n, "changesets"
+        ),
+    }
+
+
+def bench_parse(fixture: Fixture, repeat: int, workers: int) -> Dict[str, Any]:
+    ids = [row["id"] for row in fixture.rows]
+    elements = {"count": 0}
+
+    def run() -> None:
+        features, _ = aggregate_downloads(fixture.osc_dir, ids, workers)
+        elements["count"] = sum(sum(actions.values()) for actions in features["FEAT_EDIT_total"].values())
+
+    timing = measure(run, repeat)
+    return {
+        "parse.aggregate_downloads": result(
+            timing, elements["count"], "elements", mb_per_second=round(fixture.osc_bytes() / 1e6 / timing["seconds"], 3)
+        )
+    }
+
+
+def pipeline_args(out_dir: Path, base_url: str, workers: int) -> argparse.Namespace:
+    parser = argparse.ArgumentParser()
+    add_pipeline_args(parser)
+    return parser.parse_args(
+        [
+            "--out-dir", str(out_dir),
+            "--nominatim-base", base_url,
+            "--osm-api-base", base_url,
+            "--workers", str(workers),
+            "--rate", "0",
+            "--map-backend", "local",
+        ]
+    )  # fmt: skip
+
+
+def run_pipeline_timed(args: argparse.Namespace, year: int) -> Dict[str, float]:
+    """One run_pipeline.py pass for the "bench" region, seconds per stage."""
+    seconds: Dict[str, float] = {}
+    base_dir = Path(args.out_dir) / "bench" / str(year)
+    started = time.perf_counter()
+    region = resolve_stage(args, "bench", year, client=HttpClient())
+    seconds["resolve"] = time.perf_counter() - started
+    started = time.perf_counter()
+    render_stage(args, region, base_dir)
+    seconds["render"] = time.perf_counter() - started
+    for name, cmd in stage_commands(args, base_dir, year):
+        started = time.perf_counter()
+        proc = subprocess.run(cmd, text=True, capture_output=True)
+        if proc.returncode != 0:
+            raise RuntimeError(f"stage {name} failed:\n{proc.stderr}")
+        seconds[name] = time.perf_counter() - started
+    started = time.perf_counter()
+    write_outputs(base_dir, "bench", year, args.timezone, args.granularity, region)
+    seconds["summary"] = time.perf_counter() - started
+    return seconds
+
+
+def bench_pipeline(fixture: Fixture, repeat: int, work_dir: Path, workers: int) -> Dict[str, Any]:
+    """End to end against the stub API with no rate limit; each stage is timed separately, node cache cold."""
+    stage_runs: Dict[str, List[float]] = {}
+    requests: Dict[str, int] = {}
+    with StubOsmServer(fixture) as stub:
+        for run in range(repeat):
+            out_dir = work_dir / f"pipeline{run}"
+            shutil.rmtree(out_dir, ignore_errors=True)
+            for name, seconds in run_pipeline_timed(pipeline_args(out_dir, stub.base_url, workers), fixture.year).items():
+                stage_runs.setdefault(name, []).append(seconds)
+        requests = dict(stub.requests)
+
+    results = {}
+    total = [sum(runs[i] for runs in stage_runs.values()) for i in range(repeat)]
+    n = len(fixture.rows)
+    results["pipeline.total"] = result(
+        {"seconds": statistics.median(total), "runs": [round(t, 6) for t in total]},
+        n,
+        "changesets",
+        requests={k: v // repeat for k, v in requests.items()},
+    )
+    for name, runs in stage_runs.items():
+        timing = {"seconds": statistics.median(runs), "runs": [round(r, 6) for r in runs]}
+        results[f"pipeline.{name}"] = result(timing, n, "changesets")
+    return results
+
+
+def bench_rerun(scale: Dict[str, int], work_dir: Path, workers: int) -> Dict[str, Any]:
+    """Daily update of the current year: run, add one changeset, run again in the same out dir.
+
+    Checks the incremental path: the second run must recompute only the new changeset's month.
+    """
+    now = dt.datetime.now(dt.timezone.utc)
+    fixture = Fixture(
+        work_dir / "fixtures", year=now.year, changesets=scale["changesets"], elements=scale["elements"], vertices=scale["vertices"]
+    )
+    # Nothing can have been created after "now"
+    cutoff = (now - dt.timedelta(hours=1)).strftime("%Y-%m-%dT%H:%M:%SZ")
+    fixture.rows = [row for row in fixture.rows if row["created_at"] < cutoff]
+    fixture.ensure()
+    out_dir = work_dir / "rerun"
+    shutil.rmtree(out_dir, ignore_errors=True)
+    with StubOsmServer(fixture) as stub:
+        args = pipeline_args(out_dir, stub.base_url, workers)
+        first = run_pipeline_timed(args, fixture.year)
+        new_row = fixture.add_changeset((now - dt.timedelta(minutes=10)).strftime("%Y-%m-%dT%H:%M:%SZ"))
+        stub.refresh()
+        before = dict(stub.requests)
+        second = run_pipeline_timed(args, fixture.year)
+        requests = {k: v - before.get(k, 0) for k, v in stub.requests.items()}
+
+    summary = json.loads((out_dir / "bench" / str(fixture.year) / "stats" / "summary.json").read_text(encoding="utf-8"))
+    incremental = summary["quality"]["incremental"]
+    month = new_row["created_at"][:7]
+    if incremental["changesets"]["months_recomputed"] != [month] or set(incremental["roads"]["months_recomputed"]) - {month}:
+        raise RuntimeError(f"rerun after one new changeset in {month} recomputed {incremental}")
+    n = len(fixture.rows)
+    return {
+        "rerun.first": result({"seconds": sum(first.values()), "runs": [round(sum(first.values()), 6)]}, n, "changesets"),
+        "rerun.second": result(
+            {"seconds": sum(second.values()), "runs": [round(sum(second.values()), 6)]},
+            n,
+            "changesets",
+            stages={k: round(v, 6) for k, v in second.items()},
+            requests=requests,
+            incremental=incremental,
+        ),
+    }
+
+
+def environment() -> Dict[str, Any]:
+    def git(*cmd: str) -> str:
+        try:
+            return subprocess.run(["git", *cmd], cwd=SCRIPTS_DIR, text=True, capture_output=True).stdout.strip()
+        except OSError:
+            return ""
+
+    return {
+        "commit": git("rev-parse", "HEAD") or None,
+        "dirty": bool(git("status", "--porcelain", "--", ".")),
+        "created_at": dt.datetime.utcnow().isoformat() + "Z",
+        "host": platform.node(),
+        "platform": platform.platform(),
+        "python": platform.python_version(),
+        "cpu_count": os.cpu_count(),
+        "numpy": np.__version__ if np is not None else None,
+    }
+
+
+def compare(report: Dict[str, Any], baseline: Dict[str, Any], max_regression: float, min_seconds: float = 0.0) -> List[str]:
+    """Print seconds per benchmark against a baseline report; returns the names slower than allowed.
+
+    Benchmarks faster than ``min_seconds`` are shown but never flagged, their timings are mostly noise.
+    """
+    regressions = []
+    old = baseline.get("results", {})
+    print(f"{'benchmark':36} {'baseline s':>12} {'current s':>12} {'ratio':>8}")
+    for name, cur in sorted(report["results"].items()):
+        if name not in old:
+            print(f"{name:36} {'-':>12} {cur['seconds']:12.4f} {'new':>8}")
+            continue
+        ratio = cur["seconds"] / max(old[name]["seconds"], 1e-9)
+        flag = ""
+        if ratio > 1 + max_regression and cur["seconds"] >= min_seconds:
+            regressions.append(name)
+            flag = "  << slower"
+        print(f"{name:36} {old[name]['seconds']:12.4f} {cur['seconds']:12.4f} {ratio:8.2f}{flag}")
+    if baseline.get("scale") != report.get("scale"):
+        print(f"warning: baseline scale {baseline.get('scale')} != current {report.get('scale')}")
+    return regressions
+
+
+def main() -> int:
+    parser = argparse.ArgumentParser(description="Benchmark the OSM pipeline on synthetic fixtures")
+    parser.add_argument("--suites", default=",".join(SUITES), help=f"comma-separated subset of {','.join(SUITES)}")
+    parser.add_argument("--scale", choices=sorted(SCALES), default="small")
+    parser.add_argument("--repeat", type=int, default=3, help="runs per benchmark; the median is reported")
+    parser.add_argument("--workers", type=int, default=4)
+    parser.add_argument(
+        "--work-dir", default=str(Path(tempfile.gettempdir()) / "osm-bench"), help="fixtures (reused) and scratch outputs"
+    )
+    parser.add_argument("--report", default="benchmark_report.json")
+    parser.add_argument("--compare", default=None, help="baseline report to compare against")
+    parser.add_argument(
+        "--max-regression",
+        type=float,
+        default=0.2,
+        help="with --compare: exit 1 if any benchmark is slower than the baseline by more than this fraction",
+    )
+    parser.add_argument("--min-seconds", type=float, default=0.01, help="with --compare: never flag benchmarks faster than this")
+    args = parser.parse_args()
+
+    suites = [s.strip() for s in args.suites.split(",") if s.strip()]
+    unknown = set(suites) - set(SUITES)
+    if unknown:
+        parser.error(f"unknown suites: {', '.join(sorted(unknown))}")
+    scale = SCALES[args.scale]
+    work_dir = Path(args.work_dir)
+    scratch = work_dir / "scratch"
+    shutil.rmtree(scratch, ignore_errors=True)
+    scratch.mkdir(parents=True)
+
+    fixture = None
+    if {"parse", "pipeline"} & set(suites):
+        fixture = Fixture(
+            work_dir / "fixtures", changesets=scale["changesets"], elements=scale["elements"], vertices=scale["vertices"]
+        ).ensure()
+
+    results: Dict[str, Any] = {}
+    for suite in suites:
+        started = time.perf_counter()
+        if suite == "geometry":
+            results.update(bench_geometry(scale, args.repeat, scratch))
+        elif suite == "metrics":
+            results.update(bench_metrics(scale, args.repeat, scratch))
+        elif suite == "parse":
+            results.update(bench_parse(fixture, args.repeat, args.workers))
+        elif suite == "pipeline":
+            results.update(bench_pipeline(fixture, args.repeat, scratch, args.workers))
+        elif suite == "rerun":
+            results.update(bench_rerun(scale, scratch, args.workers))
+        print(f"{suite}: {time.perf_counter() - started:.1f}s", file=sys.stderr)
+
+    report = {
+        "version": REPORT_VERSION,
+        "suite": "osm",
+        "scale": args.scale,
+        "sizes": scale,
+        "repeat": args.repeat,
+        "workers": args.workers,
+        "environment": environment(),
+        "results": results,
+    }
+    write_json(Path(args.report), report)
+    print(json.dumps({"status": "ok", "report": args.report, "benchmarks": len(results)}, ensure_ascii=False))
+    if args.compare:
+        baseline = json.loads(Path(args.compare).read_text(encoding="utf-8"))
+        if compare(report, baseline, args.max_regression, args.min_seconds):
+            return 1
+    return 0
+
+
+if __name__ == "__main__":
+    raise SystemExit(main())
@@ -0,0 +1,361 @@
+#!/usr/bin/env python3
+from __future__ import annotations
+
+import argparse
+import csv
+import datetime as dt
+import json
+import math
+import threading
+import xml.etree.ElementTree as ET
+from concurrent.futures import FIRST_COMPLETED, Future, ThreadPoolExecutor, wait
+from pathlib import Path
+from typing import Any, Dict, Iterable, List, Optional, Tuple
+
+from columnar import DICT, ColumnTable
+from common import HttpClient, append_log, update_quality
+from polygon_index import bbox_centroids, region_index
+
+API_LIMIT = 100
+MIN_WINDOW_SECONDS = 1
+# A window is only checkpointed as final once it ended this long before it was fetched: changesets
+# stay open for up to 24h, so younger windows (the current month, future months) are queried again
+SETTLE_SECONDS = 24 * 3600
+CSV_FIELDS = [
+    "id",
+    "created_at",
+    "closed_at",
+    "uid",
+    "user",
+    "changes_count",
+    "comments_count",
+    "min_lon",
+    "min_lat",
+    "max_lon",
+    "max_lat",
+    "created_by",
+    "in_region",
+]
+
+# Columnar layout of raw/changesets.col; times are epoch seconds (-1 = unset), bbox is NaN when absent
+CHANGESET_SCHEMA = {
+    "id": "q",
+    "created_at": "q",
+    "closed_at": "q",
+    "month": DICT,
+    "uid": "q",
+    "user": DICT,
+    "changes_count": "q",
+    "comments_count": "q",
+    "min_lon": "d",
+    "min_lat": "d",
+    "max_lon": "d",
+    "max_lat": "d",
+    "created_by": DICT,
+    "in_region": "b",
+}
+
+Window = Tuple[str, str]
+
+
+def iso(t: dt.datetime) -> str:
+    return t.strftime("%Y-%m-%dT%H:%M:%SZ")
+
+
+def parse_iso(value: str) -> dt.datetime:
+    return dt.datetime.strptime(value, "%Y-%m-%dT%H:%M:%SZ").replace(tzinfo=dt.timezone.utc)
+
+
+def month_windows(year: int) -> List[Window]:
+    windows = []
+    for m in range(1, 13):
+        start = dt.datetime(year, m, 1, tzinfo=dt.timezone.utc)
+        end = dt.datetime(year + (m == 12), m % 12 + 1, 1, tzinfo=dt.timezone.utc)
+        windows.append((iso(start), iso(end)))
+    return windows
+
+
+def split_window(window: Window) -> Optional[Tuple[Window, Window]]:
+    start, end = parse_iso(window[0]), parse_iso(window[1])
+    if (end - start).total_seconds() < 2 * MIN_WINDOW_SECONDS:
+        return None
+    mid = start + (end - start) / 2
+    mid = mid.replace(microsecond=0)
+    return (window[0], iso(mid)), (iso(mid), window[1])
+
+
+def parse_changesets(xml_bytes: bytes) -> List[Dict[str, Any]]:
+    rows = []
+    for cs in ET.fromstring(xml_bytes).iter("changeset"):
+        a = cs.attrib
+        tags = {t.get("k"): t.get("v") for t in cs.iter("tag")}
+        rows.append(
+            {
+                "id": int(a["id"]),
+                "created_at": a.get("created_at", ""),
+                "closed_at": a.get("closed_at", ""),
+                "uid": int(a.get("uid") or 0),
+                "user": a.get("user", ""),
+                "changes_count": int(a.get("changes_count") or 0),
+                "comments_count": int(a.get("comments_count") or 0),
+                "min_lon": a.get("min_lon", ""),
+                "min_lat": a.get("min_lat", ""),
+                "max_lon": a.get("max_lon", ""),
+                "max_lat": a.get("max_lat", ""),
+                "created_by": tags.get("created_by", ""),
+            }
+        )
+    return rows
+
+
+def window_settled(window: Window, fetched_at: Optional[str]) -> bool:
+    if not fetched_at:
+        return False
+    return (parse_iso(fetched_at) - parse_iso(window[1])).total_seconds() >= SETTLE_SECONDS
+
+
+class WindowCheckpoint:
+    """Append-only JSONL of finished windows: leaf windows keep their rows, bisected windows are marked split.
+
+    Each leaf records when it was fetched; windows that were not yet settled then (see SETTLE_SECONDS)
+    are not served from the checkpoint, so re-runs pick up new and still-open changesets.
+    """
+
+    def __init__(self, path: Path) -> None:
+        self.path = path
+        self.done: Dict[Window, List[Dict[str, Any]]] = {}
+        self.split: set = set()
+        self._lock = threading.Lock()
+        if path.exists():
+            with path.open("r", encoding="utf-8") as f:
+                for line in f:
+                    try:
+                        rec = json.loads(line)
+                    except ValueError:
+                        # An interrupted write leaves at most one partial trailing line
+                        continue
+                    window = tuple(rec["window"])
+                    if rec["status"] == "split":
+                        self.split.add(window)
+                    elif window_settled(window, rec.get("fetched_at")):
+                        self.done[window] = rec["rows"]
+
+    def _append(self, rec: Dict[str, Any]) -> None:
+        with self._lock:
+            self.path.parent.mkdir(parents=True, exist_ok=True)
+            with self.path.open("a", encoding="utf-8") as f:
+                f.write(json.dumps(rec, ensure_ascii=False) + "\n")
+
+    def mark_done(self, window: Window, rows: List[Dict[str, Any]], fetched_at: str) -> None:
+        self._append({"window": list(window), "status": "done", "fetched_at": fetched_at, "rows": rows})
+
+    def mark_split(self, window: Window) -> None:
+        self._append({"window": list(window), "status": "split"})
+
+
+def collect_changesets(
+    api_base: str,
+    bbox: List[float],
+    windows: List[Window],
+    checkpoint: WindowCheckpoint,
+    workers: int = 4,
+    limit: int = API_LIMIT,
+    log_path: Optional[Path] = None,
+    client: Optional[HttpClient] = None,
+) -> Tuple[List[Dict[str, Any]], Dict[str, List[Any]]]:
+    client = client or HttpClient()
+    quality: Dict[str, List[Any]] = {"truncation_windows": [], "api_errors": [], "retries": client.retries, "partial_failures": []}
+    bbox_param = ",".join(str(v) for v in bbox)
+    url = f"{api_base}/api/0.6/changesets"
+
+    def fetch(window: Window) -> Tuple[List[Dict[str, Any]], str]:
+        params = {"bbox": bbox_param, "from": window[0], "to": window[1], "order": "newest", "limit": limit}
+        # Taken before the request: anything closing after this instant is not in the response
+        fetched_at = iso(dt.datetime.now(dt.timezone.utc))
+        return parse_changesets(client.get(url, params)), fetched_at
+
+    rows_by_id: Dict[int, Dict[str, Any]] = {}
+    with ThreadPoolExecutor(max_workers=max(1, workers)) as pool:
+        pending: Dict[Future, Window] = {}
+
+        def schedule(window: Window) -> None:
+            if window in checkpoint.split:
+                halves = split_window(window)
+                if halves:
+                    quality["truncation_windows"].append({"window": list(window), "bisected": True, "resumed": True})
+                    for half in halves:
+                        schedule(half)
+                    return
+            if window in checkpoint.done:
+                for row in checkpoint.done[window]:
+                    rows_by_id[row["id"]] = row
+                return
+            pending[pool.submit(fetch, window)] = window
+
+        for window in windows:
+            schedule(window)
+
+        while pending:
+            finished, _ = wait(list(pending), return_when=FIRST_COMPLETED)
+            for future in finished:
+                window = pending.pop(future)
+                try:
+                    rows, fetched_at = future.result()
+                except Exception as exc:  # noqa: BLE001
+                    quality["api_errors"].append({"window": list(window), "error": str(exc)})
+                    quality["partial_failures"].append({"stage": "changesets", "window": list(window)})
+                    continue
+
+                if len(rows) >= limit:
+                    halves = split_window(window)
+                    quality["truncation_windows"].append({"window": list(window), "count": len(rows), "bisected": bool(halves)})
+                    if halves:
+                        checkpoint.mark_split(window)
+                        checkpoint.split.add(window)
+                        for half in halves:
+                            schedule(half)
+                        continue
+                    # Cannot bisect any further: keep what the API returned and flag it
+                    quality["partial_failures"].append({"stage": "changesets", "window": list(window), "reason": "limit"})
+
+                checkpoint.mark_done(window, rows, fetched_at)
+                for row in rows:
+                    rows_by_id[row["id"]] = row
+                if log_path:
+                    append_log(log_path, f"changesets window {window[0]}..{window[1]}: {len(rows)}")
+
+    rows = sorted(rows_by_id.values(), key=lambda r: (r["created_at"], r["id"]))
+    return rows, quality
+
+
+def write_changesets_csv(path: Path, rows: List[Dict[str, Any]]) -> None:
+    path.parent.mkdir(parents=True, exist_ok=True)
+    with path.open("w", encoding="utf-8", newline="") as f:
+        writer = csv.DictWriter(f, fieldnames=CSV_FIELDS)
+        writer.writeheader()
+        writer.writerows(rows)
+
+
+def read_changesets_csv(path: Path) -> List[Dict[str, Any]]:
+    if not path.exists() or path.stat().st_size == 0:
+        return []
+    with path.open("r", encoding="utf-8", newline="") as f:
+        rows = list(csv.DictReader(f))
+    for row in rows:
+        for key in ("id", "uid", "changes_count", "comments_count"):
+            row[key] = int(row[key] or 0)
+        # Older CSVs have no polygon test: treat every bbox hit as in-region
+        row["in_region"] = int(row.get("in_region") or 1)
+    return rows
+
+
+def epoch(value: str) -> int:
+    # fromisoformat is much faster than strptime; the API always sends "...Z" UTC stamps
+    if not value:
+        return -1
+    return int(dt.datetime.fromisoformat(value.rstrip("Z")).replace(tzinfo=dt.timezone.utc).timestamp())
+
+
+def changesets_table(rows: Iterable[Dict[str, Any]]) -> ColumnTable:
+    table = ColumnTable(CHANGESET_SCHEMA)
+    for row in rows:
+        created = row.get("created_at") or ""
+        table.append(
+            {
+                **row,
+                "created_at": epoch(created),
+                "closed_at": epoch(row.get("closed_at") or ""),
+                "month": created[:7],
+                "in_region": row.get("in_region", 1),
+            }
+        )
+    return table
+
+
+def table_rows(table: ColumnTable) -> List[Dict[str, Any]]:
+    # Export view: decode the columnar table back into the changesets.csv row layout
+    rows = []
+    for row in table.rows():
+        for key in ("created_at", "closed_at"):
+            row[key] = iso(dt.datetime.fromtimestamp(row[key], dt.timezone.utc)) if row[key] >= 0 else ""
+        for key in ("min_lon", "min_lat", "max_lon", "max_lat"):
+            row[key] = "" if math.isnan(row[key]) else repr(row[key])
+        del row["month"]
+        rows.append(row)
+    return rows
+
+
+def load_changesets_table(base_dir: Path) -> ColumnTable:
+    path = base_dir / "raw" / "changesets.col"
+    if ColumnTable.exists(path):
+        return ColumnTable.load(path)
+    # Runs from before the columnar store only have the CSV
+    return changesets_table(read_changesets_csv(base_dir / "raw" / "changesets.csv"))
+
+
+def mark_in_region(rows: List[Dict[str, Any]], region: Dict[str, Any]) -> int:
+    """Flag rows whose bbox centroid lies inside the region polygon; returns the in-region count."""
+    index = region_index(region)
+    if index is None:
+        for row in rows:
+            row["in_region"] = 1
+        return len(rows)
+    for row in rows:
+        row["in_region"] = 0
+    lons, lats, positions = bbox_centroids(rows)
+    for pos, inside in zip(positions, index.contains_many(lons, lats)):
+        rows[pos]["in_region"] = int(inside)
+    return sum(row["in_region"] for row in rows)
+
+
+def main() -> int:
+    parser = argparse.ArgumentParser(description="Collect changesets in the region bbox (Layer 1)")
+    parser.add_argument("--region-json", required=True)
+    parser.add_argument("--year", type=int, required=True)
+    parser.add_argument("--osm-api-base", default="https://api.openstreetmap.org")
+    parser.add_argument("--workers", type=int, default=4)
+    parser.add_argument("--limit", type=int, default=API_LIMIT)
+    parser.add_argument("--rate", type=float, default=2.0, help="max requests per second per host")
+    args = parser.parse_args()
+
+    region_path = Path(args.region_json)
+    base_dir = region_path.parent.parent
+    log_path = base_dir / "logs" / "run.log"
+
+    with region_path.open("r", encoding="utf-8") as f:
+        region = json.load(f)
+    bbox = [float(v) for v in region["bbox"]["final"]]
+
+    append_log(log_path, f"[{dt.datetime.utcnow().isoformat()}Z] start collect_changesets")
+    checkpoint = WindowCheckpoint(base_dir / "raw" / "changesets_windows.jsonl")
+    rows, quality = collect_changesets(
+        args.osm_api_base,
+        bbox,
+        month_windows(args.year),
+        checkpoint,
+        workers=args.workers,
+        limit=args.limit,
+        log_path=log_path,
+        client=HttpClient(rate=args.rate),
+    )
+
+    in_region = mark_in_region(rows, region)
+    changesets_table(rows).save(base_dir / "raw" / "changesets.col")
+    out_csv = base_dir / "raw" / "changesets.csv"
+    write_changesets_csv(out_csv, rows)
+    update_quality(base_dir, "changesets", quality)
+    append_log(
+        log_path,
+        f"[{dt.datetime.utcnow().isoformat()}Z] changesets.csv written: {len(rows)} rows ({in_region} in region polygon)",
+    )
+    print(
+        json.dumps(
+            {"status": "ok", "changesets_csv": str(out_csv), "count": len(rows), "in_region": in_region},
+            ensure_ascii=False,
+        )
+    )
+    return 0
+
+
+if __name__ == "__main__":
+    raise SystemExit(main())
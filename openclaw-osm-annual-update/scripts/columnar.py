@@ -0,0 +1,126 @@
+from __future__ import annotations
+
+import json
+import shutil
+import sys
+from array import array
+from pathlib import Path
+from typing import Any, Dict, Iterable, Iterator, List
+
+DICT = "dict"
+SCHEMA_FILE = "schema.json"
+# Tables written before integer columns were pinned to 64 bits used the platform-sized "l"
+LEGACY_TYPECODES = {"l": "q"}
+
+
+class ColumnTable:
+    """Append-only typed column store.
+
+    Numeric columns are ``array.array`` (one typecode each); string columns are dictionary-encoded
+    into int32 codes plus a value list. On disk a table is a directory: ``schema.json`` and one
+    raw ``<column>.bin`` per column, so loading is a straight ``fromfile`` with no text parsing.
+    Use fixed-size typecodes (``"q"`` not ``"l"``) so tables move between platforms; the header
+    records each column's item size and ``load`` refuses a table whose sizes do not match.
+    """
+
+    def __init__(self, schema: Dict[str, str]) -> None:
+        self.schema = dict(schema)
+        self.columns: Dict[str, array] = {}
+        self.dicts: Dict[str, List[str]] = {}
+        self._codes: Dict[str, Dict[str, int]] = {}
+        for name, kind in self.schema.items():
+            if kind == DICT:
+                self.columns[name] = array("i")
+                self.dicts[name] = []
+                self._codes[name] = {}
+            else:
+                self.columns[name] = array(kind)
+
+    def __len__(self) -> int:
+        first = next(iter(self.columns.values()), None)
+        return len(first) if first is not None else 0
+
+    def encode(self, name: str, value: Any) -> int:
+        text = "" if value is None else str(value)
+        codes = self._codes[name]
+        code = codes.get(text)
+        if code is None:
+            code = codes[text] = len(self.dicts[name])
+            self.dicts[name].append(text)
+        return code
+
+    def append(self, row: Dict[str, Any]) -> None:
+        for name, kind in self.schema.items():
+            value = row.get(name)
+            if kind == DICT:
+                self.columns[name].append(self.encode(name, value))
+            elif kind in "fd":
+                self.columns[name].append(float(value) if value not in (None, "") else float("nan"))
+            else:
+                self.columns[name].append(int(value or 0))
+
+    def extend(self, rows: Iterable[Dict[str, Any]]) -> "ColumnTable":
+        for row in rows:
+            self.append(row)
+        return self
+
+    def values(self, name: str) -> List[Any]:
+        if self.schema[name] == DICT:
+            lookup = self.dicts[name]
+            return [lookup[c] for c in self.columns[name]]
+        return self.columns[name].tolist()
+
+    def rows(self) -> Iterator[Dict[str, Any]]:
+        names = list(self.schema)
+        decoded = [self.values(n) for n in names]
+        for values in zip(*decoded):
+            yield dict(zip(names, values))
+
+    def save(self, path: Path) -> None:
+        # Build next to the target and swap in, so readers never see a half-written table
+        tmp = path.with_name(path.name + ".tmp")
+        if tmp.exists():
+            shutil.rmtree(tmp)
+        tmp.mkdir(parents=True)
+        for name, column in self.columns.items():
+            with (tmp / f"{name}.bin").open("wb") as f:
+                column.tofile(f)
+        meta = {
+            "byteorder": sys.byteorder,
+            "itemsizes": {name: column.itemsize for name, column in self.columns.items()},
+            "rows": len(self),
+            "schema": self.schema,
+            "dicts": self.dicts,
+        }
+        (tmp / SCHEMA_FILE).write_text(json.dumps(meta, ensure_ascii=False), encoding="utf-8")
+        if path.exists():
+            shutil.rmtree(path)
+        tmp.rename(path)
+
+    @classmethod
+    def load(cls, path: Path) -> "ColumnTable":
+        meta = json.loads((path / SCHEMA_FILE).read_text(encoding="utf-8"))
+        table = cls(meta["schema"])
+        itemsizes = meta.get("itemsizes", {})
+        for name, kind in meta["schema"].items():
+            column = table.columns[name]
+            if name in itemsizes and itemsizes[name] != column.itemsize:
+                raise ValueError(
+                    f"{path}: column {name!r} was written with {itemsizes[name]}-byte items, "
+                    f"this platform uses {column.itemsize}"
+                )
+            with (path / f"{name}.bin").open("rb") as f:
+                column.fromfile(f, meta["rows"])
+            if meta["byteorder"] != sys.byteorder:
+                column.byteswap()
+            if kind in LEGACY_TYPECODES:
+                table.schema[name] = LEGACY_TYPECODES[kind]
+                table.columns[name] = array(table.schema[name], column)
+        for name, values in meta["dicts"].items():
+            table.dicts[name] = values
+            table._codes[name] = {v: i for i, v in enumerate(values)}
+        return table
+
+    @staticmethod
+    def exists(path: Path) -> bool:
+        return (path / SCHEMA_FILE).exists()
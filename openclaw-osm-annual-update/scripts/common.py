@@ -1,10 +1,26 @@
 from __future__ import annotations
 
+import datetime as dt
+import email.utils
+import gzip
 import hashlib
+import http.client
 import json
+import math
+import os
 import re
+import threading
+import time
+import urllib.parse
+from array import array
 from pathlib import Path
-from typing import Any, Dict, Iterable, List, Tuple
+from typing import IO, Any, Callable, Dict, Iterable, Iterator, List, Optional, Sequence, Tuple
+
+USER_AGENT = "openclaw-osm-annual-update/1.0"
+RETRY_STATUS = {429, 500, 502, 503, 504}
+DEFAULT_CACHE_TTL = 30 * 86400
+DEFAULT_CACHE_MAX_ENTRIES = 5000
+EARTH_RADIUS_KM = 6371.0088
 
 
 def slugify_region(region_query: str) -> str:
@@ -27,23 +43,189 @@ def ensure_output_tree(base_dir: Path) -> Dict[str, Path]:
     return parts
 
 
+def is_position(item: Any) -> bool:
+    return (
+        isinstance(item, (list, tuple))
+        and len(item) >= 2
+        and isinstance(item[0], (int, float))
+        and isinstance(item[1], (int, float))
+    )
+
+
+def iter_positions(coordinates: Any) -> Iterator[Tuple[float, float]]:
+    """Yield every (lon, lat) of a GeoJSON coordinates tree, iteratively (no recursion, no copies)."""
+    # A Point's coordinates are the position itself
+    if is_position(coordinates):
+        yield float(coordinates[0]), float(coordinates[1])
+        return
+    stack = [iter(coordinates or [])]
+    while stack:
+        for item in stack[-1]:
+            if isinstance(item, (list, tuple)):
+                if is_position(item):
+                    yield float(item[0]), float(item[1])
+                else:
+                    stack.append(iter(item))
+                    break
+        else:
+            stack.pop()
+
+
 def geometry_bbox(geometry: Dict[str, Any]) -> Tuple[float, float, float, float]:
-    coords: List[Tuple[float, float]] = []
+    # Running min/max over the stream of positions
+    min_lon = min_lat = math.inf
+    max_lon = max_lat = -math.inf
+    for lon, lat in iter_positions(geometry.get("coordinates", [])):
+        if lon < min_lon:
+            min_lon = lon
+        if lon > max_lon:
+            max_lon = lon
+        if lat < min_lat:
+            min_lat = lat
+        if lat > max_lat:
+            max_lat = lat
+    if min_lon == math.inf:
+        raise ValueError("No coordinates in geometry")
+    return (min_lon, min_lat, max_lon, max_lat)
+
+
+class PackedGeometry:
+    """(Multi)Polygon packed into flat arrays.
+
+    ``coords`` holds interleaved lon, lat; ring i spans points ring_offsets[i]:ring_offsets[i + 1];
+    polygon j owns rings polygon_offsets[j]:polygon_offsets[j + 1], the first one being its shell.
+    """
+
+    def __init__(self) -> None:
+        self.coords = array("d")
+        self.ring_offsets = array("q", [0])
+        self.polygon_offsets = array("q", [0])
+
+    @classmethod
+    def from_geometry(cls, geometry: Dict[str, Any]) -> "PackedGeometry":
+        kind = geometry.get("type")
+        coordinates = geometry.get("coordinates") or []
+        if kind == "Polygon":
+            polygons = [coordinates]
+        elif kind == "MultiPolygon":
+            polygons = coordinates
+        else:
+            raise ValueError(f"Unsupported geometry type: {kind}")
+        packed = cls()
+        for polygon in polygons:
+            for ring in polygon:
+                packed.add_ring(iter_positions(ring))
+            packed.polygon_offsets.append(len(packed.ring_offsets) - 1)
+        return packed
+
+    def add_ring(self, points: Iterable[Tuple[float, float]]) -> None:
+        for lon, lat in points:
+            self.coords.append(lon)
+            self.coords.append(lat)
+        self.ring_offsets.append(len(self.coords) // 2)
+
+    @property
+    def num_points(self) -> int:
+        return len(self.coords) // 2
+
+    def ring(self, i: int) -> Tuple[array, array]:
+        start, end = self.ring_offsets[i] * 2, self.ring_offsets[i + 1] * 2
+        return self.coords[start:end:2], self.coords[start + 1 : end : 2]
+
+    def rings(self) -> Iterator[List[Tuple[float, float]]]:
+        for i in range(len(self.ring_offsets) - 1):
+            lons, lats = self.ring(i)
+            yield list(zip(lons, lats))
+
+    def bbox(self) -> Tuple[float, float, float, float]:
+        if not self.coords:
+            raise ValueError("No coordinates in geometry")
+        lons, lats = self.coords[0::2], self.coords[1::2]
+        return (min(lons), min(lats), max(lons), max(lats))
+
+    def ring_area_km2(self, i: int) -> float:
+        # Spherical excess of a lon/lat ring (Chamberlain & Duquette), unsigned
+        lons, lats = self.ring(i)
+        n = len(lons)
+        if n < 3:
+            return 0.0
+        total = 0.0
+        for k in range(n):
+            lon1, lat1 = lons[k - 1], lats[k - 1]
+            lon2, lat2 = lons[k], lats[k]
+            total += math.radians(lon2 - lon1) * (2 + math.sin(math.radians(lat1)) + math.sin(math.radians(lat2)))
+        return abs(total) * EARTH_RADIUS_KM**2 / 2
 
-    def walk(v: Any) -> None:
-        if isinstance(v, list):
-            if len(v) >= 2 and isinstance(v[0], (int, float)) and isinstance(v[1], (int, float)):
-                coords.append((float(v[0]), float(v[1])))
+    def area_km2(self) -> float:
+        area = 0.0
+        for j in range(len(self.polygon_offsets) - 1):
+            first, last = self.polygon_offsets[j], self.polygon_offsets[j + 1]
+            for i in range(first, last):
+                area += self.ring_area_km2(i) if i == first else -self.ring_area_km2(i)
+        return area
+
+    def simplify(self, tolerance: float) -> "PackedGeometry":
+        """Douglas-Peucker per ring (tolerance in degrees), with an explicit stack; rings keep >= 4 points."""
+        out = PackedGeometry()
+        for j in range(len(self.polygon_offsets) - 1):
+            for i in range(self.polygon_offsets[j], self.polygon_offsets[j + 1]):
+                lons, lats = self.ring(i)
+                keep = _douglas_peucker(lons, lats, tolerance)
+                if len(keep) < 4 and len(lons) >= 4:
+                    keep = sorted(set(keep) | {0, len(lons) // 3, 2 * len(lons) // 3, len(lons) - 1})
+                out.add_ring((lons[k], lats[k]) for k in keep)
+            out.polygon_offsets.append(len(out.ring_offsets) - 1)
+        return out
+
+    def to_geometry(self) -> Dict[str, Any]:
+        polygons = []
+        for j in range(len(self.polygon_offsets) - 1):
+            rings = []
+            for i in range(self.polygon_offsets[j], self.polygon_offsets[j + 1]):
+                lons, lats = self.ring(i)
+                rings.append([[lon, lat] for lon, lat in zip(lons, lats)])
+            polygons.append(rings)
+        return {"type": "MultiPolygon", "coordinates": polygons}
+
+
+def _douglas_peucker(xs: Sequence[float], ys: Sequence[float], tolerance: float) -> List[int]:
+    n = len(xs)
+    if n <= 2:
+        return list(range(n))
+    keep = bytearray(n)
+    keep[0] = keep[n - 1] = 1
+    tol2 = tolerance * tolerance
+    stack = [(0, n - 1)]
+    while stack:
+        first, last = stack.pop()
+        ax, ay = xs[first], ys[first]
+        dx, dy = xs[last] - ax, ys[last] - ay
+        seg2 = dx * dx + dy * dy
+        worst, worst_d2 = -1, tol2
+        for k in range(first + 1, last):
+            px, py = xs[k] - ax, ys[k] - ay
+            if seg2 == 0:
+                d2 = px * px + py * py
             else:
-                for i in v:
-                    walk(i)
+                cross = px * dy - py * dx
+                d2 = cross * cross / seg2
+            if d2 > worst_d2:
+                worst, worst_d2 = k, d2
+        if worst > 0:
+            keep[worst] = 1
+            stack.append((first, worst))
+            stack.append((worst, last))
+    return [k for k in range(n) if keep[k]]
 
-    walk(geometry.get("coordinates", []))
-    if not coords:
-        raise ValueError("No coordinates in geometry")
-    lons = [c[0] for c in coords]
-    lats = [c[1] for c in coords]
-    return (min(lons), min(lats), max(lons), max(lats))
+
+def bbox_area_km2(bbox: Sequence[float]) -> float:
+    # Exact area of a lon/lat rectangle on the sphere
+    min_lon, min_lat, max_lon, max_lat = bbox
+    return (
+        math.radians(max_lon - min_lon)
+        * abs(math.sin(math.radians(max_lat)) - math.sin(math.radians(min_lat)))
+        * EARTH_RADIUS_KM**2
+    )
 
 
 def parse_bbox_list(values: Iterable[Any]) -> Tuple[float, float, float, float]:
@@ -74,9 +256,48 @@ def bbox_diff(a: Tuple[float, float, float, float], b: Tuple[float, float, float
     }
 
 
+def _is_nested(value: Any) -> bool:
+    # Lists deeper than a coordinate ring are split up; a ring itself is encoded in one call
+    if isinstance(value, dict):
+        return True
+    return isinstance(value, (list, tuple)) and bool(value) and isinstance(value[0], (list, tuple, dict))
+
+
+def _iter_json_chunks(value: Any) -> Iterator[str]:
+    """Yield the text of json.dumps(value, sort_keys=True, ensure_ascii=False) in pieces.
+
+    Containers are walked with an explicit stack; rings and other shallow lists go through the C
+    encoder whole, so no document-sized string is built for large boundaries.
+    """
+    dumps = json.dumps
+    stack: List[Tuple[bool, Any]] = [(False, value)]
+    while stack:
+        is_text, item = stack.pop()
+        if is_text:
+            yield item
+        elif isinstance(item, dict) and item:
+            keys = sorted(item)
+            yield "{"
+            stack.append((True, "}"))
+            for i in range(len(keys) - 1, -1, -1):
+                stack.append((False, item[keys[i]]))
+                stack.append((True, (", " if i else "") + dumps(keys[i], ensure_ascii=False) + ": "))
+        elif isinstance(item, (list, tuple)) and item and _is_nested(item[0]):
+            yield "["
+            stack.append((True, "]"))
+            for i in range(len(item) - 1, -1, -1):
+                stack.append((False, item[i]))
+                if i:
+                    stack.append((True, ", "))
+        else:
+            yield dumps(item, sort_keys=True, ensure_ascii=False)
+
+
 def polygon_hash(geometry: Dict[str, Any]) -> str:
-    raw = json.dumps(geometry, sort_keys=True, ensure_ascii=False).encode("utf-8")
-    return hashlib.sha256(raw).hexdigest()[:16]
+    digest = hashlib.sha256()
+    for chunk in _iter_json_chunks(geometry):
+        digest.update(chunk.encode("utf-8"))
+    return digest.hexdigest()[:16]
 
 
 def write_json(path: Path, obj: Dict[str, Any]) -> None:
@@ -89,3 +310,279 @@ def append_log(log_path: Path, message: str) -> None:
     log_path.parent.mkdir(parents=True, exist_ok=True)
     with log_path.open("a", encoding="utf-8") as f:
         f.write(message.rstrip() + "\n")
+
+
+class HttpError(Exception):
+    """Non-retryable or retries-exhausted response; status is 0 when the response itself was broken."""
+
+    def __init__(self, status: int, url: str, reason: Optional[str] = None) -> None:
+        super().__init__(f"{reason or f'HTTP {status}'}: {url}")
+        self.status = status
+        self.url = url
+
+
+def retry_after_seconds(value: Optional[str], default: float) -> float:
+    # Retry-After is either delta-seconds or an HTTP-date; anything unparsable keeps the backoff delay
+    if not value:
+        return default
+    try:
+        return max(0.0, float(value))
+    except ValueError:
+        pass
+    try:
+        when = email.utils.parsedate_to_datetime(value)
+    except (TypeError, ValueError):
+        return default
+    if when.tzinfo is None:
+        when = when.replace(tzinfo=dt.timezone.utc)
+    return max(0.0, (when - dt.datetime.now(dt.timezone.utc)).total_seconds())
+
+
+class RateLimiter:
+    # Minimum spacing between requests to one host, shared by all worker threads
+    def __init__(self, rate: float) -> None:
+        self.interval = 1.0 / rate if rate > 0 else 0.0
+        self._lock = threading.Lock()
+        self._next: Dict[str, float] = {}
+
+    def wait(self, host: str) -> None:
+        if not self.interval:
+            return
+        with self._lock:
+            now = time.monotonic()
+            slot = max(now, self._next.get(host, now))
+            self._next[host] = slot + self.interval
+        if slot > now:
+            time.sleep(slot - now)
+
+
+class HttpClient:
+    """Keep-alive GET client: one persistent connection per host per thread, per-host rate limit,
+    exponential backoff on 429/5xx and network errors. Retries are appended to ``self.retries``."""
+
+    def __init__(
+        self,
+        rate: float = 0.0,
+        timeout: float = 60,
+        retries: int = 4,
+        backoff: float = 2.0,
+        on_retry: Optional[Callable[[Dict[str, Any]], None]] = None,
+    ) -> None:
+        self.limiter = RateLimiter(rate)
+        self.timeout = timeout
+        self.max_retries = retries
+        self.backoff = backoff
+        self.on_retry = on_retry
+        self.retries: List[Dict[str, Any]] = []
+        self._local = threading.local()
+
+    def _connection(self, scheme: str, netloc: str) -> http.client.HTTPConnection:
+        conns = self._local.__dict__.setdefault("conns", {})
+        conn = conns.get((scheme, netloc))
+        if conn is None:
+            cls = http.client.HTTPSConnection if scheme == "https" else http.client.HTTPConnection
+            conn = cls(netloc, timeout=self.timeout)
+            conns[(scheme, netloc)] = conn
+        return conn
+
+    def _drop(self, scheme: str, netloc: str) -> None:
+        conn = self._local.__dict__.get("conns", {}).pop((scheme, netloc), None)
+        if conn is not None:
+            conn.close()
+
+    def _request(self, url: str, handle: Callable[[http.client.HTTPResponse], Any]) -> Any:
+        parts = urllib.parse.urlsplit(url)
+        path = parts.path + (f"?{parts.query}" if parts.query else "")
+        attempt = 0
+        while True:
+            self.limiter.wait(parts.netloc)
+            delay = self.backoff * (2**attempt)
+            try:
+                conn = self._connection(parts.scheme, parts.netloc)
+                conn.request("GET", path, headers={"User-Agent": USER_AGENT, "Accept-Encoding": "gzip"})
+                resp = conn.getresponse()
+                if resp.status == 200:
+                    return handle(resp)
+                resp.read()
+                if resp.getheader("Connection", "").lower() == "close":
+                    self._drop(parts.scheme, parts.netloc)
+                if resp.status not in RETRY_STATUS or attempt >= self.max_retries:
+                    raise HttpError(resp.status, url)
+                delay = retry_after_seconds(resp.getheader("Retry-After"), delay)
+                reason = f"HTTP {resp.status}"
+            except (http.client.HTTPException, OSError) as exc:
+                self._drop(parts.scheme, parts.netloc)
+                reason = f"{type(exc).__name__}: {exc}"
+                if attempt >= self.max_retries:
+                    if isinstance(exc, http.client.HTTPException):
+                        # e.g. IncompleteRead: callers handle (HttpError, OSError) per item
+                        raise HttpError(0, url, reason) from exc
+                    raise
+            attempt += 1
+            record = {"url": url, "attempt": attempt, "reason": reason, "delay": delay}
+            self.retries.append(record)
+            if self.on_retry:
+                self.on_retry(record)
+            time.sleep(delay)
+
+    def get(self, url: str, params: Optional[Dict[str, Any]] = None) -> bytes:
+        full_url = f"{url}?{urllib.parse.urlencode(params)}" if params else url
+
+        def read(resp: http.client.HTTPResponse) -> bytes:
+            body = resp.read()
+            if resp.getheader("Content-Encoding", "").lower() == "gzip":
+                body = gzip.decompress(body)
+            return body
+
+        return self._request(full_url, read)
+
+    def download(self, url: str, dest: Path, compress: bool = False) -> int:
+        # Stream to a temp file and rename, so a file on disk is always complete
+        tmp = dest.with_name(dest.name + ".part")
+
+        def save(resp: http.client.HTTPResponse) -> int:
+            src: Any = resp
+            if resp.getheader("Content-Encoding", "").lower() == "gzip":
+                src = gzip.GzipFile(fileobj=resp)
+            opener = gzip.open if compress else open
+            written = 0
+            with opener(tmp, "wb") as out:
+                for chunk in iter(lambda: src.read(1 << 16), b""):
+                    out.write(chunk)
+                    written += len(chunk)
+            os.replace(tmp, dest)
+            return written
+
+        dest.parent.mkdir(parents=True, exist_ok=True)
+        try:
+            return self._request(url, save)
+        finally:
+            if tmp.exists():
+                tmp.unlink()
+
+
+class CacheMiss(Exception):
+    pass
+
+
+class ResponseCache:
+    """On-disk JSON response cache, one file per URL + params key.
+
+    Entries older than ``ttl`` seconds are refetched (or still served with ``allow_stale``,
+    e.g. offline); past ``max_entries`` the least recently used files are evicted. The directory is
+    only scanned when a running entry estimate crosses the bound, and then trimmed to 90% of it, so
+    puts do not pay for a listing each.
+    """
+
+    def __init__(self, root: Path, ttl: float = DEFAULT_CACHE_TTL, max_entries: int = DEFAULT_CACHE_MAX_ENTRIES) -> None:
+        self.root = root
+        self.ttl = ttl
+        self.max_entries = max_entries
+        self.hits = 0
+        self.misses = 0
+        self._entries: Optional[int] = None  # estimate; other runs sharing the directory can skew it
+
+    @staticmethod
+    def key(url: str, params: Optional[Dict[str, Any]] = None) -> str:
+        raw = json.dumps([url, params or {}], sort_keys=True, ensure_ascii=False).encode("utf-8")
+        return hashlib.sha256(raw).hexdigest()
+
+    def _path(self, key: str) -> Path:
+        return self.root / key[:2] / f"{key}.json"
+
+    def get(
+        self,
+        url: str,
+        params: Optional[Dict[str, Any]] = None,
+        allow_stale: bool = False,
+        validate: Optional[Callable[[Dict[str, Any]], bool]] = None,
+    ) -> Optional[Dict[str, Any]]:
+        path = self._path(self.key(url, params))
+        try:
+            entry = json.loads(path.read_text(encoding="utf-8"))
+        except (OSError, ValueError):
+            self.misses += 1
+            return None
+        if not allow_stale and time.time() - float(entry.get("fetched_at", 0)) > self.ttl:
+            self.misses += 1
+            return None
+        if validate is not None and not validate(entry):
+            self.misses += 1
+            return None
+        try:
+            os.utime(path)  # mtime doubles as last-access time for eviction
+        except FileNotFoundError:
+            # Evicted or invalidated by another run sharing the cache since the read
+            self.misses += 1
+            return None
+        self.hits += 1
+        return entry
+
+    def put(self, url: str, params: Optional[Dict[str, Any]], body: Any, meta: Optional[Dict[str, Any]] = None) -> None:
+        path = self._path(self.key(url, params))
+        path.parent.mkdir(parents=True, exist_ok=True)
+        entry = {"url": url, "params": params or {}, "fetched_at": time.time(), "meta": meta or {}, "body": body}
+        tmp = path.with_name(f"{path.name}.{os.getpid()}.{threading.get_ident()}.part")
+        tmp.write_text(json.dumps(entry, ensure_ascii=False), encoding="utf-8")
+        existed = path.exists()
+        os.replace(tmp, path)
+        if self._entries is None:
+            self._entries = sum(1 for _ in self.root.glob("*/*.json"))
+        elif not existed:
+            self._entries += 1
+        if self._entries > self.max_entries:
+            self.evict()
+
+    def invalidate(self, url: str, params: Optional[Dict[str, Any]] = None) -> None:
+        self._path(self.key(url, params)).unlink(missing_ok=True)
+
+    def evict(self) -> int:
+        """Trim the cache to 90% of ``max_entries``, least recently used first; returns the files removed."""
+        files = []
+        for path in self.root.glob("*/*.json"):
+            try:
+                files.append((path.stat().st_mtime, path))
+            except FileNotFoundError:
+                continue  # already evicted by another run
+        files.sort()
+        keep = self.max_entries - self.max_entries // 10
+        removed = 0
+        # Expired entries are kept for offline use until the size bound pushes them out
+        for _, path in files[: max(0, len(files) - keep)]:
+            path.unlink(missing_ok=True)
+            removed += 1
+        self._entries = len(files) - removed
+        return removed
+
+
+def osc_path(download_dir: Path, changeset_id: int) -> Optional[Path]:
+    for name in (f"{changeset_id}.osc.xml", f"{changeset_id}.osc.xml.gz"):
+        path = download_dir / name
+        if path.exists():
+            return path
+    return None
+
+
+def open_osc(path: Path) -> IO[bytes]:
+    return gzip.open(path, "rb") if path.suffix == ".gz" else path.open("rb")
+
+
+def update_quality(base_dir: Path, stage: str, quality: Dict[str, List[Any]]) -> None:
+    # Each stage owns one section; the summary merges all sections into summary.quality
+    path = base_dir / "stats" / "quality.json"
+    data: Dict[str, Any] = {}
+    if path.exists():
+        data = json.loads(path.read_text(encoding="utf-8"))
+    data[stage] = quality
+    write_json(path, data)
+
+
+def load_quality(base_dir: Path) -> Dict[str, List[Any]]:
+    path = base_dir / "stats" / "quality.json"
+    merged: Dict[str, List[Any]] = {}
+    if not path.exists():
+        return merged
+    for stage_quality in json.loads(path.read_text(encoding="utf-8")).values():
+        for key, items in stage_quality.items():
+            merged.setdefault(key, []).extend(items)
+    return merged
@@ -0,0 +1,112 @@
+#!/usr/bin/env python3
+from __future__ import annotations
+
+import argparse
+import datetime as dt
+import json
+from concurrent.futures import ThreadPoolExecutor, as_completed
+from pathlib import Path
+from typing import Any, Dict, Iterable, List, Optional
+
+from collect_changesets import load_changesets_table
+from common import HttpClient, HttpError, append_log, osc_path, update_quality
+
+
+def download_changesets(
+    api_base: str,
+    changeset_ids: Iterable[int],
+    download_dir: Path,
+    client: HttpClient,
+    workers: int = 4,
+    compress: bool = False,
+    log_path: Optional[Path] = None,
+    closed_at: Optional[Dict[int, int]] = None,
+) -> Dict[str, Any]:
+    """closed_at maps changeset id -> close time (epoch seconds, -1 = still open when collected).
+
+    A file on disk is complete thanks to the .part rename, but a changeset that was still open when
+    it was downloaded can have gained edits since; with closed_at such files are fetched again.
+    """
+    quality: Dict[str, List[Any]] = {"api_errors": [], "retries": client.retries, "partial_failures": []}
+    ids = sorted(set(int(i) for i in changeset_ids))
+
+    def current(changeset_id: int) -> bool:
+        path = osc_path(download_dir, changeset_id)
+        if path is None:
+            return False
+        if closed_at is None:
+            return True
+        closed = closed_at.get(changeset_id, -1)
+        return closed >= 0 and path.stat().st_mtime >= closed
+
+    todo = [i for i in ids if not current(i)]
+    suffix = ".osc.xml.gz" if compress else ".osc.xml"
+
+    def fetch(changeset_id: int) -> int:
+        url = f"{api_base}/api/0.6/changeset/{changeset_id}/download"
+        stale = osc_path(download_dir, changeset_id)
+        dest = download_dir / f"{changeset_id}{suffix}"
+        written = client.download(url, dest, compress=compress)
+        if stale is not None and stale != dest:
+            # Refreshed under the other suffix: osc_path must not find the old copy first
+            stale.unlink()
+        return written
+
+    downloaded = 0
+    total_bytes = 0
+    with ThreadPoolExecutor(max_workers=max(1, workers)) as pool:
+        futures = {pool.submit(fetch, i): i for i in todo}
+        for future in as_completed(futures):
+            changeset_id = futures[future]
+            try:
+                total_bytes += future.result()
+                downloaded += 1
+            except (HttpError, OSError) as exc:
+                quality["api_errors"].append({"changeset_id": changeset_id, "error": str(exc)})
+                quality["partial_failures"].append({"stage": "download", "changeset_id": changeset_id})
+                if log_path:
+                    append_log(log_path, f"download failed {changeset_id}: {exc}")
+
+    return {
+        "requested": len(ids),
+        "skipped_existing": len(ids) - len(todo),
+        "downloaded": downloaded,
+        "failed": len(todo) - downloaded,
+        "bytes": total_bytes,
+        "quality": quality,
+    }
+
+
+def main() -> int:
+    parser = argparse.ArgumentParser(description="Download OsmChange for every collected changeset (Layer 2)")
+    parser.add_argument("--base-dir", required=True, help="outputs/<region>/<year>")
+    parser.add_argument("--osm-api-base", default="https://api.openstreetmap.org")
+    parser.add_argument("--workers", type=int, default=4)
+    parser.add_argument("--rate", type=float, default=2.0, help="max requests per second per host")
+    parser.add_argument("--gzip", action="store_true", help="store files as .osc.xml.gz")
+    args = parser.parse_args()
+
+    base_dir = Path(args.base_dir)
+    log_path = base_dir / "logs" / "run.log"
+    table = load_changesets_table(base_dir)
+    ids = table.columns["id"]
+
+    append_log(log_path, f"[{dt.datetime.utcnow().isoformat()}Z] start download_changesets ({len(ids)} changesets)")
+    result = download_changesets(
+        args.osm_api_base,
+        ids,
+        base_dir / "raw" / "changeset_download",
+        HttpClient(rate=args.rate),
+        workers=args.workers,
+        compress=args.gzip,
+        log_path=log_path,
+        closed_at=dict(zip(ids, table.columns["closed_at"])),
+    )
+    update_quality(base_dir, "download", result.pop("quality"))
+    append_log(log_path, f"[{dt.datetime.utcnow().isoformat()}Z] download done: {json.dumps(result)}")
+    print(json.dumps({"status": "ok", **result}, ensure_ascii=False))
+    return 0
+
+
+if __name__ == "__main__":
+    raise SystemExit(main())
@@ -0,0 +1,254 @@
+from __future__ import annotations
+
+import math
+import struct
+import zlib
+from pathlib import Path
+from typing import Dict, Iterable, List, Optional, Sequence, Tuple
+
+TILE_SIZE = 256
+MAX_MERCATOR_LAT = 85.05112878
+
+RGB = Tuple[int, int, int]
+
+
+def mercator(lon: float, lat: float) -> Tuple[float, float]:
+    """Web Mercator in world units: x, y in [0, 1), y growing southwards (as in XYZ tiles)."""
+    lat = max(-MAX_MERCATOR_LAT, min(MAX_MERCATOR_LAT, lat))
+    x = (lon + 180.0) / 360.0
+    s = math.sin(math.radians(lat))
+    y = 0.5 - math.log((1 + s) / (1 - s)) / (4 * math.pi)
+    return x, y
+
+
+class Viewport:
+    """Maps lon/lat to pixels for a bbox fitted (aspect preserved, padded) into width x height."""
+
+    def __init__(self, bbox: Sequence[float], width: int, height: int, padding: float = 0.08) -> None:
+        x0, y1 = mercator(bbox[0], bbox[1])
+        x1, y0 = mercator(bbox[2], bbox[3])
+        span = max((x1 - x0) / (width * (1 - 2 * padding)), (y1 - y0) / (height * (1 - 2 * padding)), 1e-12)
+        self.scale = 1.0 / span  # pixels per world unit
+        self.left = (x0 + x1) / 2 - width / 2 * span
+        self.top = (y0 + y1) / 2 - height / 2 * span
+        self.width = width
+        self.height = height
+
+    def project(self, lon: float, lat: float) -> Tuple[float, float]:
+        x, y = mercator(lon, lat)
+        return (x - self.left) * self.scale, (y - self.top) * self.scale
+
+    def zoom(self) -> int:
+        # Tile zoom whose native resolution is closest to (at least) the viewport's
+        return max(0, min(19, math.ceil(math.log2(self.scale / TILE_SIZE))))
+
+
+class Canvas:
+    def __init__(self, width: int, height: int, background: RGB) -> None:
+        self.width = width
+        self.height = height
+        self.pixels = bytearray(bytes(background) * (width * height))
+
+    def fill_polygon(self, rings: Iterable[Sequence[Tuple[float, float]]], color: RGB, alpha: float) -> None:
+        """Even-odd scanline fill; each edge only touches the rows it spans."""
+        crossings: List[List[float]] = [[] for _ in range(self.height)]
+        for ring in rings:
+            for (ax, ay), (bx, by) in zip(ring, ring[1:] + ring[:1]):
+                if ay == by:
+                    continue
+                if ay > by:
+                    ax, ay, bx, by = bx, by, ax, ay
+                row0 = max(0, math.ceil(ay - 0.5))
+                row1 = min(self.height - 1, math.ceil(by - 0.5) - 1)
+                slope = (bx - ax) / (by - ay)
+                for row in range(row0, row1 + 1):
+                    crossings[row].append(ax + (row + 0.5 - ay) * slope)
+        tables = [bytes(round(v * (1 - alpha) + c * alpha) for v in range(256)) for c in color]
+        for row, xs in enumerate(crossings):
+            if not xs:
+                continue
+            xs.sort()
+            base = row * self.width * 3
+            for x_start, x_end in zip(xs[0::2], xs[1::2]):
+                c0 = max(0, math.ceil(x_start - 0.5))
+                c1 = min(self.width, math.ceil(x_end - 0.5))
+                if c1 <= c0:
+                    continue
+                for ch in range(3):
+                    lo, hi = base + c0 * 3 + ch, base + c1 * 3 + ch
+                    self.pixels[lo:hi:3] = self.pixels[lo:hi:3].translate(tables[ch])
+
+    def line(self, ax: float, ay: float, bx: float, by: float, color: RGB, width: int = 2) -> None:
+        steps = max(1, int(max(abs(bx - ax), abs(by - ay))))
+        half = width // 2
+        px = bytes(color)
+        for i in range(steps + 1):
+            t = i / steps
+            x = int(ax + (bx - ax) * t)
+            y = int(ay + (by - ay) * t)
+            for dy in range(-half, width - half):
+                yy = y + dy
+                if not 0 <= yy < self.height:
+                    continue
+                lo = max(0, x - half)
+                hi = min(self.width, x - half + width)
+                if lo < hi:
+                    start = (yy * self.width + lo) * 3
+                    self.pixels[start : start + (hi - lo) * 3] = px * (hi - lo)
+
+    def polyline(self, points: Sequence[Tuple[float, float]], color: RGB, width: int = 2, closed: bool = True) -> None:
+        # Skip vertices that land on the same pixel: huge boundaries collapse to their on-screen outline
+        last: Optional[Tuple[float, float]] = None
+        first: Optional[Tuple[float, float]] = None
+        for x, y in points:
+            if last is not None and abs(x - last[0]) < 1 and abs(y - last[1]) < 1:
+                continue
+            if last is not None:
+                self.line(last[0], last[1], x, y, color, width)
+            else:
+                first = (x, y)
+            last = (x, y)
+        if closed and first is not None and last is not None:
+            self.line(last[0], last[1], first[0], first[1], color, width)
+
+    def paste(self, rgb: bytes, src_w: int, src_h: int, dx: int, dy: int) -> None:
+        for row in range(src_h):
+            y = dy + row
+            if not 0 <= y < self.height:
+                continue
+            lo = max(0, dx)
+            hi = min(self.width, dx + src_w)
+            if lo >= hi:
+                continue
+            src = (row * src_w + (lo - dx)) * 3
+            dst = (y * self.width + lo) * 3
+            self.pixels[dst : dst + (hi - lo) * 3] = rgb[src : src + (hi - lo) * 3]
+
+    def to_png(self) -> bytes:
+        stride = self.width * 3
+        raw = b"".join(b"\x00" + bytes(self.pixels[r * stride : (r + 1) * stride]) for r in range(self.height))
+        return encode_png(self.width, self.height, raw)
+
+
+def _chunk(kind: bytes, data: bytes) -> bytes:
+    return struct.pack(">I", len(data)) + kind + data + struct.pack(">I", zlib.crc32(kind + data) & 0xFFFFFFFF)
+
+
+def encode_png(width: int, height: int, filtered_rgb: bytes) -> bytes:
+    header = struct.pack(">IIBBBBB", width, height, 8, 2, 0, 0, 0)
+    return (
+        b"\x89PNG\r\n\x1a\n"
+        + _chunk(b"IHDR", header)
+        + _chunk(b"IDAT", zlib.compress(filtered_rgb, 6))
+        + _chunk(b"IEND", b"")
+    )
+
+
+def decode_png(data: bytes) -> Tuple[int, int, bytes]:
+    """Decode an 8-bit, non-interlaced PNG (RGB, RGBA, grey or palette) to RGB bytes; enough for map tiles."""
+    if data[:8] != b"\x89PNG\r\n\x1a\n":
+        raise ValueError("not a PNG")
+    pos = 8
+    idat = bytearray()
+    palette = b""
+    width = height = depth = color_type = interlace = 0
+    while pos < len(data):
+        length, kind = struct.unpack(">I4s", data[pos : pos + 8])
+        body = data[pos + 8 : pos + 8 + length]
+        pos += 12 + length
+        if kind == b"IHDR":
+            width, height, depth, color_type, _, _, interlace = struct.unpack(">IIBBBBB", body)
+        elif kind == b"PLTE":
+            palette = body
+        elif kind == b"IDAT":
+            idat += body
+        elif kind == b"IEND":
+            break
+    channels = {0: 1, 2: 3, 3: 1, 4: 2, 6: 4}.get(color_type)
+    if depth != 8 or interlace or channels is None:
+        raise ValueError(f"unsupported PNG (depth={depth}, color_type={color_type}, interlace={interlace})")
+
+    raw = zlib.decompress(bytes(idat))
+    stride = width * channels
+    out = bytearray(stride * height)
+    prev = bytearray(stride)
+    pos = 0
+    for row in range(height):
+        ftype = raw[pos]
+        line = bytearray(raw[pos + 1 : pos + 1 + stride])
+        pos += 1 + stride
+        if ftype == 1:
+            for i in range(channels, stride):
+                line[i] = (line[i] + line[i - channels]) & 0xFF
+        elif ftype == 2:
+            line = bytearray((a + b) & 0xFF for a, b in zip(line, prev))
+        elif ftype == 3:
+            for i in range(stride):
+                left = line[i - channels] if i >= channels else 0
+                line[i] = (line[i] + ((left + prev[i]) >> 1)) & 0xFF
+        elif ftype == 4:
+            for i in range(stride):
+                a = line[i - channels] if i >= channels else 0
+                b = prev[i]
+                c = prev[i - channels] if i >= channels else 0
+                p = a + b - c
+                pa, pb, pc = abs(p - a), abs(p - b), abs(p - c)
+                pred = a if pa <= pb and pa <= pc else (b if pb <= pc else c)
+                line[i] = (line[i] + pred) & 0xFF
+        out[row * stride : (row + 1) * stride] = line
+        prev = line
+
+    if color_type == 2:
+        return width, height, bytes(out)
+    rgb = bytearray(width * height * 3)
+    if color_type == 6:
+        for ch in range(3):
+            rgb[ch::3] = out[ch::4]
+    elif color_type == 4:
+        for ch in range(3):
+            rgb[ch::3] = out[0::2]
+    elif color_type == 0:
+        for ch in range(3):
+            rgb[ch::3] = out
+    else:
+        lut: Dict[int, bytes] = {i: palette[i * 3 : i * 3 + 3] for i in range(len(palette) // 3)}
+        rgb = bytearray(b"".join(lut.get(v, b"\x00\x00\x00") for v in out))
+    return width, height, bytes(rgb)
+
+
+def paste_tiles(canvas: Canvas, view: Viewport, tile_dir: Path) -> int:
+    """Draw locally cached XYZ tiles (<tile_dir>/<z>/<x>/<y>.png) under the viewport; returns tiles used."""
+    z = view.zoom()
+    n = 2**z
+    x_first = int(view.left * n)
+    y_first = int(view.top * n)
+    x_last = int((view.left + view.width / view.scale) * n)
+    y_last = int((view.top + view.height / view.scale) * n)
+    used = 0
+    for ty in range(max(0, y_first), min(n - 1, y_last) + 1):
+        for tx in range(x_first, x_last + 1):
+            path = tile_dir / str(z) / str(tx % n) / f"{ty}.png"
+            if not path.exists():
+                continue
+            w, h, rgb = decode_png(path.read_bytes())
+            # Snap both edges to pixels so neighbouring tiles meet without seams
+            dx = round((tx / n - view.left) * view.scale)
+            dy = round((ty / n - view.top) * view.scale)
+            size_x = max(1, round(((tx + 1) / n - view.left) * view.scale) - dx)
+            size_y = max(1, round(((ty + 1) / n - view.top) * view.scale) - dy)
+            if (w, h) != (size_x, size_y):
+                rgb, w, h = resample(rgb, w, h, size_x, size_y), size_x, size_y
+            canvas.paste(rgb, w, h, dx, dy)
+            used += 1
+    return used
+
+
+def resample(rgb: bytes, w: int, h: int, new_w: int, new_h: int) -> bytes:
+    # Nearest neighbour: tiles only serve as context under the overlay
+    out = bytearray(new_w * new_h * 3)
+    cols = [min(w - 1, x * w // new_w) * 3 for x in range(new_w)]
+    for y in range(new_h):
+        src_row = min(h - 1, y * h // new_h) * w * 3
+        dst = y * new_w * 3
+        out[dst : dst + new_w * 3] = b"".join(rgb[src_row + c : src_row + c + 3] for c in cols)
+    return bytes(out)
@@ -0,0 +1,237 @@
+from __future__ import annotations
+
+import json
+import operator
+from collections import Counter, defaultdict
+from itertools import compress
+from pathlib import Path
+from typing import Any, Dict, Iterable, List, Optional, Sequence, Tuple
+
+from columnar import ColumnTable
+
+try:
+    import numpy as np
+except ImportError:  # numpy is optional: the pure-Python grouping gives the same numbers
+    np = None
+
+AU_CS_THRESHOLD = 10
+AU_CHG_THRESHOLD = 500
+TOPK_USERS = 10
+# Per-month partial aggregates live in stats/partials/; bump the version when their layout changes
+PARTIALS_DIR = "partials"
+PARTIALS_VERSION = 1
+
+
+def month_keys(year: int) -> List[str]:
+    return [f"{year}-{m:02d}" for m in range(1, 13)]
+
+
+def load_partials(path: Path, scope: Dict[str, Any]) -> Dict[str, Dict[str, Any]]:
+    """Month partials from a previous run, or {} if missing, outdated or built for another scope."""
+    if not path.exists():
+        return {}
+    try:
+        data = json.loads(path.read_text(encoding="utf-8"))
+    except (OSError, ValueError):
+        return {}
+    if data.get("version") != PARTIALS_VERSION or data.get("scope") != scope:
+        return {}
+    return data.get("months", {})
+
+
+def save_partials(path: Path, scope: Dict[str, Any], months: Dict[str, Dict[str, Any]]) -> None:
+    # Machine-only cache: compact output keeps json on its C encoder (indent=2 falls back to pure Python)
+    data = {"version": PARTIALS_VERSION, "scope": scope, "months": dict(sorted(months.items()))}
+    path.parent.mkdir(parents=True, exist_ok=True)
+    path.write_text(json.dumps(data, ensure_ascii=False, separators=(",", ":")), encoding="utf-8")
+
+
+def _month_fingerprints(table: ColumnTable, keep: Optional[Sequence[int]]) -> Dict[int, List[int]]:
+    # [count, sum(id), sum(changes_count), sum(created_at)] per month code: any added, dropped or
+    # re-flagged changeset changes it, and it costs a few bincounts instead of a regroup
+    cols = table.columns
+    n_months = len(table.dicts["month"])
+    if np is not None and len(table):
+        mask = np.frombuffer(keep, dtype=np.int8).astype(bool) if keep is not None else slice(None)
+        months_col = np.frombuffer(cols["month"], dtype=np.int32)[mask]
+        sums = [np.bincount(months_col, minlength=n_months)]
+        for name in ("id", "changes_count", "created_at"):
+            values = np.frombuffer(cols[name], dtype=np.dtype(f"i{cols[name].itemsize}"))[mask]
+            sums.append(np.bincount(months_col, weights=values.astype(np.float64), minlength=n_months).round())
+        return {m: [int(s[m]) for s in sums] for m in range(n_months) if sums[0][m]}
+    acc: Dict[int, List[int]] = {}
+    flags = keep if keep is not None else [1] * len(table)
+    for month, cid, chg, created, ok in zip(cols["month"], cols["id"], cols["changes_count"], cols["created_at"], flags):
+        if ok:
+            a = acc.setdefault(month, [0, 0, 0, 0])
+            a[0] += 1
+            a[1] += cid
+            a[2] += chg
+            a[3] += created
+    return acc
+
+
+# Both groupers key a (month, user) pair as uid * n_months + month and return four dicts over those
+# keys: CS, CHG, and created_at + user dictionary code of the pair's latest named changeset
+MonthUsers = Tuple[Dict[int, int], Dict[int, int], Dict[int, int], Dict[int, int]]
+
+
+def _group_month_users_python(table: ColumnTable, keep: Optional[Sequence[int]], dirty: set) -> MonthUsers:
+    cols = table.columns
+    selector: Iterable[Any] = map(dirty.__contains__, cols["month"])
+    if keep is not None:
+        selector = map(operator.and_, selector, keep)
+    selector = list(selector)
+
+    def column(name: str, rows: Sequence[Any]) -> List[int]:
+        return list(compress(cols[name], rows))
+
+    n_months = len(table.dicts["month"])
+    uids = column("uid", selector)
+    keys = list(map(operator.add, map(n_months.__mul__, uids), column("month", selector)))
+    cs = Counter(keys)
+    chg = dict.fromkeys(cs, 0)
+    for key, value in zip(keys, column("changes_count", selector)):
+        chg[key] += value
+
+    created, codes = column("created_at", selector), column("user", selector)
+    blank = {code for code, name in enumerate(table.dicts["user"]) if not name}
+    if blank:
+        named = list(map(operator.not_, map(blank.__contains__, codes)))
+        keys, created, codes = list(compress(keys, named)), list(compress(created, named)), list(compress(codes, named))
+    if all(map(operator.le, created, created[1:])):
+        # Rows in created_at order (as collect writes them): the last row of a pair is its latest
+        return cs, chg, dict(zip(keys, created)), dict(zip(keys, codes))
+    latest: Dict[int, int] = {}
+    latest_codes: Dict[int, int] = {}
+    for key, when, code in zip(keys, created, codes):
+        if key not in latest or when >= latest[key]:
+            latest[key] = when
+            latest_codes[key] = code
+    return cs, chg, latest, latest_codes
+
+
+def _group_month_users_numpy(table: ColumnTable, keep: Optional[Sequence[int]], dirty: set) -> MonthUsers:
+    cols = table.columns
+
+    def column(name: str) -> Any:
+        dtype = np.dtype(f"i{cols[name].itemsize}")
+        return np.frombuffer(cols[name], dtype=dtype) if len(cols[name]) else np.zeros(0, dtype=dtype)
+
+    selected = np.isin(column("month"), list(dirty))
+    if keep is not None:
+        selected &= column("in_region").astype(bool)
+    rows = np.nonzero(selected)[0]
+    n_months = len(table.dicts["month"])
+    keys, key_idx = np.unique(column("uid")[rows] * n_months + column("month")[rows], return_inverse=True)
+    key_idx = key_idx.reshape(-1)
+    key_list = keys.tolist()
+    cs = dict(zip(key_list, np.bincount(key_idx, minlength=len(keys)).tolist()))
+    chg_sums = np.bincount(key_idx, weights=column("changes_count")[rows].astype(np.float64), minlength=len(keys))
+    chg = dict(zip(key_list, chg_sums.round().astype(np.int64).tolist()))
+
+    created, codes = column("created_at")[rows], column("user")[rows]
+    blank = [code for code, name in enumerate(table.dicts["user"]) if not name]
+    named = np.nonzero(~np.isin(codes, blank))[0]
+    if named.size == 0:
+        return cs, chg, {}, {}
+    # Latest named row per pair: sort by (pair, created_at, row) and keep each pair's last row
+    order = named[np.lexsort((named, created[named], key_idx[named]))]
+    last = order[np.append(key_idx[order][1:] != key_idx[order][:-1], True)]
+    last_keys = keys[key_idx[last]].tolist()
+    return cs, chg, dict(zip(last_keys, created[last].tolist())), dict(zip(last_keys, codes[last].tolist()))
+
+
+def _month_partials(table: ColumnTable, keep: Optional[Sequence[int]], dirty: set) -> Dict[int, Dict[str, Any]]:
+    """Exact per-user aggregates for the dirty month codes: users[uid] = [CS, CHG], names[uid] = [created_at, name].
+
+    uids are string keys, as stored in the partials file. Grouping runs once over the selected rows on
+    the integer columns and dictionary codes (bincounts with numpy, compress/Counter without), so a
+    cold run costs one grouped pass rather than a Python loop over every row.
+    """
+    user_names = table.dicts["user"]
+    partials: Dict[int, Dict[str, Any]] = {m: {"CS": 0, "CHG": 0, "users": {}, "names": {}} for m in dirty}
+    if not len(table) or not dirty:
+        return partials
+    group = _group_month_users_numpy if np is not None else _group_month_users_python
+    cs, chg, latest, codes = group(table, keep, dirty)
+    n_months = len(table.dicts["month"])
+    for key, count in cs.items():
+        uid, month = divmod(key, n_months)
+        part = partials[month]
+        part["CS"] += count
+        part["CHG"] += chg[key]
+        part["users"][str(uid)] = [count, chg[key]]
+    for key, created in latest.items():
+        uid, month = divmod(key, n_months)
+        partials[month]["names"][str(uid)] = [created, user_names[codes[key]]]
+    return partials
+
+
+def merge_month_partials(months: Dict[str, Dict[str, Any]], year: int) -> Dict[str, Any]:
+    """CS/CHG/U per month, AU and top contributors from month partials only (a user's latest name wins)."""
+    cs_by_user: Dict[str, int] = defaultdict(int)
+    chg_by_user: Dict[str, int] = defaultdict(int)
+    names: Dict[str, Tuple[int, str]] = {}
+    for part in months.values():
+        for uid, (cs, chg) in part["users"].items():
+            cs_by_user[uid] += cs
+            chg_by_user[uid] += chg
+        for uid, (created, name) in part["names"].items():
+            if uid not in names or created >= names[uid][0]:
+                names[uid] = (created, name)
+    empty = {"CS": 0, "CHG": 0, "users": {}}
+    monthly = [
+        {"month": m, "CS": months.get(m, empty)["CS"], "CHG": months.get(m, empty)["CHG"], "U": len(months.get(m, empty)["users"])}
+        for m in month_keys(year)
+    ]
+    topk = sorted(chg_by_user, key=lambda uid: (-chg_by_user[uid], int(uid)))[:TOPK_USERS]
+    return {
+        "changesets": {
+            "CS_total": sum(part["CS"] for part in months.values()),
+            "CHG_total": sum(chg_by_user.values()),
+            "monthly": monthly,
+        },
+        "contributors": {
+            "U_total": len(cs_by_user),
+            "AU_10cs": sum(1 for n in cs_by_user.values() if n >= AU_CS_THRESHOLD),
+            "AU_500chg": sum(1 for n in chg_by_user.values() if n >= AU_CHG_THRESHOLD),
+            "topk_users_by_chg": [
+                {"uid": int(uid), "user": names.get(uid, (0, ""))[1], "CHG": chg_by_user[uid], "CS": cs_by_user[uid]}
+                for uid in topk
+            ],
+        },
+    }
+
+
+def incremental_changeset_metrics(
+    base_dir: Path, table: ColumnTable, year: int, in_region_only: bool = True
+) -> Dict[str, Any]:
+    """Changeset and contributor metrics backed by stats/partials/changesets.json.
+
+    Only months whose fingerprint moved since the last run are regrouped; the rest are merged from
+    their stored partials. Users are kept as exact per-month sets, so U/AU stay exact after merging.
+    """
+    path = base_dir / "stats" / PARTIALS_DIR / "changesets.json"
+    scope = {"year": year, "in_region_only": in_region_only}
+    previous = load_partials(path, scope)
+    keep = table.columns["in_region"] if in_region_only else None
+    month_names = table.dicts["month"]
+    fingerprints = _month_fingerprints(table, keep)
+    dirty = {code for code, key in fingerprints.items() if (previous.get(month_names[code]) or {}).get("key") != key}
+
+    months: Dict[str, Dict[str, Any]] = {}
+    for code, part in _month_partials(table, keep, dirty).items():
+        months[month_names[code]] = {"key": fingerprints[code], **part}
+    for code in fingerprints.keys() - dirty:
+        months[month_names[code]] = previous[month_names[code]]
+    if dirty or months.keys() != previous.keys():
+        save_partials(path, scope, months)
+
+    result = merge_month_partials(months, year)
+    result["changesets"]["bbox_hit_CS_total"] = len(table)
+    result["incremental"] = {
+        "months_recomputed": sorted(month_names[code] for code in dirty),
+        "months_reused": sorted(month_names[code] for code in fingerprints.keys() - dirty),
+    }
+    return result
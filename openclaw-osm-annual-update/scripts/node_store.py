@@ -0,0 +1,207 @@
+#!/usr/bin/env python3
+from __future__ import annotations
+
+import argparse
+import datetime as dt
+import json
+import sqlite3
+import threading
+import xml.etree.ElementTree as ET
+from concurrent.futures import ThreadPoolExecutor, as_completed
+from pathlib import Path
+from typing import Dict, Iterable, Iterator, List, Tuple
+
+from common import HttpClient, HttpError, append_log, update_quality
+
+MAX_URL_LENGTH = 8000
+SQLITE_MAX_VARIABLES = 900
+
+Coord = Tuple[float, float]
+
+
+class NodeStore:
+    """SQLite node coordinate cache (id -> lat/lon) in WAL mode, shared across regions and years."""
+
+    def __init__(self, path: Path) -> None:
+        self.path = path
+        path.parent.mkdir(parents=True, exist_ok=True)
+        self._local = threading.local()
+        self._write_lock = threading.Lock()
+        conn = self._conn()
+        conn.execute("PRAGMA journal_mode=WAL")
+        conn.execute("CREATE TABLE IF NOT EXISTS nodes (id INTEGER PRIMARY KEY, lat REAL NOT NULL, lon REAL NOT NULL)")
+        conn.commit()
+
+    def _conn(self) -> sqlite3.Connection:
+        conn = getattr(self._local, "conn", None)
+        if conn is None:
+            conn = sqlite3.connect(self.path, timeout=60)
+            conn.execute("PRAGMA synchronous=NORMAL")
+            self._local.conn = conn
+        return conn
+
+    def get_many(self, ids: Iterable[int]) -> Dict[int, Coord]:
+        found: Dict[int, Coord] = {}
+        id_list = list(ids)
+        conn = self._conn()
+        for i in range(0, len(id_list), SQLITE_MAX_VARIABLES):
+            chunk = id_list[i : i + SQLITE_MAX_VARIABLES]
+            placeholders = ",".join("?" * len(chunk))
+            for node_id, lat, lon in conn.execute(f"SELECT id, lat, lon FROM nodes WHERE id IN ({placeholders})", chunk):
+                found[node_id] = (lat, lon)
+        return found
+
+    def missing(self, ids: Iterable[int]) -> List[int]:
+        id_set = set(ids)
+        return sorted(id_set - self.get_many(id_set).keys())
+
+    def put_many(self, rows: Iterable[Tuple[int, float, float]]) -> int:
+        rows = list(rows)
+        if not rows:
+            return 0
+        with self._write_lock:
+            conn = self._conn()
+            with conn:
+                conn.executemany("INSERT OR REPLACE INTO nodes (id, lat, lon) VALUES (?, ?, ?)", rows)
+        return len(rows)
+
+    def close(self) -> None:
+        conn = getattr(self._local, "conn", None)
+        if conn is not None:
+            conn.close()
+            self._local.conn = None
+
+
+def url_batches(base_url: str, ids: List[int], max_url_length: int = MAX_URL_LENGTH) -> Iterator[List[int]]:
+    # Pack as many ids as fit into one URL: "<base>?nodes=1,2,3"
+    budget = max_url_length - len(base_url) - len("?nodes=")
+    batch: List[int] = []
+    used = 0
+    for node_id in ids:
+        cost = len(str(node_id)) + (1 if batch else 0)
+        if batch and used + cost > budget:
+            yield batch
+            batch, used = [], 0
+            cost = len(str(node_id))
+        batch.append(node_id)
+        used += cost
+    if batch:
+        yield batch
+
+
+def parse_nodes(xml_bytes: bytes) -> List[Tuple[int, float, float]]:
+    rows = []
+    for node in ET.fromstring(xml_bytes).iter("node"):
+        # Deleted nodes come back visible="false" without coordinates
+        if node.get("lat") is None or node.get("lon") is None:
+            continue
+        rows.append((int(node.get("id")), float(node.get("lat")), float(node.get("lon"))))
+    return rows
+
+
+def fetch_batch(client: HttpClient, url: str, batch: List[int]) -> Tuple[List[Tuple[int, float, float]], List[int]]:
+    # The API answers 404/410 for the whole request if any id is unknown: bisect to isolate it.
+    # The query is built by hand: urlencode would send each comma as %2C and overshoot the url_batches budget.
+    try:
+        rows = parse_nodes(client.get(f"{url}?nodes={','.join(str(i) for i in batch)}"))
+    except HttpError as exc:
+        if exc.status not in (404, 410, 414):
+            raise
+        if len(batch) == 1:
+            if exc.status == 414:
+                raise
+            return [], batch
+        mid = len(batch) // 2
+        left_rows, left_missing = fetch_batch(client, url, batch[:mid])
+        right_rows, right_missing = fetch_batch(client, url, batch[mid:])
+        return left_rows + right_rows, left_missing + right_missing
+    got = {r[0] for r in rows}
+    return rows, [i for i in batch if i not in got]
+
+
+def fetch_missing_nodes(
+    store: NodeStore,
+    api_base: str,
+    node_ids: Iterable[int],
+    client: HttpClient,
+    workers: int = 4,
+    max_url_length: int = MAX_URL_LENGTH,
+) -> Dict[str, object]:
+    wanted = set(node_ids)
+    todo = store.missing(wanted)
+    url = f"{api_base}/api/0.6/nodes"
+    fetched = 0
+    unavailable: List[int] = []
+    errors: List[Dict[str, object]] = []
+    batches = list(url_batches(url, todo, max_url_length))
+
+    with ThreadPoolExecutor(max_workers=max(1, workers)) as pool:
+        futures = {pool.submit(fetch_batch, client, url, batch): batch for batch in batches}
+        for future in as_completed(futures):
+            try:
+                rows, missing = future.result()
+            except (HttpError, OSError) as exc:
+                batch = futures[future]
+                errors.append({"stage": "nodes", "batch_size": len(batch), "first_id": batch[0], "error": str(exc)})
+                unavailable.extend(batch)
+                continue
+            # Inserts happen on this thread only: one writer, bulk transactions
+            fetched += store.put_many(rows)
+            unavailable.extend(missing)
+
+    return {
+        "requested": len(wanted),
+        "cached": len(wanted) - len(todo),
+        "fetched": fetched,
+        "requests": len(batches),
+        "unavailable": sorted(unavailable),
+        "errors": errors,
+        "retries": client.retries,
+    }
+
+
+def read_highway_ways(path: Path) -> Iterator[Dict[str, object]]:
+    if not path.exists():
+        return
+    with path.open("r", encoding="utf-8") as f:
+        for line in f:
+            if line.strip():
+                yield json.loads(line)
+
+
+def main() -> int:
+    parser = argparse.ArgumentParser(description="Fill the node coordinate cache for edited highway ways (Layer 3)")
+    parser.add_argument("--base-dir", required=True, help="outputs/<region>/<year>")
+    parser.add_argument("--node-cache", required=True, help="sqlite file shared across regions/years")
+    parser.add_argument("--osm-api-base", default="https://api.openstreetmap.org")
+    parser.add_argument("--workers", type=int, default=4)
+    parser.add_argument("--rate", type=float, default=2.0, help="max requests per second per host")
+    args = parser.parse_args()
+
+    base_dir = Path(args.base_dir)
+    log_path = base_dir / "logs" / "run.log"
+    node_ids = {int(n) for way in read_highway_ways(base_dir / "raw" / "highway_ways.jsonl") for n in way["nodes"]}
+
+    append_log(log_path, f"[{dt.datetime.utcnow().isoformat()}Z] start node_store ({len(node_ids)} nodes)")
+    store = NodeStore(Path(args.node_cache))
+    result = fetch_missing_nodes(store, args.osm_api_base, node_ids, HttpClient(rate=args.rate), workers=args.workers)
+    store.close()
+
+    unavailable = result.pop("unavailable")
+    result["unavailable"] = len(unavailable)
+    failures = []
+    if unavailable:
+        # Deleted/unknown nodes; their way segments are skipped by the length engine
+        failures.append({"stage": "nodes", "reason": "node unavailable", "count": len(unavailable), "sample": unavailable[:20]})
+    update_quality(
+        base_dir,
+        "nodes",
+        {"api_errors": result.pop("errors"), "retries": result.pop("retries"), "partial_failures": failures},
+    )
+    append_log(log_path, f"[{dt.datetime.utcnow().isoformat()}Z] node_store done: {json.dumps(result)}")
+    print(json.dumps({"status": "ok", **result}, ensure_ascii=False))
+    return 0
+
+
+if __name__ == "__main__":
+    raise SystemExit(main())
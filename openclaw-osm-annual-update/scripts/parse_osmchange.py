@@ -0,0 +1,224 @@
+#!/usr/bin/env python3
+from __future__ import annotations
+
+import argparse
+import datetime as dt
+import json
+import xml.etree.ElementTree as ET
+from concurrent.futures import ProcessPoolExecutor
+from pathlib import Path
+from typing import Any, Callable, Dict, Iterable, List, Optional, Set, Tuple
+
+from collect_changesets import load_changesets_table
+from columnar import DICT, ColumnTable
+from common import append_log, open_osc, osc_path, update_quality, write_json
+from node_store import NodeStore
+
+ELEMENT_TYPES = ("node", "way", "relation")
+ACTIONS = ("create", "modify", "delete")
+TAG_CATEGORIES = ("roads", "buildings", "pois", "landuse", "water", "boundaries")
+
+# Precompiled classification tables (metric_definitions.md, FEAT_EDIT_BY_TAG):
+# key -> category for "key=*" rules, (key, value) -> category for exact matches.
+# roads only counts ways, per "way + highway=*".
+KEY_RULES: Dict[str, str] = {
+    "highway": "roads",
+    "building": "buildings",
+    "amenity": "pois",
+    "shop": "pois",
+    "tourism": "pois",
+    "landuse": "landuse",
+    "waterway": "water",
+    "boundary": "boundaries",
+}
+KEY_VALUE_RULES: Dict[Tuple[str, str], str] = {("natural", "water"): "water"}
+WAY_ONLY_CATEGORIES = frozenset({"roads"})
+GEOMETRY_ACTIONS = frozenset({"create", "modify"})
+
+ChangesetCallback = Callable[[int, Dict[str, Any]], None]
+
+# Per-changeset edit counts (stats/edits.col) for re-aggregation by month/type/tag without reparsing
+EDIT_SCHEMA = {"changeset_id": "q", "month": DICT, "element_type": DICT, "action": DICT, "count": "q"}
+TAG_EDIT_SCHEMA = {"changeset_id": "q", "month": DICT, "category": DICT, "count": "q"}
+
+
+def empty_partial() -> Dict[str, Any]:
+    return {
+        "FEAT_EDIT": {t: {a: 0 for a in ACTIONS} for t in ELEMENT_TYPES},
+        "FEAT_EDIT_BY_TAG": {c: 0 for c in TAG_CATEGORIES},
+        "unique": {t: [] for t in ELEMENT_TYPES},
+        # Layer 3 inputs: [way_id, action, [node refs]] for highway ways, [id, lat, lon] for nodes
+        "highways": [],
+        "coords": [],
+    }
+
+
+def classify(element_type: str, tags: Iterable[Tuple[str, str]]) -> set:
+    categories = set()
+    for key, value in tags:
+        category = KEY_RULES.get(key) or KEY_VALUE_RULES.get((key, value))
+        if category and (category not in WAY_ONLY_CATEGORIES or element_type == "way"):
+            categories.add(category)
+    return categories
+
+
+def parse_osc(path: Path) -> Dict[str, Any]:
+    """Stream one OsmChange file into a partial aggregate.
+
+    Each finished element is removed from its <create>/<modify>/<delete> parent right away,
+    so memory stays flat regardless of file size.
+    """
+    partial = empty_partial()
+    feat_edit = partial["FEAT_EDIT"]
+    by_tag = partial["FEAT_EDIT_BY_TAG"]
+    unique = {t: set() for t in ELEMENT_TYPES}
+    highways = partial["highways"]
+    coords = partial["coords"]
+    action: Optional[str] = None
+    action_elem: Optional[ET.Element] = None
+
+    with open_osc(path) as f:
+        for event, elem in ET.iterparse(f, events=("start", "end")):
+            tag = elem.tag
+            if event == "start":
+                if tag in ACTIONS:
+                    action, action_elem = tag, elem
+                continue
+            if tag in ELEMENT_TYPES and action is not None:
+                element_id = int(elem.get("id", 0))
+                feat_edit[tag][action] += 1
+                unique[tag].add(element_id)
+                tags = [(t.get("k", ""), t.get("v", "")) for t in elem.iterfind("tag")]
+                categories = classify(tag, tags)
+                for category in categories:
+                    by_tag[category] += 1
+                if action in GEOMETRY_ACTIONS:
+                    if tag == "node" and elem.get("lat") is not None:
+                        coords.append([element_id, float(elem.get("lat")), float(elem.get("lon"))])
+                    elif tag == "way" and "roads" in categories:
+                        refs = [int(nd.get("ref")) for nd in elem.iterfind("nd")]
+                        highways.append([element_id, action, refs])
+                if action_elem is not None:
+                    action_elem.remove(elem)
+            elif tag in ACTIONS:
+                action, action_elem = None, None
+                elem.clear()
+
+    partial["unique"] = {t: sorted(ids) for t, ids in unique.items()}
+    return partial
+
+
+def parse_changeset(args: Tuple[int, str]) -> Tuple[int, Dict[str, Any]]:
+    changeset_id, path = args
+    return changeset_id, parse_osc(Path(path))
+
+
+def merge_partials(partials: Iterable[Dict[str, Any]]) -> Dict[str, Any]:
+    total = empty_partial()
+    unique = {t: set() for t in ELEMENT_TYPES}
+    for partial in partials:
+        for t in ELEMENT_TYPES:
+            for a in ACTIONS:
+                total["FEAT_EDIT"][t][a] += partial["FEAT_EDIT"][t][a]
+            unique[t].update(partial["unique"][t])
+        for c in TAG_CATEGORIES:
+            total["FEAT_EDIT_BY_TAG"][c] += partial["FEAT_EDIT_BY_TAG"][c]
+    return {
+        "FEAT_EDIT_total": total["FEAT_EDIT"],
+        "FEAT_EDIT_BY_TAG_total": total["FEAT_EDIT_BY_TAG"],
+        "UNIQUE_FEAT_total": {t: len(ids) for t, ids in unique.items()},
+    }
+
+
+def aggregate_downloads(
+    download_dir: Path,
+    changeset_ids: Iterable[int],
+    workers: int = 0,
+    on_changeset: Optional[ChangesetCallback] = None,
+    count_ids: Optional[Set[int]] = None,
+) -> Tuple[Dict[str, Any], List[Dict[str, Any]]]:
+    jobs: List[Tuple[int, str]] = []
+    missing: List[Dict[str, Any]] = []
+    for changeset_id in changeset_ids:
+        path = osc_path(download_dir, changeset_id)
+        if path is None:
+            missing.append({"stage": "parse", "changeset_id": changeset_id, "reason": "osc missing"})
+        else:
+            jobs.append((changeset_id, str(path)))
+
+    partials: List[Dict[str, Any]] = []
+    with ProcessPoolExecutor(max_workers=workers or None) as pool:
+        for changeset_id, partial in pool.map(parse_changeset, jobs, chunksize=16):
+            if on_changeset is not None:
+                on_changeset(changeset_id, partial)
+            # Geometry has been handed off; only counters are kept for the merge
+            del partial["highways"], partial["coords"]
+            # Road geometry is filtered per node later; feature counts follow the changeset's region test
+            if count_ids is None or changeset_id in count_ids:
+                partials.append(partial)
+    return merge_partials(partials), missing
+
+
+def main() -> int:
+    parser = argparse.ArgumentParser(description="Aggregate FEAT_EDIT / FEAT_EDIT_BY_TAG from downloaded OsmChange files")
+    parser.add_argument("--base-dir", required=True, help="outputs/<region>/<year>")
+    parser.add_argument("--workers", type=int, default=0, help="parser processes (default: CPU count)")
+    parser.add_argument("--node-cache", default=None, help="sqlite node cache to seed with coordinates from the diffs")
+    args = parser.parse_args()
+
+    base_dir = Path(args.base_dir)
+    log_path = base_dir / "logs" / "run.log"
+    table = load_changesets_table(base_dir)
+    ids = table.columns["id"]
+    months = dict(zip(ids, table.values("month")))
+    edits = ColumnTable(EDIT_SCHEMA)
+    tag_edits = ColumnTable(TAG_EDIT_SCHEMA)
+    store = NodeStore(Path(args.node_cache)) if args.node_cache else None
+    ways_path = base_dir / "raw" / "highway_ways.jsonl"
+
+    append_log(log_path, f"[{dt.datetime.utcnow().isoformat()}Z] start parse_osmchange")
+    with ways_path.open("w", encoding="utf-8") as ways_file:
+
+        def on_changeset(changeset_id: int, partial: Dict[str, Any]) -> None:
+            month = months.get(changeset_id, "")
+            for element_type, actions in partial["FEAT_EDIT"].items():
+                for action, count in actions.items():
+                    if count:
+                        edits.append(
+                            {
+                                "changeset_id": changeset_id,
+                                "month": month,
+                                "element_type": element_type,
+                                "action": action,
+                                "count": count,
+                            }
+                        )
+            for category, count in partial["FEAT_EDIT_BY_TAG"].items():
+                if count:
+                    tag_edits.append({"changeset_id": changeset_id, "month": month, "category": category, "count": count})
+            for way_id, action, refs in partial["highways"]:
+                record = {"changeset_id": changeset_id, "month": month, "way_id": way_id, "action": action, "nodes": refs}
+                ways_file.write(json.dumps(record, separators=(",", ":")) + "\n")
+            if store is not None:
+                store.put_many(tuple(c) for c in partial["coords"])
+
+        features, missing = aggregate_downloads(
+            base_dir / "raw" / "changeset_download",
+            ids,
+            args.workers,
+            on_changeset,
+            count_ids={i for i, ok in zip(ids, table.columns["in_region"]) if ok},
+        )
+    if store is not None:
+        store.close()
+    write_json(base_dir / "stats" / "features.json", features)
+    edits.save(base_dir / "stats" / "edits.col")
+    tag_edits.save(base_dir / "stats" / "tag_edits.col")
+    update_quality(base_dir, "parse", {"partial_failures": missing})
+    append_log(log_path, f"[{dt.datetime.utcnow().isoformat()}Z] features.json written ({len(missing)} osc missing)")
+    print(json.dumps({"status": "ok", "features_json": str(base_dir / "stats" / "features.json")}, ensure_ascii=False))
+    return 0
+
+
+if __name__ == "__main__":
+    raise SystemExit(main())
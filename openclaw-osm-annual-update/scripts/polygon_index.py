@@ -0,0 +1,170 @@
+from __future__ import annotations
+
+import math
+from array import array
+from typing import Any, Dict, Iterable, List, Optional, Sequence, Tuple
+
+from common import geometry_bbox
+
+try:
+    import numpy as np
+except ImportError:  # numpy is optional: contains_many falls back to the per-point grid lookup
+    np = None
+
+OUTSIDE, INSIDE, BOUNDARY = 0, 1, 2
+MIN_GRID = 8
+MAX_GRID = 256
+MAX_PAIRS_PER_CHUNK = 4_000_000
+
+
+def polygon_rings(geometry: Dict[str, Any]) -> List[List[Tuple[float, float]]]:
+    kind = geometry.get("type")
+    coords = geometry.get("coordinates") or []
+    if kind == "Polygon":
+        polygons = [coords]
+    elif kind == "MultiPolygon":
+        polygons = coords
+    else:
+        raise ValueError(f"Unsupported geometry type for region index: {kind}")
+    return [[(float(p[0]), float(p[1])) for p in ring] for polygon in polygons for ring in polygon]
+
+
+class PolygonIndex:
+    """Grid index over a (Multi)Polygon for fast even-odd point-in-polygon tests.
+
+    Cells the boundary never touches are resolved once (inside/outside) at build time;
+    points in boundary cells are ray-cast only against the edges of their latitude band.
+    """
+
+    def __init__(self, geometry: Dict[str, Any], grid: int = 0) -> None:
+        self.min_x, self.min_y, self.max_x, self.max_y = geometry_bbox(geometry)
+        self.x1, self.y1, self.x2, self.y2 = array("d"), array("d"), array("d"), array("d")
+        for ring in polygon_rings(geometry):
+            for (ax, ay), (bx, by) in zip(ring, ring[1:] + ring[:1]):
+                # Horizontal edges never cross a horizontal ray
+                if ay != by:
+                    self.x1.append(ax)
+                    self.y1.append(ay)
+                    self.x2.append(bx)
+                    self.y2.append(by)
+
+        self.grid = grid or max(MIN_GRID, min(MAX_GRID, int(math.sqrt(len(self.x1)))))
+        self.cell_w = (self.max_x - self.min_x) / self.grid or 1e-12
+        self.cell_h = (self.max_y - self.min_y) / self.grid or 1e-12
+
+        self.bands: List[array] = [array("q") for _ in range(self.grid)]
+        self.cells = bytearray(self.grid * self.grid)
+        for i in range(len(self.x1)):
+            ix0, ix1 = sorted((self._col(self.x1[i]), self._col(self.x2[i])))
+            iy0, iy1 = sorted((self._row(self.y1[i]), self._row(self.y2[i])))
+            for iy in range(iy0, iy1 + 1):
+                self.bands[iy].append(i)
+                row = iy * self.grid
+                for ix in range(ix0, ix1 + 1):
+                    self.cells[row + ix] = BOUNDARY
+        for iy in range(self.grid):
+            self._fill_row(iy)
+
+        if np is not None:
+            self._np_edges = tuple(np.frombuffer(a, dtype=np.float64) for a in (self.x1, self.y1, self.x2, self.y2))
+            self._np_cells = np.frombuffer(bytes(self.cells), dtype=np.uint8)
+
+    def _col(self, x: float) -> int:
+        return min(self.grid - 1, max(0, int((x - self.min_x) / self.cell_w)))
+
+    def _row(self, y: float) -> int:
+        return min(self.grid - 1, max(0, int((y - self.min_y) / self.cell_h)))
+
+    def _fill_row(self, iy: int) -> None:
+        # One parity sweep per row: every crossing of the row's centre line lies in a
+        # boundary cell, so sweeping left to right resolves every other cell of the row.
+        cy = self.min_y + (iy + 0.5) * self.cell_h
+        x1, y1, x2, y2 = self.x1, self.y1, self.x2, self.y2
+        crossings = sorted(
+            x1[i] + (cy - y1[i]) * (x2[i] - x1[i]) / (y2[i] - y1[i])
+            for i in self.bands[iy]
+            if (y1[i] > cy) != (y2[i] > cy)
+        )
+        row = iy * self.grid
+        passed = 0
+        for ix in range(self.grid):
+            if self.cells[row + ix] == BOUNDARY:
+                continue
+            cx = self.min_x + (ix + 0.5) * self.cell_w
+            while passed < len(crossings) and crossings[passed] <= cx:
+                passed += 1
+            # Same rule as _ray_cast: count the crossings strictly right of the centre
+            self.cells[row + ix] = INSIDE if (len(crossings) - passed) % 2 else OUTSIDE
+
+    def _ray_cast(self, x: float, y: float, band: int) -> bool:
+        inside = False
+        x1, y1, x2, y2 = self.x1, self.y1, self.x2, self.y2
+        for i in self.bands[band]:
+            if (y1[i] > y) != (y2[i] > y) and x < x1[i] + (y - y1[i]) * (x2[i] - x1[i]) / (y2[i] - y1[i]):
+                inside = not inside
+        return inside
+
+    def contains(self, lon: float, lat: float) -> bool:
+        if not (self.min_x <= lon <= self.max_x and self.min_y <= lat <= self.max_y):
+            return False
+        iy = self._row(lat)
+        state = self.cells[iy * self.grid + self._col(lon)]
+        if state != BOUNDARY:
+            return state == INSIDE
+        return self._ray_cast(lon, lat, iy)
+
+    def contains_many(self, lons: Sequence[float], lats: Sequence[float]) -> List[bool]:
+        if np is None:
+            return [self.contains(x, y) for x, y in zip(lons, lats)]
+
+        x = np.asarray(lons, dtype=np.float64)
+        y = np.asarray(lats, dtype=np.float64)
+        result = np.zeros(x.shape, dtype=bool)
+        in_bbox = (x >= self.min_x) & (x <= self.max_x) & (y >= self.min_y) & (y <= self.max_y)
+        idx = np.nonzero(in_bbox)[0]
+        if idx.size == 0:
+            return result.tolist()
+
+        ix = np.clip(((x[idx] - self.min_x) / self.cell_w).astype(np.int64), 0, self.grid - 1)
+        iy = np.clip(((y[idx] - self.min_y) / self.cell_h).astype(np.int64), 0, self.grid - 1)
+        state = self._np_cells[iy * self.grid + ix]
+        result[idx[state == INSIDE]] = True
+
+        boundary = state == BOUNDARY
+        ex1, ey1, ex2, ey2 = self._np_edges
+        for band in np.unique(iy[boundary]):
+            points = idx[boundary & (iy == band)]
+            edges = np.frombuffer(self.bands[band], dtype=np.int64)
+            bx1, by1, bx2, by2 = ex1[edges], ey1[edges], ex2[edges], ey2[edges]
+            step = max(1, MAX_PAIRS_PER_CHUNK // max(1, edges.size))
+            for start in range(0, points.size, step):
+                chunk = points[start : start + step]
+                px = x[chunk][:, None]
+                py = y[chunk][:, None]
+                crosses = ((by1 > py) != (by2 > py)) & (px < bx1 + (py - by1) * (bx2 - bx1) / (by2 - by1))
+                result[chunk] = (crosses.sum(axis=1) % 2) == 1
+        return result.tolist()
+
+
+def region_index(region: Dict[str, Any]) -> Optional[PolygonIndex]:
+    geometry = region.get("geometry")
+    if not geometry or geometry.get("type") not in ("Polygon", "MultiPolygon"):
+        return None
+    return PolygonIndex(geometry)
+
+
+def bbox_centroids(rows: Iterable[Dict[str, Any]]) -> Tuple[List[float], List[float], List[int]]:
+    # Changeset centroid = centre of its bbox; rows without a bbox are left out
+    lons: List[float] = []
+    lats: List[float] = []
+    positions: List[int] = []
+    for pos, row in enumerate(rows):
+        try:
+            lon = (float(row["min_lon"]) + float(row["max_lon"])) / 2
+            lat = (float(row["min_lat"]) + float(row["max_lat"])) / 2
+        except (KeyError, TypeError, ValueError):
+            continue
+        lons.append(lon)
+        lats.append(lat)
+        positions.append(pos)
+    return lons, lats, positions
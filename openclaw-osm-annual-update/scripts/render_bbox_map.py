@@ -2,13 +2,26 @@
 from __future__ import annotations
 
 import argparse
+import hashlib
 import json
+import math
 import os
+import shutil
 import urllib.parse
 import urllib.request
 from pathlib import Path
+from typing import Any, Dict, Optional
 
-from common import append_log
+from common import PackedGeometry, append_log
+from map_raster import Canvas, Viewport, paste_tiles
+
+BACKENDS = ("auto", "mapbox", "local")
+BACKGROUND = (242, 239, 233)
+BOUNDARY_FILL = (0, 122, 255)
+BOUNDARY_LINE = (0, 86, 179)
+BBOX_LINE = (255, 45, 85)
+# Boundary vertices closer than this (in pixels) to the simplified outline are dropped before drawing
+SIMPLIFY_PX = 0.5
 
 
 def make_bbox_polygon(min_lon: float, min_lat: float, max_lon: float, max_lat: float) -> dict:
@@ -30,38 +43,88 @@ def make_bbox_polygon(min_lon: float, min_lat: float, max_lon: float, max_lat: f
     }
 
 
-def main() -> int:
-    parser = argparse.ArgumentParser(description="Render bbox overlay map via Mapbox Static API")
-    parser.add_argument("--region-json", required=True)
-    parser.add_argument("--out-png", required=True)
-    parser.add_argument("--mapbox-token-env", default="MAPBOX_ACCESS_TOKEN")
-    parser.add_argument("--mapbox-style", default="mapbox/streets-v12")
-    parser.add_argument("--image-size", default="1000x700")
-    args = parser.parse_args()
-
-    region_path = Path(args.region_json)
-    out_png = Path(args.out_png)
+def render_local(
+    region: Dict[str, Any],
+    out_png: Path,
+    image_size: str = "1000x700",
+    cache_dir: Optional[Path] = None,
+    tile_dir: Optional[Path] = None,
+) -> Dict[str, Any]:
+    """Rasterize boundary + bbox in Web Mercator without network; renders are cached by polygon_hash."""
+    width, height = (int(v) for v in image_size.lower().split("x"))
+    bbox = [float(v) for v in region["bbox"]["final"]]
+    cached = None
+    if cache_dir is not None:
+        variant = json.dumps([bbox, image_size, str(tile_dir or "")]).encode("utf-8")
+        name = f"{region.get('polygon_hash') or 'nogeom'}_{hashlib.sha256(variant).hexdigest()[:12]}.png"
+        cached = cache_dir / name
+        if cached.exists():
+            out_png.parent.mkdir(parents=True, exist_ok=True)
+            shutil.copyfile(cached, out_png)
+            return {"status": "ok", "out_png": str(out_png), "backend": "local", "cached": True}
+
+    view = Viewport(bbox, width, height)
+    canvas = Canvas(width, height, BACKGROUND)
+    tiles = paste_tiles(canvas, view, tile_dir) if tile_dir is not None and tile_dir.exists() else 0
+
+    geometry = region.get("geometry") or {}
+    rings = []
+    if geometry.get("type") in ("Polygon", "MultiPolygon"):
+        # Pixel size in degrees of longitude, narrowed by cos(lat) so it is also safe vertically
+        tolerance = SIMPLIFY_PX * 360.0 / view.scale * math.cos(math.radians((bbox[1] + bbox[3]) / 2))
+        packed = PackedGeometry.from_geometry(geometry).simplify(tolerance)
+        rings = [[view.project(lon, lat) for lon, lat in ring] for ring in packed.rings()]
+    canvas.fill_polygon(rings, BOUNDARY_FILL, 0.18)
+    for ring in rings:
+        canvas.polyline(ring, BOUNDARY_LINE, width=2)
+    corners = [(bbox[0], bbox[1]), (bbox[2], bbox[1]), (bbox[2], bbox[3]), (bbox[0], bbox[3])]
+    canvas.polyline([view.project(lon, lat) for lon, lat in corners], BBOX_LINE, width=3)
+
+    png = canvas.to_png()
+    out_png.parent.mkdir(parents=True, exist_ok=True)
+    out_png.write_bytes(png)
+    if cached is not None:
+        cached.parent.mkdir(parents=True, exist_ok=True)
+        tmp = cached.with_name(cached.name + f".{os.getpid()}.part")
+        tmp.write_bytes(png)
+        os.replace(tmp, cached)
+    return {"status": "ok", "out_png": str(out_png), "backend": "local", "cached": False, "tiles": tiles}
+
+
+def render_bbox_map(
+    region: Dict[str, Any],
+    out_png: Path,
+    mapbox_token_env: str = "MAPBOX_ACCESS_TOKEN",
+    mapbox_style: str = "mapbox/streets-v12",
+    image_size: str = "1000x700",
+    backend: str = "auto",
+    cache_dir: Optional[Path] = None,
+    tile_dir: Optional[Path] = None,
+) -> Dict[str, Any]:
+    """Render the bbox overlay for an in-memory region.json; returns the status record.
+
+    ``auto`` uses Mapbox when a token is set and the local renderer otherwise.
+    """
     log_path = out_png.parent.parent / "logs" / "run.log"
-
-    with region_path.open("r", encoding="utf-8") as f:
-        region = json.load(f)
-
     bbox = region["bbox"]["final"]
     min_lon, min_lat, max_lon, max_lat = [float(v) for v in bbox]
 
-    token = os.getenv(args.mapbox_token_env)
+    token = os.getenv(mapbox_token_env)
+    if backend == "local" or (backend == "auto" and not token):
+        result = render_local(region, out_png, image_size, cache_dir, tile_dir)
+        append_log(log_path, f"bbox map rendered locally: {out_png} (cached={result['cached']})")
+        return result
     if not token:
-        append_log(log_path, f"Mapbox token env missing: {args.mapbox_token_env}")
-        print(json.dumps({"status": "skipped", "reason": "missing token env"}, ensure_ascii=False))
-        return 0
+        append_log(log_path, f"Mapbox token env missing: {mapbox_token_env}")
+        return {"status": "skipped", "reason": "missing token env"}
 
     feature = make_bbox_polygon(min_lon, min_lat, max_lon, max_lat)
     encoded = urllib.parse.quote(json.dumps(feature, separators=(",", ":"), ensure_ascii=False), safe="")
     overlay = f"geojson({encoded})"
 
     static_url = (
-        f"https://api.mapbox.com/styles/v1/{args.mapbox_style}/static/"
-        f"{overlay}/[{min_lon},{min_lat},{max_lon},{max_lat}]/{args.image_size}"
+        f"https://api.mapbox.com/styles/v1/{mapbox_style}/static/"
+        f"{overlay}/[{min_lon},{min_lat},{max_lon},{max_lat}]/{image_size}"
         f"?access_token={token}"
     )
 
@@ -71,7 +134,35 @@ def main() -> int:
         out_png.write_bytes(r.read())
 
     append_log(log_path, f"bbox map saved: {out_png}")
-    print(json.dumps({"status": "ok", "out_png": str(out_png)}, ensure_ascii=False))
+    return {"status": "ok", "out_png": str(out_png), "backend": "mapbox"}
+
+
+def main() -> int:
+    parser = argparse.ArgumentParser(description="Render bbox overlay map via Mapbox Static API")
+    parser.add_argument("--region-json", required=True)
+    parser.add_argument("--out-png", required=True)
+    parser.add_argument("--mapbox-token-env", default="MAPBOX_ACCESS_TOKEN")
+    parser.add_argument("--mapbox-style", default="mapbox/streets-v12")
+    parser.add_argument("--image-size", default="1000x700")
+    parser.add_argument("--backend", choices=BACKENDS, default="auto", help="auto: Mapbox if a token is set, else local")
+    parser.add_argument("--map-cache-dir", default=None, help="cache for local renders (keyed by polygon_hash)")
+    parser.add_argument("--tile-dir", default=None, help="local XYZ tile cache <z>/<x>/<y>.png drawn under the overlay")
+    args = parser.parse_args()
+
+    with Path(args.region_json).open("r", encoding="utf-8") as f:
+        region = json.load(f)
+
+    result = render_bbox_map(
+        region,
+        Path(args.out_png),
+        args.mapbox_token_env,
+        args.mapbox_style,
+        args.image_size,
+        backend=args.backend,
+        cache_dir=Path(args.map_cache_dir) if args.map_cache_dir else None,
+        tile_dir=Path(args.tile_dir) if args.tile_dir else None,
+    )
+    print(json.dumps(result, ensure_ascii=False))
     return 0
 
 
@@ -4,22 +4,86 @@ from __future__ import annotations
 import argparse
 import datetime as dt
 import json
-import urllib.parse
-import urllib.request
 from pathlib import Path
-from typing import Any, Dict, List, Tuple
+from typing import Any, Callable, Dict, List, Optional, Tuple
 
-from common import append_log, bbox_diff, ensure_output_tree, geometry_bbox, parse_bbox_list, polygon_hash, slugify_region, write_json
+from common import (
+    DEFAULT_CACHE_TTL,
+    CacheMiss,
+    HttpClient,
+    PackedGeometry,
+    ResponseCache,
+    append_log,
+    bbox_area_km2,
+    bbox_diff,
+    ensure_output_tree,
+    geometry_bbox,
+    parse_bbox_list,
+    polygon_hash,
+    slugify_region,
+    write_json,
+)
 
+# Nominatim usage policy: at most one request per second
+NOMINATIM_RATE = 1.0
 
-def get_json(url: str, params: Dict[str, Any]) -> Any:
-    qs = urllib.parse.urlencode(params)
-    req = urllib.request.Request(
-        f"{url}?{qs}",
-        headers={"User-Agent": "openclaw-osm-annual-update/1.0"},
-    )
-    with urllib.request.urlopen(req, timeout=30) as r:
-        return json.loads(r.read().decode("utf-8"))
+
+def get_json(
+    url: str,
+    params: Dict[str, Any],
+    client: Optional[HttpClient] = None,
+    cache: Optional[ResponseCache] = None,
+    offline: bool = False,
+    validate: Optional[Callable[[Dict[str, Any]], bool]] = None,
+    meta: Optional[Callable[[Any], Dict[str, Any]]] = None,
+) -> Any:
+    if cache is not None:
+        entry = cache.get(url, params, allow_stale=offline, validate=validate)
+        if entry is not None:
+            return entry["body"]
+    if offline:
+        raise CacheMiss(f"offline and no valid cached response: {url} {json.dumps(params, sort_keys=True)}")
+    client = client or HttpClient(rate=NOMINATIM_RATE, timeout=30)
+    body = json.loads(client.get(url, params).decode("utf-8"))
+    if cache is not None:
+        cache.put(url, params, body, meta(body) if meta else None)
+    return body
+
+
+def lookup_meta(payload: Dict[str, Any]) -> Dict[str, Any]:
+    features = payload.get("features") or []
+    geometry = features[0].get("geometry") if features else None
+    return {"polygon_hash": polygon_hash(geometry) if geometry else None}
+
+
+def recorded_polygon_hash(region_json_path: Path, osm_type: str, osm_id: int) -> Optional[str]:
+    """polygon_hash a previous run recorded in meta/region.json for this OSM object, if any."""
+    try:
+        region = json.loads(region_json_path.read_text(encoding="utf-8"))
+    except (OSError, ValueError):
+        return None
+    chosen = region.get("chosen_osm_object") or {}
+    if chosen.get("osm_type") != osm_type or chosen.get("osm_id") != osm_id:
+        return None
+    return region.get("polygon_hash")
+
+
+def lookup_validator(known_hash: Optional[str]) -> Callable[[Dict[str, Any]], bool]:
+    """Accept a cached lookup only if its boundary hashes to ``known_hash``.
+
+    ``known_hash`` is the polygon_hash of the boundary already recorded for this region, so a cache
+    entry that drifted from the analysed boundary is refetched (or fails with --offline). Without a
+    recorded hash the only check left is that the body still hashes to what was stored with it at
+    put time, which catches damaged or hand-edited cache files but says nothing about upstream.
+    """
+
+    def is_valid(entry: Dict[str, Any]) -> bool:
+        body_hash = lookup_meta(entry["body"]).get("polygon_hash")
+        if body_hash != (entry.get("meta") or {}).get("polygon_hash"):
+            return False
+        return known_hash is None or body_hash == known_hash
+
+    return is_valid
 
 
 def select_candidate(candidates: List[Dict[str, Any]]) -> Tuple[Dict[str, Any], str]:
@@ -37,34 +101,41 @@ def select_candidate(candidates: List[Dict[str, Any]]) -> Tuple[Dict[str, Any],
     return chosen, reason
 
 
-def main() -> int:
-    parser = argparse.ArgumentParser(description="Resolve OSM administrative region + bbox")
-    parser.add_argument("--region-query", required=True)
-    parser.add_argument("--year", type=int, required=True)
-    parser.add_argument("--out-dir", default="outputs")
-    parser.add_argument("--timezone", default="UTC")
-    parser.add_argument("--nominatim-base", default="https://nominatim.openstreetmap.org")
-    parser.add_argument("--bbox-diff-threshold", type=float, default=0.01)
-    parser.add_argument("--bbox-area-ratio-threshold", type=float, default=0.05)
-    args = parser.parse_args()
-
-    region_slug = slugify_region(args.region_query)
-    base_dir = Path(args.out_dir) / region_slug / str(args.year)
+def resolve_region(
+    region_query: str,
+    year: int,
+    out_dir: str = "outputs",
+    timezone: str = "UTC",
+    nominatim_base: str = "https://nominatim.openstreetmap.org",
+    bbox_diff_threshold: float = 0.01,
+    bbox_area_ratio_threshold: float = 0.05,
+    cache: Optional[ResponseCache] = None,
+    offline: bool = False,
+    client: Optional[HttpClient] = None,
+) -> Dict[str, Any]:
+    """Resolve the region via Nominatim, write meta/region.json and return its content."""
+    region_slug = slugify_region(region_query)
+    base_dir = Path(out_dir) / region_slug / str(year)
     dirs = ensure_output_tree(base_dir)
     log_path = dirs["logs"] / "run.log"
 
     append_log(log_path, f"[{dt.datetime.utcnow().isoformat()}Z] start resolve_region")
+    client = client or HttpClient(rate=NOMINATIM_RATE, timeout=30)
+    hits, misses = (cache.hits, cache.misses) if cache else (0, 0)
 
-    search_url = f"{args.nominatim_base}/search"
-    search_params = {"q": args.region_query, "format": "jsonv2", "addressdetails": 1, "limit": 5}
-    candidates = get_json(search_url, search_params)
+    search_url = f"{nominatim_base}/search"
+    search_params = {"q": region_query, "format": "jsonv2", "addressdetails": 1, "limit": 5}
+    candidates = get_json(search_url, search_params, client, cache, offline)
     chosen, reason = select_candidate(candidates)
 
     osm_type = str(chosen.get("osm_type", "")).upper()[:1]
     osm_id = int(chosen.get("osm_id"))
-    lookup_url = f"{args.nominatim_base}/lookup"
+    lookup_url = f"{nominatim_base}/lookup"
     lookup_params = {"osm_ids": f"{osm_type}{osm_id}", "format": "geojson", "polygon_geojson": 1}
-    payload = get_json(lookup_url, lookup_params)
+    known_hash = recorded_polygon_hash(dirs["meta"] / "region.json", osm_type, osm_id)
+    payload = get_json(
+        lookup_url, lookup_params, client, cache, offline, validate=lookup_validator(known_hash), meta=lookup_meta
+    )
 
     features = payload.get("features", [])
     if not features:
@@ -75,7 +146,13 @@ def main() -> int:
     if not geom:
         raise ValueError("Lookup feature missing geometry")
 
-    bbox_from_geom = geometry_bbox(geom)
+    if geom.get("type") in ("Polygon", "MultiPolygon"):
+        packed = PackedGeometry.from_geometry(geom)
+        bbox_from_geom = packed.bbox()
+        geometry_area = packed.area_km2()
+    else:
+        bbox_from_geom = geometry_bbox(geom)
+        geometry_area = None
     bbox_lookup = None
     if "bbox" in feat:
         bbox_lookup = tuple(feat["bbox"])
@@ -90,26 +167,28 @@ def main() -> int:
         diff = bbox_diff(bbox_from_geom, bbox_lookup)
         over_threshold = any(
             [
-                diff["min_lon_diff"] > args.bbox_diff_threshold,
-                diff["min_lat_diff"] > args.bbox_diff_threshold,
-                diff["max_lon_diff"] > args.bbox_diff_threshold,
-                diff["max_lat_diff"] > args.bbox_diff_threshold,
-                diff["area_ratio_diff"] > args.bbox_area_ratio_threshold,
+                diff["min_lon_diff"] > bbox_diff_threshold,
+                diff["min_lat_diff"] > bbox_diff_threshold,
+                diff["max_lon_diff"] > bbox_diff_threshold,
+                diff["max_lat_diff"] > bbox_diff_threshold,
+                diff["area_ratio_diff"] > bbox_area_ratio_threshold,
             ]
         )
         if not over_threshold:
             final_bbox = bbox_lookup
             source = "lookup_bbox"
 
+    bbox_area = bbox_area_km2(final_bbox)
     region_json = {
         "meta": {
-            "region_query": args.region_query,
+            "region_query": region_query,
             "region_slug": region_slug,
-            "year": args.year,
-            "timezone": args.timezone,
+            "year": year,
+            "timezone": timezone,
             "boundary_source": "nominatim",
             "selection_reason": reason,
             "bbox_source": source,
+            "nominatim_cache": {"hits": cache.hits - hits, "misses": cache.misses - misses} if cache else None,
             "generated_at": dt.datetime.utcnow().isoformat() + "Z",
         },
         "nominatim": {
@@ -125,7 +204,13 @@ def main() -> int:
             "lookup": list(bbox_lookup) if bbox_lookup else None,
             "geometry_computed": list(bbox_from_geom),
             "diff": diff,
-            "thresholds": {"degree": args.bbox_diff_threshold, "area_ratio": args.bbox_area_ratio_threshold},
+            # Share of the final bbox covered by the boundary; low values mean many out-of-region hits
+            "area_km2": {
+                "geometry": geometry_area,
+                "bbox_final": bbox_area,
+                "fill_ratio": geometry_area / bbox_area if geometry_area is not None and bbox_area > 0 else None,
+            },
+            "thresholds": {"degree": bbox_diff_threshold, "area_ratio": bbox_area_ratio_threshold},
         },
         "geometry": geom,
         "polygon_hash": polygon_hash(geom),
@@ -133,7 +218,41 @@ def main() -> int:
 
     write_json(dirs["meta"] / "region.json", region_json)
     append_log(log_path, f"[{dt.datetime.utcnow().isoformat()}Z] region.json written")
-    print(json.dumps({"region_json": str(dirs['meta'] / 'region.json'), "bbox": list(final_bbox)}, ensure_ascii=False))
+    return region_json
+
+
+def nominatim_cache(out_dir: str, cache_dir: Optional[str] = None, ttl: float = DEFAULT_CACHE_TTL) -> ResponseCache:
+    return ResponseCache(Path(cache_dir or Path(out_dir) / "_cache" / "nominatim"), ttl=ttl)
+
+
+def main() -> int:
+    parser = argparse.ArgumentParser(description="Resolve OSM administrative region + bbox")
+    parser.add_argument("--region-query", required=True)
+    parser.add_argument("--year", type=int, required=True)
+    parser.add_argument("--out-dir", default="outputs")
+    parser.add_argument("--timezone", default="UTC")
+    parser.add_argument("--nominatim-base", default="https://nominatim.openstreetmap.org")
+    parser.add_argument("--bbox-diff-threshold", type=float, default=0.01)
+    parser.add_argument("--bbox-area-ratio-threshold", type=float, default=0.05)
+    parser.add_argument("--cache-dir", default=None, help="Nominatim response cache (default: <out-dir>/_cache/nominatim)")
+    parser.add_argument("--cache-ttl", type=float, default=DEFAULT_CACHE_TTL, help="seconds before a cached response is refetched")
+    parser.add_argument("--no-cache", action="store_true")
+    parser.add_argument("--offline", action="store_true", help="resolve from cache only, never call Nominatim")
+    args = parser.parse_args()
+
+    region = resolve_region(
+        args.region_query,
+        args.year,
+        out_dir=args.out_dir,
+        timezone=args.timezone,
+        nominatim_base=args.nominatim_base,
+        bbox_diff_threshold=args.bbox_diff_threshold,
+        bbox_area_ratio_threshold=args.bbox_area_ratio_threshold,
+        cache=None if args.no_cache else nominatim_cache(args.out_dir, args.cache_dir, args.cache_ttl),
+        offline=args.offline,
+    )
+    region_json_path = Path(args.out_dir) / region["meta"]["region_slug"] / str(args.year) / "meta" / "region.json"
+    print(json.dumps({"region_json": str(region_json_path), "bbox": region["bbox"]["final"]}, ensure_ascii=False))
     return 0
 
 
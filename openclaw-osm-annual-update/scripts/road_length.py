@@ -0,0 +1,328 @@
+#!/usr/bin/env python3
+from __future__ import annotations
+
+import argparse
+import datetime as dt
+import hashlib
+import json
+import math
+from array import array
+from collections import defaultdict
+from itertools import islice
+from pathlib import Path
+from typing import Any, Dict, Iterable, Iterator, List, Optional, Set, Tuple
+
+from columnar import DICT, ColumnTable
+from common import append_log, write_json
+from metrics import PARTIALS_DIR, load_partials, month_keys, save_partials
+from node_store import NodeStore, read_highway_ways
+from polygon_index import PolygonIndex, region_index
+
+try:
+    import numpy as np
+except ImportError:  # numpy is optional: the array fallback gives the same numbers, just slower
+    np = None
+
+EARTH_RADIUS_KM = 6371.0088
+BATCH_WAYS = 20000
+METHOD_NOTE = (
+    "haversine over consecutive way nodes (R=6371.0088 km) using current node coordinates; "
+    "segments touching unavailable nodes or nodes outside the region polygon are skipped"
+)
+
+# One row per highway way edit (stats/way_lengths.col)
+WAY_LENGTH_SCHEMA = {"changeset_id": "q", "month": DICT, "way_id": "q", "action": DICT, "length_km": "d"}
+# Distinct node ids referenced per month (stats/partials/road_nodes.col), for the year's missing_nodes_rate
+ROAD_NODES_SCHEMA = {"month": DICT, "node_id": "q"}
+
+
+class PackedWays:
+    """A batch of ways flattened into parallel coordinate arrays.
+
+    Way i owns points offsets[i]:offsets[i + 1]; known[j] is 0 when node j has no coordinates.
+    """
+
+    def __init__(self) -> None:
+        self.lat = array("d")
+        self.lon = array("d")
+        self.known = bytearray()
+        self.offsets = array("q", [0])
+
+    def add(self, refs: Iterable[int], coords: Dict[int, Tuple[float, float]]) -> None:
+        for ref in refs:
+            point = coords.get(ref)
+            if point is None:
+                self.lat.append(0.0)
+                self.lon.append(0.0)
+                self.known.append(0)
+            else:
+                self.lat.append(point[0])
+                self.lon.append(point[1])
+                self.known.append(1)
+        self.offsets.append(len(self.lat))
+
+    def __len__(self) -> int:
+        return len(self.offsets) - 1
+
+
+def way_lengths_numpy(packed: PackedWays) -> List[float]:
+    lat = np.radians(np.frombuffer(packed.lat, dtype=np.float64))
+    lon = np.radians(np.frombuffer(packed.lon, dtype=np.float64))
+    known = np.frombuffer(bytes(packed.known), dtype=np.uint8).astype(bool)
+    offsets = np.frombuffer(packed.offsets, dtype=np.int64)
+    if lat.size < 2:
+        return [0.0] * len(packed)
+
+    dlat = lat[1:] - lat[:-1]
+    dlon = lon[1:] - lon[:-1]
+    h = np.sin(dlat / 2) ** 2 + np.cos(lat[:-1]) * np.cos(lat[1:]) * np.sin(dlon / 2) ** 2
+    seg = 2 * EARTH_RADIUS_KM * np.arcsin(np.sqrt(np.minimum(h, 1.0)))
+
+    # Segment j joins point j and j+1: drop the ones crossing a way boundary or touching unknown nodes
+    valid = known[:-1] & known[1:]
+    boundaries = offsets[1:-1] - 1
+    valid[boundaries[(boundaries >= 0) & (boundaries < valid.size)]] = False
+    owner = np.searchsorted(offsets, np.arange(seg.size), side="right") - 1
+    return np.bincount(owner, weights=np.where(valid, seg, 0.0), minlength=len(packed)).tolist()
+
+
+def way_lengths_python(packed: PackedWays) -> List[float]:
+    lat = [math.radians(v) for v in packed.lat]
+    lon = [math.radians(v) for v in packed.lon]
+    cos_lat = [math.cos(v) for v in lat]
+    known = packed.known
+    lengths = []
+    for i in range(len(packed)):
+        total = 0.0
+        for j in range(packed.offsets[i], packed.offsets[i + 1] - 1):
+            if not (known[j] and known[j + 1]):
+                continue
+            h = math.sin((lat[j + 1] - lat[j]) / 2) ** 2 + cos_lat[j] * cos_lat[j + 1] * math.sin((lon[j + 1] - lon[j]) / 2) ** 2
+            total += 2 * EARTH_RADIUS_KM * math.asin(math.sqrt(min(h, 1.0)))
+        lengths.append(total)
+    return lengths
+
+
+def way_lengths(packed: PackedWays) -> List[float]:
+    return way_lengths_numpy(packed) if np is not None else way_lengths_python(packed)
+
+
+def batched(items: Iterable[Any], size: int) -> Iterator[List[Any]]:
+    it = iter(items)
+    while True:
+        chunk = list(islice(it, size))
+        if not chunk:
+            return
+        yield chunk
+
+
+def measure_batches(
+    ways: Iterable[Dict[str, Any]],
+    store: NodeStore,
+    batch_ways: int = BATCH_WAYS,
+    index: Optional[PolygonIndex] = None,
+) -> Iterator[Tuple[List[Dict[str, Any]], List[float], Set[int], Set[int]]]:
+    """Yield (ways, lengths_km, referenced node ids, node ids with coordinates) per batch.
+
+    With an index, only segments whose both ends lie inside the region polygon are measured.
+    """
+    for batch in batched(ways, batch_ways):
+        refs = {int(n) for way in batch for n in way["nodes"]}
+        coords = store.get_many(refs)
+        usable = coords
+        if index is not None:
+            ids = list(coords)
+            inside = index.contains_many([coords[i][1] for i in ids], [coords[i][0] for i in ids])
+            usable = {i: coords[i] for i, ok in zip(ids, inside) if ok}
+
+        packed = PackedWays()
+        for way in batch:
+            packed.add(way["nodes"], usable)
+        yield batch, way_lengths(packed), refs, set(coords)
+
+
+def month_key(ways: List[Dict[str, Any]]) -> str:
+    digest = hashlib.sha256()
+    for way in ways:
+        digest.update(json.dumps(way, sort_keys=True, separators=(",", ":")).encode("utf-8"))
+    return digest.hexdigest()[:16]
+
+
+def road_month_partial(
+    ways: List[Dict[str, Any]],
+    store: NodeStore,
+    batch_ways: int = BATCH_WAYS,
+    index: Optional[PolygonIndex] = None,
+    lengths: Optional[ColumnTable] = None,
+) -> Tuple[Dict[str, Any], Set[int]]:
+    """One month's partial aggregate (unrounded km) and the distinct node ids it references."""
+    raw = new = 0.0
+    unique: Dict[str, float] = {}
+    seen_nodes: Set[int] = set()
+    missing_nodes: Set[int] = set()
+    ways_with_missing = set()
+    for batch, batch_lengths, refs, known in measure_batches(ways, store, batch_ways, index):
+        seen_nodes |= refs
+        missing_nodes |= refs - known
+        for way, length in zip(batch, batch_lengths):
+            if lengths is not None:
+                lengths.append({**way, "length_km": length})
+            raw += length
+            if way["action"] == "create":
+                new += length
+            unique[str(int(way["way_id"]))] = length
+            if any(int(n) not in known for n in way["nodes"]):
+                ways_with_missing.add(int(way["way_id"]))
+    partial = {
+        "key": month_key(ways),
+        "ERL_raw": raw,
+        "NRL": new,
+        "ways": unique,
+        "ways_with_missing": sorted(ways_with_missing),
+        "missing_nodes": sorted(missing_nodes),
+    }
+    return partial, seen_nodes
+
+
+def merge_road_partials(
+    months: Dict[str, Dict[str, Any]], seen_nodes: Set[int], year: int, index: Optional[PolygonIndex] = None
+) -> Dict[str, Any]:
+    """ERL_raw / ERL_unique / NRL per month and for the year from month partials.
+
+    ERL_unique keeps one length per way_id (per month, and per year for the total); later months win.
+    """
+    unique_year: Dict[str, float] = {}
+    missing_nodes: set = set()
+    ways_with_missing: set = set()
+    for month in sorted(months):
+        part = months[month]
+        unique_year.update(part["ways"])
+        missing_nodes.update(part["missing_nodes"])
+        ways_with_missing.update(part["ways_with_missing"])
+    empty = {"ERL_raw": 0.0, "NRL": 0.0, "ways": {}}
+    monthly = [
+        {
+            "month": m,
+            "ERL_raw": round(months.get(m, empty)["ERL_raw"], 3),
+            "ERL_unique": round(sum(months.get(m, empty)["ways"].values()), 3),
+            "NRL": round(months.get(m, empty)["NRL"], 3),
+        }
+        for m in month_keys(year)
+    ]
+    return {
+        "ERL_raw_total": round(sum(part["ERL_raw"] for part in months.values()), 3),
+        "ERL_unique_total": round(sum(unique_year.values()), 3),
+        "NRL_total": round(sum(part["NRL"] for part in months.values()), 3),
+        "unit": "km",
+        "monthly": monthly,
+        "missing_nodes_rate": round(len(missing_nodes) / len(seen_nodes), 6) if seen_nodes else None,
+        "affected_ways_count": len(unique_year),
+        "ways_with_missing_nodes": len(ways_with_missing),
+        "engine": "numpy" if np is not None else "python",
+        "region_filter": "polygon" if index is not None else "none",
+        "method_note": METHOD_NOTE,
+    }
+
+
+def incremental_road_metrics(
+    base_dir: Path,
+    ways: Iterable[Dict[str, Any]],
+    store: NodeStore,
+    year: int,
+    batch_ways: int = BATCH_WAYS,
+    index: Optional[PolygonIndex] = None,
+    polygon_hash: Optional[str] = None,
+    full: bool = False,
+) -> Dict[str, Any]:
+    """Road metrics backed by stats/partials/roads.json; rewrites stats/way_lengths.col.
+
+    A month is measured again only if its way edits changed, or if one of the nodes it was missing
+    has since reached the node cache; other months keep their stored partials and way lengths.
+    A different boundary (polygon_hash) invalidates every month, and so does full=True.
+    """
+    stats_dir = base_dir / "stats"
+    partials_path = stats_dir / PARTIALS_DIR / "roads.json"
+    nodes_path = stats_dir / PARTIALS_DIR / "road_nodes.col"
+    lengths_path = stats_dir / "way_lengths.col"
+    scope = {"year": year, "polygon_hash": polygon_hash, "region_filter": "polygon" if index is not None else "none"}
+    if full and partials_path.exists():
+        partials_path.unlink()
+    previous = load_partials(partials_path, scope)
+    if previous and not (ColumnTable.exists(nodes_path) and ColumnTable.exists(lengths_path)):
+        previous = {}
+
+    by_month: Dict[str, List[Dict[str, Any]]] = defaultdict(list)
+    for way in ways:
+        by_month[way["month"]].append(way)
+    dirty = set()
+    for month, month_ways in by_month.items():
+        old = previous.get(month)
+        if old is None or old["key"] != month_key(month_ways):
+            dirty.add(month)
+        elif old["missing_nodes"] and store.get_many(old["missing_nodes"]):
+            dirty.add(month)
+
+    old_nodes: Dict[str, List[int]] = defaultdict(list)
+    old_lengths: Dict[str, List[Dict[str, Any]]] = defaultdict(list)
+    if previous:
+        for row in ColumnTable.load(nodes_path).rows():
+            old_nodes[row["month"]].append(row["node_id"])
+        for row in ColumnTable.load(lengths_path).rows():
+            old_lengths[row["month"]].append(row)
+
+    months: Dict[str, Dict[str, Any]] = {}
+    seen_nodes: Set[int] = set()
+    nodes = ColumnTable(ROAD_NODES_SCHEMA)
+    lengths = ColumnTable(WAY_LENGTH_SCHEMA)
+    for month in sorted(by_month):
+        if month in dirty:
+            months[month], month_nodes = road_month_partial(by_month[month], store, batch_ways, index, lengths)
+        else:
+            months[month], month_nodes = previous[month], set(old_nodes[month])
+            lengths.extend(old_lengths[month])
+        seen_nodes |= month_nodes
+        nodes.extend({"month": month, "node_id": n} for n in sorted(month_nodes))
+
+    if dirty or months.keys() != previous.keys() or not previous:
+        nodes.save(nodes_path)
+        lengths.save(lengths_path)
+        save_partials(partials_path, scope, months)
+    roads = merge_road_partials(months, seen_nodes, year, index)
+    roads["incremental"] = {"months_recomputed": sorted(dirty), "months_reused": sorted(by_month.keys() - dirty)}
+    return roads
+
+
+def main() -> int:
+    parser = argparse.ArgumentParser(description="Compute ERL_raw / ERL_unique / NRL from edited highway ways (Layer 3)")
+    parser.add_argument("--base-dir", required=True, help="outputs/<region>/<year>")
+    parser.add_argument("--year", type=int, required=True)
+    parser.add_argument("--node-cache", required=True, help="sqlite node cache filled by node_store.py")
+    parser.add_argument("--batch-ways", type=int, default=BATCH_WAYS)
+    parser.add_argument("--full", action="store_true", help="clear stats/partials/roads.json and measure every month again")
+    args = parser.parse_args()
+
+    base_dir = Path(args.base_dir)
+    log_path = base_dir / "logs" / "run.log"
+    append_log(log_path, f"[{dt.datetime.utcnow().isoformat()}Z] start road_length")
+    region_path = base_dir / "meta" / "region.json"
+    region = json.loads(region_path.read_text(encoding="utf-8")) if region_path.exists() else {}
+    index = region_index(region) if region else None
+    store = NodeStore(Path(args.node_cache))
+    ways = read_highway_ways(base_dir / "raw" / "highway_ways.jsonl")
+    roads = incremental_road_metrics(
+        base_dir, ways, store, args.year, args.batch_ways, index, region.get("polygon_hash"), full=args.full
+    )
+    store.close()
+    write_json(base_dir / "stats" / "roads.json", roads)
+    reused = len(roads.get("incremental", {}).get("months_reused", []))
+    append_log(
+        log_path,
+        f"[{dt.datetime.utcnow().isoformat()}Z] roads.json written "
+        f"(ERL_raw={roads['ERL_raw_total']} km, engine={roads['engine']}, months_reused={reused})",
+    )
+    print(json.dumps({"status": "ok", "roads_json": str(base_dir / "stats" / "roads.json")}, ensure_ascii=False))
+    return 0
+
+
+if __name__ == "__main__":
+    raise SystemExit(main())
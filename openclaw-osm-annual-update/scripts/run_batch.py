@@ -0,0 +1,229 @@
+#!/usr/bin/env python3
+from __future__ import annotations
+
+import argparse
+import datetime as dt
+import json
+import time
+from concurrent.futures import FIRST_COMPLETED, Future, ThreadPoolExecutor, wait
+from pathlib import Path
+from typing import Any, Callable, Dict, List, Tuple
+
+from common import HttpClient, ensure_output_tree, slugify_region, write_json
+from resolve_region import NOMINATIM_RATE, nominatim_cache
+from run_pipeline import (
+    add_pipeline_args,
+    render_stage,
+    resolve_stage,
+    run_cmd,
+    stage_commands,
+    write_outputs,
+    write_trend,
+)
+
+# Stage -> concurrency class. Classes with a slot limit keep shared services polite:
+# Nominatim allows one request per second overall, OSM API stages share --api-slots.
+STAGE_CLASS = {
+    "resolve": "nominatim",
+    "share_region": "local",
+    "render_map": "local",
+    "collect": "osm",
+    "download": "osm",
+    "parse": "cpu",
+    "nodes": "osm",
+    "roads": "cpu",
+    "summary": "local",
+    "trend": "local",
+}
+STAGE_DEPS = {
+    "render_map": ["region"],
+    "collect": ["region"],
+    "download": ["collect"],
+    "parse": ["download"],
+    "nodes": ["parse"],
+    "roads": ["nodes"],
+    "summary": ["roads"],
+}
+
+
+class Task:
+    def __init__(self, name: str, stage: str, fn: Callable[[], None], deps: List[str]) -> None:
+        self.name = name
+        self.stage = stage
+        self.fn = fn
+        self.deps = deps
+        self.status = "pending"
+        self.error = ""
+        self.seconds = 0.0
+
+    def run(self) -> None:
+        start = time.monotonic()
+        try:
+            self.fn()
+        finally:
+            self.seconds = round(time.monotonic() - start, 3)
+
+
+def load_manifest(path: Path) -> List[Tuple[str, List[int]]]:
+    """Manifest: {"regions": [...], "years": [...]} (cross product) and/or
+    {"jobs": [{"region_query": ..., "years": [...]}]}."""
+    manifest = json.loads(path.read_text(encoding="utf-8"))
+    jobs: Dict[str, List[int]] = {}
+    for region in manifest.get("regions", []):
+        jobs.setdefault(region, []).extend(int(y) for y in manifest.get("years", []))
+    for job in manifest.get("jobs", []):
+        jobs.setdefault(job["region_query"], []).extend(int(y) for y in job["years"])
+    return [(region, sorted(set(years))) for region, years in jobs.items() if years]
+
+
+def share_region(region: Dict[str, Any], dest_base: Path, year: int) -> Dict[str, Any]:
+    # Region resolution does not depend on the year: reuse the first year's result
+    shared = {**region, "meta": {**region["meta"], "year": year}}
+    write_json(dest_base / "meta" / "region.json", shared)
+    return shared
+
+
+def build_tasks(args: argparse.Namespace, jobs: List[Tuple[str, List[int]]]) -> Dict[str, Task]:
+    tasks: Dict[str, Task] = {}
+    # Resolved regions by base dir, passed between tasks in memory
+    regions: Dict[Path, Dict[str, Any]] = {}
+    # One cache and one rate-limited client, so the whole batch stays within Nominatim's policy
+    cache = nominatim_cache(args.out_dir)
+    client = HttpClient(rate=NOMINATIM_RATE, timeout=30)
+
+    def resolve(region_query: str, year: int, base_dir: Path) -> None:
+        regions[base_dir] = resolve_stage(args, region_query, year, cache, client)
+
+    def share(src: Path, dest: Path, year: int) -> None:
+        regions[dest] = share_region(regions[src], dest, year)
+
+    def add(name: str, stage: str, fn: Callable[[], None], deps: List[str]) -> None:
+        tasks[name] = Task(name, stage, fn, deps)
+
+    for region_query, years in jobs:
+        slug = slugify_region(region_query)
+        first_base = Path(args.out_dir) / slug / str(years[0])
+        resolve_name = f"{slug}/resolve"
+        add(resolve_name, "resolve", lambda q=region_query, y=years[0], b=first_base: resolve(q, y, b), [])
+
+        for year in years:
+            base_dir = Path(args.out_dir) / slug / str(year)
+            ensure_output_tree(base_dir)
+            prefix = f"{slug}/{year}"
+            region_task = resolve_name
+            if year != years[0]:
+                region_task = f"{prefix}/share_region"
+                add(
+                    region_task,
+                    "share_region",
+                    lambda b=base_dir, y=year, src=first_base: share(src, b, y),
+                    [resolve_name],
+                )
+            add(
+                f"{prefix}/render_map",
+                "render_map",
+                lambda b=base_dir: print(json.dumps(render_stage(args, regions[b], b), ensure_ascii=False)),
+                [region_task],
+            )
+            for stage, cmd in stage_commands(args, base_dir, year):
+                deps = [region_task if d == "region" else f"{prefix}/{d}" for d in STAGE_DEPS[stage]]
+                add(f"{prefix}/{stage}", stage, lambda c=cmd: run_cmd(c), deps)
+            add(
+                f"{prefix}/summary",
+                "summary",
+                lambda b=base_dir, q=region_query, y=year: write_outputs(
+                    b, q, y, args.timezone, args.granularity, regions[b]
+                ),
+                [f"{prefix}/{d}" for d in STAGE_DEPS["summary"]],
+            )
+        # Merges the years' month partials, so it waits for every summary of the region
+        add(
+            f"{slug}/trend",
+            "trend",
+            lambda d=first_base.parent, q=region_query: write_trend(d, q),
+            [f"{slug}/{year}/summary" for year in years],
+        )
+    return tasks
+
+
+def run_tasks(tasks: Dict[str, Task], workers: int, slots: Dict[str, int]) -> None:
+    """Run the dependency graph on one pool. A failed task skips its dependents only."""
+    running: Dict[Future, Task] = {}
+    in_use: Dict[str, int] = {cls: 0 for cls in slots}
+
+    def ready(task: Task) -> bool:
+        if task.status != "pending" or any(tasks[d].status != "ok" for d in task.deps):
+            return False
+        cls = STAGE_CLASS[task.stage]
+        return cls not in slots or in_use[cls] < slots[cls]
+
+    def skip_blocked() -> None:
+        changed = True
+        while changed:
+            changed = False
+            for task in tasks.values():
+                if task.status == "pending" and any(tasks[d].status in ("failed", "skipped") for d in task.deps):
+                    task.status = "skipped"
+                    task.error = "dependency failed"
+                    changed = True
+
+    with ThreadPoolExecutor(max_workers=max(1, workers)) as pool:
+        while True:
+            for task in tasks.values():
+                if len(running) >= workers:
+                    break
+                if ready(task):
+                    task.status = "running"
+                    cls = STAGE_CLASS[task.stage]
+                    if cls in in_use:
+                        in_use[cls] += 1
+                    running[pool.submit(task.run)] = task
+            if not running:
+                break
+            done, _ = wait(running, return_when=FIRST_COMPLETED)
+            for future in done:
+                task = running.pop(future)
+                cls = STAGE_CLASS[task.stage]
+                if cls in in_use:
+                    in_use[cls] -= 1
+                try:
+                    future.result()
+                    task.status = "ok"
+                except Exception as exc:  # isolate: one region's failure must not stop the batch
+                    task.status = "failed"
+                    task.error = str(exc)[-2000:]
+                print(json.dumps({"task": task.name, "status": task.status, "seconds": task.seconds}), flush=True)
+            skip_blocked()
+
+
+def main() -> int:
+    parser = argparse.ArgumentParser(description="Run the OSM annual update pipeline for many regions x years")
+    parser.add_argument("--manifest", required=True, help="JSON manifest of regions and years")
+    parser.add_argument("--jobs", type=int, default=4, help="stages running at once across the batch")
+    parser.add_argument("--api-slots", type=int, default=1, help="OSM API stages running at once (each at --rate)")
+    parser.add_argument("--cpu-slots", type=int, default=1, help="parse/road stages running at once")
+    add_pipeline_args(parser)
+    args = parser.parse_args()
+
+    jobs = load_manifest(Path(args.manifest))
+    tasks = build_tasks(args, jobs)
+    started = dt.datetime.utcnow().isoformat() + "Z"
+    run_tasks(tasks, args.jobs, {"nominatim": 1, "osm": max(1, args.api_slots), "cpu": max(1, args.cpu_slots)})
+
+    report: Dict[str, Any] = {
+        "started_at": started,
+        "finished_at": dt.datetime.utcnow().isoformat() + "Z",
+        "jobs": [{"region_query": r, "years": y} for r, y in jobs],
+        "tasks": [
+            {"task": t.name, "status": t.status, "seconds": t.seconds, "error": t.error or None} for t in tasks.values()
+        ],
+    }
+    failed = [t.name for t in tasks.values() if t.status != "ok"]
+    report_path = Path(args.out_dir) / "batch_report.json"
+    write_json(report_path, report)
+    print(json.dumps({"status": "failed" if failed else "ok", "report": str(report_path), "not_ok": failed}, ensure_ascii=False))
+    return 1 if failed else 0
+
+
+if __name__ == "__main__":
+    raise SystemExit(main())
@@ -8,8 +8,15 @@ import json
 import subprocess
 import sys
 from pathlib import Path
+from typing import Any, Dict, List, Optional, Tuple
 
-from common import ensure_output_tree, slugify_region, write_json
+from collect_changesets import load_changesets_table
+from common import HttpClient, ResponseCache, ensure_output_tree, load_quality, slugify_region, write_json
+from metrics import PARTIALS_DIR, PARTIALS_VERSION, incremental_changeset_metrics, merge_month_partials
+from render_bbox_map import BACKENDS, render_bbox_map
+from resolve_region import nominatim_cache, resolve_region
+
+SCRIPTS_DIR = Path(__file__).resolve().parent
 
 
 def run_cmd(args: list[str]) -> None:
@@ -20,11 +27,31 @@ def run_cmd(args: list[str]) -> None:
         print(proc.stdout.strip())
 
 
-def write_summary_stub(base_dir: Path, region_query: str, year: int, timezone: str, granularity: str) -> None:
+def summary_metrics(base_dir: Path, year: int) -> Dict[str, Any]:
+    return incremental_changeset_metrics(base_dir, load_changesets_table(base_dir), year)
+
+
+def write_summary_stub(
+    base_dir: Path,
+    region_query: str,
+    year: int,
+    timezone: str,
+    granularity: str,
+    region: Optional[Dict[str, Any]] = None,
+    cs_metrics: Optional[Dict[str, Any]] = None,
+) -> None:
     region_json_path = base_dir / "meta" / "region.json"
-    region = {}
-    if region_json_path.exists():
-        region = json.loads(region_json_path.read_text(encoding="utf-8"))
+    if region is None:
+        region = {}
+        if region_json_path.exists():
+            region = json.loads(region_json_path.read_text(encoding="utf-8"))
+    if cs_metrics is None:
+        cs_metrics = summary_metrics(base_dir, year)
+    quality = load_quality(base_dir)
+    features_path = base_dir / "stats" / "features.json"
+    features = json.loads(features_path.read_text(encoding="utf-8")) if features_path.exists() else {}
+    roads_path = base_dir / "stats" / "roads.json"
+    roads = json.loads(roads_path.read_text(encoding="utf-8")) if roads_path.exists() else {}
 
     summary = {
         "meta": {
@@ -39,94 +66,260 @@ def write_summary_stub(base_dir: Path, region_query: str, year: int, timezone: s
             "bbox": (region.get("bbox") or {}).get("final"),
             "polygon_hash": region.get("polygon_hash"),
         },
-        "changesets": {"CS_total": 0, "CHG_total": 0, "monthly": []},
-        "contributors": {"U_total": 0, "AU_10cs": 0, "AU_500chg": 0, "topk_users_by_chg": []},
-        "features": {"FEAT_EDIT_total": {}, "FEAT_EDIT_BY_TAG_total": {}, "UNIQUE_FEAT_total": None},
+        "changesets": cs_metrics["changesets"],
+        "contributors": cs_metrics["contributors"],
+        "features": {
+            "FEAT_EDIT_total": features.get("FEAT_EDIT_total", {}),
+            "FEAT_EDIT_BY_TAG_total": features.get("FEAT_EDIT_BY_TAG_total", {}),
+            "UNIQUE_FEAT_total": features.get("UNIQUE_FEAT_total"),
+        },
         "roads": {
-            "ERL_raw_total": 0.0,
-            "ERL_unique_total": 0.0,
-            "monthly": [],
-            "missing_nodes_rate": None,
-            "affected_ways_count": 0,
-            "method_note": "TBD: geodesic length from way node coordinates",
+            "ERL_raw_total": roads.get("ERL_raw_total", 0.0),
+            "ERL_unique_total": roads.get("ERL_unique_total", 0.0),
+            "NRL_total": roads.get("NRL_total", 0.0),
+            "unit": "km",
+            "monthly": roads.get("monthly", []),
+            "missing_nodes_rate": roads.get("missing_nodes_rate"),
+            "affected_ways_count": roads.get("affected_ways_count", 0),
+            "method_note": roads.get("method_note", "TBD: geodesic length from way node coordinates"),
         },
         "quality": {
-            "truncation_windows": [],
-            "bbox_cross_border_risk_note": "changeset bbox hit may include cross-border edits",
-            "api_errors": [],
-            "retries": [],
-            "partial_failures": [],
+            "truncation_windows": quality.get("truncation_windows", []),
+            "bbox_cross_border_risk_note": (
+                "changesets are kept when their bbox centroid lies in the region polygon; "
+                "a changeset spanning the border counts wholly in or out"
+            ),
+            "api_errors": quality.get("api_errors", []),
+            "retries": quality.get("retries", []),
+            "partial_failures": quality.get("partial_failures", []),
+            # Months merged from stats/partials/ vs. recomputed on this run
+            "incremental": {"changesets": cs_metrics["incremental"], "roads": roads.get("incremental")},
         },
     }
     write_json(base_dir / "stats" / "summary.json", summary)
 
 
-def write_monthly_stub(base_dir: Path, year: int) -> None:
+def write_monthly_stub(base_dir: Path, year: int, cs_metrics: Optional[Dict[str, Any]] = None) -> None:
     path = base_dir / "stats" / "monthly.csv"
+    if cs_metrics is None:
+        cs_metrics = summary_metrics(base_dir, year)
+    monthly = cs_metrics["changesets"]["monthly"]
+    roads_path = base_dir / "stats" / "roads.json"
+    roads = json.loads(roads_path.read_text(encoding="utf-8")) if roads_path.exists() else {}
+    erl = {r["month"]: r for r in roads.get("monthly", [])}
     with path.open("w", encoding="utf-8", newline="") as f:
         writer = csv.writer(f)
         writer.writerow(["month", "CS", "CHG", "U", "ERL_raw", "ERL_unique"])
-        for m in range(1, 13):
-            writer.writerow([f"{year}-{m:02d}", 0, 0, 0, 0, 0])
+        for row in monthly:
+            month_roads = erl.get(row["month"], {})
+            writer.writerow(
+                [
+                    row["month"],
+                    row["CS"],
+                    row["CHG"],
+                    row["U"],
+                    month_roads.get("ERL_raw", 0),
+                    month_roads.get("ERL_unique", 0),
+                ]
+            )
 
 
-def main() -> int:
-    parser = argparse.ArgumentParser(description="Bootstrap OSM annual update skill outputs")
-    parser.add_argument("--region-query", required=True)
-    parser.add_argument("--year", type=int, required=True)
+def write_outputs(
+    base_dir: Path,
+    region_query: str,
+    year: int,
+    timezone: str,
+    granularity: str,
+    region: Optional[Dict[str, Any]] = None,
+) -> None:
+    # summary.json and monthly.csv share one pass over the changeset partials
+    cs_metrics = summary_metrics(base_dir, year)
+    write_summary_stub(base_dir, region_query, year, timezone, granularity, region, cs_metrics)
+    write_monthly_stub(base_dir, year, cs_metrics)
+
+
+def write_trend(region_dir: Path, region_query: str) -> Dict[str, Any]:
+    """Multi-year view of one region (<out-dir>/<region>/trend.json), merged from every finished
+    year's month partials and roads.json; no year's changesets or ways are read again."""
+    yearly: List[Dict[str, Any]] = []
+    monthly: List[Dict[str, Any]] = []
+    years_by_user: Dict[str, int] = {}
+    for year_dir in sorted(p for p in region_dir.iterdir() if p.name.isdigit()):
+        stats_dir = year_dir / "stats"
+        partials_path = stats_dir / PARTIALS_DIR / "changesets.json"
+        if not partials_path.exists():
+            continue
+        partials = json.loads(partials_path.read_text(encoding="utf-8"))
+        if partials.get("version") != PARTIALS_VERSION:
+            continue
+        year = int(year_dir.name)
+        cs_metrics = merge_month_partials(partials["months"], year)
+        roads_path = stats_dir / "roads.json"
+        roads = json.loads(roads_path.read_text(encoding="utf-8")) if roads_path.exists() else {}
+        users = {uid for part in partials["months"].values() for uid in part["users"]}
+        for uid in users:
+            years_by_user[uid] = years_by_user.get(uid, 0) + 1
+        yearly.append(
+            {
+                "year": year,
+                "CS_total": cs_metrics["changesets"]["CS_total"],
+                "CHG_total": cs_metrics["changesets"]["CHG_total"],
+                "U_total": cs_metrics["contributors"]["U_total"],
+                "AU_10cs": cs_metrics["contributors"]["AU_10cs"],
+                "AU_500chg": cs_metrics["contributors"]["AU_500chg"],
+                "ERL_raw_total": roads.get("ERL_raw_total", 0.0),
+                "ERL_unique_total": roads.get("ERL_unique_total", 0.0),
+                "NRL_total": roads.get("NRL_total", 0.0),
+            }
+        )
+        erl = {r["month"]: r for r in roads.get("monthly", [])}
+        for row in cs_metrics["changesets"]["monthly"]:
+            month_roads = erl.get(row["month"], {})
+            monthly.append(
+                {
+                    **row,
+                    "ERL_raw": month_roads.get("ERL_raw", 0.0),
+                    "ERL_unique": month_roads.get("ERL_unique", 0.0),
+                    "NRL": month_roads.get("NRL", 0.0),
+                }
+            )
+    trend = {
+        "region_query": region_query,
+        "years": [row["year"] for row in yearly],
+        "yearly": yearly,
+        "monthly": monthly,
+        "contributors": {
+            # Exact: the partials keep every year's user set, not just counts
+            "U_all_years": len(years_by_user),
+            "U_multi_year": sum(1 for n in years_by_user.values() if n > 1),
+        },
+    }
+    write_json(region_dir / "trend.json", trend)
+    return trend
+
+
+def add_pipeline_args(parser: argparse.ArgumentParser) -> None:
+    # Options shared by run_pipeline.py and run_batch.py
     parser.add_argument("--out-dir", default="outputs")
     parser.add_argument("--timezone", default="UTC")
     parser.add_argument("--granularity", default="month")
     parser.add_argument("--nominatim-base", default="https://nominatim.openstreetmap.org")
+    parser.add_argument("--nominatim-offline", action="store_true", help="resolve the region from the response cache only")
+    parser.add_argument("--osm-api-base", default="https://api.openstreetmap.org")
+    parser.add_argument("--workers", type=int, default=4)
+    parser.add_argument("--rate", type=float, default=2.0, help="max OSM API requests per second")
+    parser.add_argument("--gzip-downloads", action="store_true", help="store OsmChange files gzip-compressed")
+    parser.add_argument(
+        "--node-cache", default=None, help="sqlite node coordinate cache (default: <out-dir>/_cache/nodes.sqlite)"
+    )
     parser.add_argument("--mapbox-token-env", default="MAPBOX_ACCESS_TOKEN")
     parser.add_argument("--mapbox-style", default="mapbox/streets-v12")
     parser.add_argument("--image-size", default="1000x700")
+    parser.add_argument("--map-backend", choices=BACKENDS, default="auto", help="auto: Mapbox if a token is set, else local")
+    parser.add_argument("--tile-dir", default=None, help="local XYZ tile cache drawn under local renders")
+
+
+def node_cache_path(args: argparse.Namespace) -> str:
+    # One node cache per out-dir, so coordinates are reused across regions and years
+    return args.node_cache or str(Path(args.out_dir) / "_cache" / "nodes.sqlite")
+
+
+def resolve_stage(
+    args: argparse.Namespace,
+    region_query: str,
+    year: int,
+    cache: Optional[ResponseCache] = None,
+    client: Optional[HttpClient] = None,
+) -> Dict[str, Any]:
+    # In-process: the returned region dict is handed straight to the next stages
+    return resolve_region(
+        region_query,
+        year,
+        out_dir=args.out_dir,
+        timezone=args.timezone,
+        nominatim_base=args.nominatim_base,
+        cache=cache if cache is not None else nominatim_cache(args.out_dir),
+        offline=args.nominatim_offline,
+        client=client,
+    )
+
+
+def render_stage(args: argparse.Namespace, region: Dict[str, Any], base_dir: Path) -> Dict[str, Any]:
+    return render_bbox_map(
+        region,
+        base_dir / "figures" / "bbox_map.png",
+        mapbox_token_env=args.mapbox_token_env,
+        mapbox_style=args.mapbox_style,
+        image_size=args.image_size,
+        backend=args.map_backend,
+        cache_dir=Path(args.out_dir) / "_cache" / "maps",
+        tile_dir=Path(args.tile_dir) if args.tile_dir else None,
+    )
+
+
+def stage_commands(args: argparse.Namespace, base_dir: Path, year: int) -> List[Tuple[str, List[str]]]:
+    """Subprocess commands for the data stages after resolve/render, in dependency order."""
+    node_cache = node_cache_path(args)
+    region_json = str(base_dir / "meta" / "region.json")
+    api_args = ["--osm-api-base", args.osm_api_base, "--workers", str(args.workers), "--rate", str(args.rate)]
+    return [
+        (
+            "collect",
+            [sys.executable, str(SCRIPTS_DIR / "collect_changesets.py"), "--region-json", region_json, "--year", str(year)]
+            + api_args,
+        ),
+        (
+            "download",
+            [sys.executable, str(SCRIPTS_DIR / "download_changesets.py"), "--base-dir", str(base_dir)]
+            + api_args
+            + (["--gzip"] if args.gzip_downloads else []),
+        ),
+        (
+            "parse",
+            [sys.executable, str(SCRIPTS_DIR / "parse_osmchange.py"), "--base-dir", str(base_dir), "--node-cache", node_cache],
+        ),
+        (
+            "nodes",
+            [sys.executable, str(SCRIPTS_DIR / "node_store.py"), "--base-dir", str(base_dir), "--node-cache", node_cache]
+            + api_args,
+        ),
+        (
+            "roads",
+            [
+                sys.executable,
+                str(SCRIPTS_DIR / "road_length.py"),
+                "--base-dir",
+                str(base_dir),
+                "--year",
+                str(year),
+                "--node-cache",
+                node_cache,
+            ],
+        ),
+    ]
+
+
+def main() -> int:
+    parser = argparse.ArgumentParser(description="Bootstrap OSM annual update skill outputs")
+    parser.add_argument("--region-query", required=True)
+    parser.add_argument("--year", type=int, required=True)
+    add_pipeline_args(parser)
     args = parser.parse_args()
 
-    root = Path(__file__).resolve().parent
     region_slug = slugify_region(args.region_query)
     base_dir = Path(args.out_dir) / region_slug / str(args.year)
     ensure_output_tree(base_dir)
 
-    (base_dir / "raw" / "changesets.csv").touch(exist_ok=True)
     (base_dir / "logs" / "run.log").touch(exist_ok=True)
 
-    run_cmd(
-        [
-            sys.executable,
-            str(root / "resolve_region.py"),
-            "--region-query",
-            args.region_query,
-            "--year",
-            str(args.year),
-            "--out-dir",
-            args.out_dir,
-            "--timezone",
-            args.timezone,
-            "--nominatim-base",
-            args.nominatim_base,
-        ]
-    )
-
-    run_cmd(
-        [
-            sys.executable,
-            str(root / "render_bbox_map.py"),
-            "--region-json",
-            str(base_dir / "meta" / "region.json"),
-            "--out-png",
-            str(base_dir / "figures" / "bbox_map.png"),
-            "--mapbox-token-env",
-            args.mapbox_token_env,
-            "--mapbox-style",
-            args.mapbox_style,
-            "--image-size",
-            args.image_size,
-        ]
-    )
+    region = resolve_stage(args, args.region_query, args.year)
+    region_json = str(base_dir / "meta" / "region.json")
+    print(json.dumps({"region_json": region_json, "bbox": region["bbox"]["final"]}, ensure_ascii=False))
+    print(json.dumps(render_stage(args, region, base_dir), ensure_ascii=False))
+    for _, cmd in stage_commands(args, base_dir, args.year):
+        run_cmd(cmd)
 
-    write_summary_stub(base_dir, args.region_query, args.year, args.timezone, args.granularity)
-    write_monthly_stub(base_dir, args.year)
+    write_outputs(base_dir, args.region_query, args.year, args.timezone, args.granularity, region)
 
     print(
         json.dumps(
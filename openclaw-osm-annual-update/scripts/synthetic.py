@@ -0,0 +1,303 @@
+#!/usr/bin/env python3
+"""Deterministic synthetic OSM inputs for benchmarks: boundaries, changesets, OsmChange files and a stub API."""
+from __future__ import annotations
+
+import datetime as dt
+import json
+import math
+import random
+import threading
+import urllib.parse
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from pathlib import Path
+from typing import Any, Dict, List, Optional, Sequence, Tuple
+from xml.sax.saxutils import quoteattr
+
+# Synthetic region: a wavy star around (113.55, 22.17), roughly Macau-sized
+CENTER = (113.55, 22.17)
+RADIUS_DEG = 0.07
+HIGHWAY_VALUES = ("residential", "service", "footway", "primary", "tertiary")
+OTHER_TAGS = (("building", "yes"), ("amenity", "cafe"), ("shop", "convenience"), ("landuse", "grass"), ("natural", "water"))
+
+
+def star_polygon(vertices: int, center: Sequence[float] = CENTER, radius: float = RADIUS_DEG, holes: int = 1) -> Dict[str, Any]:
+    """Closed GeoJSON Polygon with ``vertices`` shell points and ``holes`` small circular holes."""
+    cx, cy = center
+    shell = []
+    for k in range(vertices):
+        a = 2 * math.pi * k / vertices
+        r = radius * (0.75 + 0.25 * math.sin(8 * a))
+        shell.append([cx + r * math.cos(a), cy + r * math.sin(a)])
+    shell.append(shell[0])
+    rings = [shell]
+    n = max(16, vertices // 50)
+    for h in range(holes):
+        # One hole sits in the middle; several are spread on a circle at 0.3 * radius
+        a = 2 * math.pi * h / holes
+        hx, hy = (cx, cy) if holes == 1 else (cx + 0.3 * radius * math.cos(a), cy + 0.3 * radius * math.sin(a))
+        hole = [[hx + 0.1 * radius * math.cos(2 * math.pi * k / n), hy + 0.1 * radius * math.sin(2 * math.pi * k / n)] for k in range(n)]
+        hole.append(hole[0])
+        rings.append(hole)
+    return {"type": "Polygon", "coordinates": rings}
+
+
+def node_coord(node_id: int, bbox: Sequence[float]) -> Tuple[float, float]:
+    # Stateless, so the stub /nodes endpoint and the fixtures agree without sharing anything
+    fx = (node_id * 0.6180339887498949) % 1.0
+    fy = (node_id * 0.7548776662466927) % 1.0
+    return bbox[1] + fy * (bbox[3] - bbox[1]), bbox[0] + fx * (bbox[2] - bbox[0])
+
+
+def synthetic_changesets(count: int, year: int, bbox: Sequence[float], users: int = 500, seed: int = 1) -> List[Dict[str, Any]]:
+    """Changeset rows as the API lists them; a tenth fall in one hour to force window bisection."""
+    rng = random.Random(seed)
+    start = dt.datetime(year, 1, 1, tzinfo=dt.timezone.utc)
+    span = (dt.datetime(year + 1, 1, 1, tzinfo=dt.timezone.utc) - start).total_seconds()
+    burst = start + dt.timedelta(days=64, hours=12)
+    rows = []
+    w, h = bbox[2] - bbox[0], bbox[3] - bbox[1]
+    for i in range(1, count + 1):
+        if i % 10 == 0:
+            t = burst + dt.timedelta(seconds=rng.randint(0, 3599))
+        else:
+            t = start + dt.timedelta(seconds=rng.randint(0, int(span) - 1))
+        # Skewed authorship: a few heavy mappers and a long tail
+        uid = int(users * rng.random() ** 3) + 1
+        x0, y0 = bbox[0] + rng.random() * w * 0.95, bbox[1] + rng.random() * h * 0.95
+        size = rng.random() * 0.01
+        stamp = t.strftime("%Y-%m-%dT%H:%M:%SZ")
+        rows.append(
+            {
+                "id": i,
+                "created_at": stamp,
+                "closed_at": stamp,
+                "uid": uid,
+                "user": f"mapper{uid}",
+                "changes_count": int(rng.paretovariate(1.2) * 5),
+                "comments_count": 0,
+                "min_lon": x0,
+                "min_lat": y0,
+                "max_lon": min(bbox[2], x0 + size),
+                "max_lat": min(bbox[3], y0 + size),
+                "created_by": rng.choice(("JOSM/1.5", "iD 2.27", "StreetComplete 57")),
+            }
+        )
+    return rows
+
+
+def changesets_xml(rows: Sequence[Dict[str, Any]]) -> bytes:
+    parts = ['<?xml version="1.0" encoding="UTF-8"?>\n<osm version="0.6">']
+    for r in rows:
+        parts.append(
+            f'<changeset id="{r["id"]}" created_at="{r["created_at"]}" closed_at="{r["closed_at"]}" open="false" '
+            f'user={quoteattr(r["user"])} uid="{r["uid"]}" changes_count="{r["changes_count"]}" '
+            f'comments_count="{r["comments_count"]}" min_lon="{r["min_lon"]:.7f}" min_lat="{r["min_lat"]:.7f}" '
+            f'max_lon="{r["max_lon"]:.7f}" max_lat="{r["max_lat"]:.7f}">'
+            f'<tag k="created_by" v={quoteattr(r["created_by"])}/></changeset>'
+        )
+    parts.append("</osm>")
+    return "".join(parts).encode("utf-8")
+
+
+def osmchange_xml(changeset_id: int, elements: int, bbox: Sequence[float]) -> bytes:
+    """One OsmChange document with about ``elements`` nodes/ways/relations.
+
+    New nodes carry coordinates; ways reference both them and older nodes that must come from /nodes.
+    """
+    rng = random.Random(changeset_id)
+    node_base = changeset_id * 1_000_000
+    parts = ['<?xml version="1.0" encoding="UTF-8"?>\n<osmChange version="0.6" generator="synthetic">']
+    for action in ("create", "modify", "delete"):
+        share = {"create": 0.5, "modify": 0.4, "delete": 0.1}[action]
+        count = max(1, int(elements * share))
+        parts.append(f"<{action}>")
+        new_nodes: List[int] = []
+        for _ in range(count):
+            roll = rng.random()
+            element_id = node_base + len(parts)
+            if roll < 0.7:
+                lat, lon = node_coord(element_id, bbox)
+                tag = "" if rng.random() < 0.8 else '<tag k="{}" v="{}"/>'.format(*rng.choice(OTHER_TAGS))
+                parts.append(
+                    f'<node id="{element_id}" version="2" changeset="{changeset_id}" lat="{lat:.7f}" lon="{lon:.7f}">'
+                    f"{tag}</node>"
+                )
+                new_nodes.append(element_id)
+            elif roll < 0.97:
+                refs = new_nodes[-rng.randint(1, 4) :] + [rng.randint(1, 5_000_000) for _ in range(rng.randint(2, 12))]
+                if rng.random() < 0.6:
+                    tag = f'<tag k="highway" v="{rng.choice(HIGHWAY_VALUES)}"/>'
+                else:
+                    tag = '<tag k="{}" v="{}"/>'.format(*rng.choice(OTHER_TAGS))
+                nds = "".join(f'<nd ref="{r}"/>' for r in refs)
+                parts.append(f'<way id="{element_id}" version="3" changeset="{changeset_id}">{nds}{tag}</way>')
+            else:
+                parts.append(
+                    f'<relation id="{element_id}" version="1" changeset="{changeset_id}">'
+                    f'<member type="way" ref="{rng.randint(1, 10**7)}" role="outer"/><tag k="boundary" v="administrative"/>'
+                    "</relation>"
+                )
+        parts.append(f"</{action}>")
+    parts.append("</osmChange>")
+    return "".join(parts).encode("utf-8")
+
+
+def nodes_xml(ids: Sequence[int], bbox: Sequence[float]) -> bytes:
+    parts = ['<?xml version="1.0" encoding="UTF-8"?>\n<osm version="0.6">']
+    for node_id in ids:
+        lat, lon = node_coord(node_id, bbox)
+        parts.append(f'<node id="{node_id}" visible="true" version="1" lat="{lat:.7f}" lon="{lon:.7f}"/>')
+    parts.append("</osm>")
+    return "".join(parts).encode("utf-8")
+
+
+class Fixture:
+    """A synthetic region: boundary, changeset listing and one OsmChange file per changeset, cached on disk.
+
+    The directory name encodes every size parameter, so repeated runs reuse the same files.
+    """
+
+    def __init__(
+        self,
+        root: Path,
+        year: int = 2025,
+        changesets: int = 2000,
+        elements: int = 200,
+        vertices: int = 50_000,
+        users: int = 500,
+    ) -> None:
+        self.year = year
+        self.geometry = star_polygon(vertices)
+        lon0, lat0 = CENTER
+        self.bbox = (lon0 - RADIUS_DEG, lat0 - RADIUS_DEG, lon0 + RADIUS_DEG, lat0 + RADIUS_DEG)
+        self.rows = synthetic_changesets(changesets, year, self.bbox, users)
+        self.elements = elements
+        self.dir = Path(root) / f"osm_y{year}_cs{changesets}_el{elements}_v{vertices}_u{users}"
+        self.osc_dir = self.dir / "osc"
+
+    def ensure(self) -> "Fixture":
+        self.osc_dir.mkdir(parents=True, exist_ok=True)
+        for row in self.rows:
+            path = self.osc_dir / f"{row['id']}.osc.xml"
+            if not path.exists():
+                tmp = path.with_name(path.name + ".part")
+                tmp.write_bytes(osmchange_xml(row["id"], self.elements, self.bbox))
+                tmp.replace(path)
+        return self
+
+    def add_changeset(self, created_at: str) -> Dict[str, Any]:
+        """Append one closed in-region changeset (and its OsmChange file), e.g. to simulate new edits between runs."""
+        # Half a radius east of the centre: inside the star, clear of the central hole
+        lon, lat = CENTER[0] + RADIUS_DEG / 2, CENTER[1]
+        row = {
+            **self.rows[0],
+            "id": max(r["id"] for r in self.rows) + 1,
+            "created_at": created_at,
+            "closed_at": created_at,
+            "min_lon": lon - 0.001,
+            "min_lat": lat - 0.001,
+            "max_lon": lon + 0.001,
+            "max_lat": lat + 0.001,
+        }
+        self.rows.append(row)
+        self.ensure()
+        return row
+
+    def osc_bytes(self) -> int:
+        return sum(p.stat().st_size for p in self.osc_dir.glob("*.osc.xml"))
+
+    def search_response(self, query: str) -> List[Dict[str, Any]]:
+        return [
+            {
+                "osm_type": "relation",
+                "osm_id": 9_000_001,
+                "class": "boundary",
+                "type": "administrative",
+                "place_rank": 8,
+                "display_name": query,
+                "boundingbox": [str(self.bbox[1]), str(self.bbox[3]), str(self.bbox[0]), str(self.bbox[2])],
+            }
+        ]
+
+    def lookup_response(self) -> Dict[str, Any]:
+        feature = {"type": "Feature", "bbox": list(self.bbox), "properties": {}, "geometry": self.geometry}
+        return {"type": "FeatureCollection", "features": [feature]}
+
+
+class StubOsmServer:
+    """Local HTTP stand-in for the OSM API and Nominatim, serving a Fixture on 127.0.0.1.
+
+    Use as a context manager; ``base_url`` works for both --osm-api-base and --nominatim-base.
+    ``requests`` counts hits per endpoint.
+    """
+
+    def __init__(self, fixture: Fixture, port: int = 0) -> None:
+        self.fixture = fixture
+        self.requests: Dict[str, int] = {}
+        self._lock = threading.Lock()
+        self.refresh()
+        self._server = ThreadingHTTPServer(("127.0.0.1", port), self._handler())
+        self._server.daemon_threads = True
+        self._thread: Optional[threading.Thread] = None
+
+    def refresh(self) -> None:
+        # Re-read fixture.rows after they changed
+        self._rows = sorted(self.fixture.rows, key=lambda r: r["created_at"], reverse=True)
+
+    @property
+    def base_url(self) -> str:
+        host, port = self._server.server_address[:2]
+        return f"http://{host}:{port}"
+
+    def _count(self, endpoint: str) -> None:
+        with self._lock:
+            self.requests[endpoint] = self.requests.get(endpoint, 0) + 1
+
+    def route(self, path: str, query: Dict[str, str]) -> Tuple[int, bytes]:
+        fixture = self.fixture
+        if path == "/api/0.6/changesets":
+            self._count("changesets")
+            rows = [r for r in self._rows if query["from"] <= r["created_at"] < query["to"]]
+            return 200, changesets_xml(rows[: int(query.get("limit", 100))])
+        if path.startswith("/api/0.6/changeset/") and path.endswith("/download"):
+            self._count("download")
+            osc = fixture.osc_dir / f"{path.split('/')[4]}.osc.xml"
+            return (200, osc.read_bytes()) if osc.exists() else (404, b"")
+        if path == "/api/0.6/nodes":
+            self._count("nodes")
+            return 200, nodes_xml([int(i) for i in query["nodes"].split(",")], fixture.bbox)
+        if path == "/search":
+            self._count("search")
+            return 200, json.dumps(fixture.search_response(query.get("q", ""))).encode("utf-8")
+        if path == "/lookup":
+            self._count("lookup")
+            return 200, json.dumps(fixture.lookup_response()).encode("utf-8")
+        return 404, b""
+
+    def _handler(self) -> type:
+        stub = self
+
+        class Handler(BaseHTTPRequestHandler):
+            protocol_version = "HTTP/1.1"
+
+            def log_message(self, *args: Any) -> None:
+                pass
+
+            def do_GET(self) -> None:
+                url = urllib.parse.urlparse(self.path)
+                status, body = stub.route(url.path, dict(urllib.parse.parse_qsl(url.query)))
+                self.send_response(status)
+                self.send_header("Content-Length", str(len(body)))
+                self.end_headers()
+                self.wfile.write(body)
+
+        return Handler
+
+    def __enter__(self) -> "StubOsmServer":
+        self._thread = threading.Thread(target=self._server.serve_forever, daemon=True)
+        self._thread.start()
+        return self
+
+    def __exit__(self, *exc: Any) -> None:
+        self._server.shutdown()
+        self._server.server_close()
@@ -4,22 +4,348 @@
 from __future__ import annotations
 
 import argparse
+import contextlib
+import contextvars
+import datetime as dt
+import fnmatch
+import hashlib
 import json
+import os
 import shutil
+import socket
 import subprocess
 import sys
+import tempfile
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor, as_completed
+from dataclasses import dataclass, field
+from itertools import accumulate
 from pathlib import Path
+from typing import Callable, Iterator
 
+try:
+    import numpy as np
+except ImportError:  # 可选：智能裁剪分析在没有 numpy 时退回纯 Python（较慢，结果一致）
+    np = None
 VIDEO_EXTENSIONS = {".mp4", ".mov", ".mkv", ".avi", ".flv", ".wmv", ".webm", ".m4v"}
+# 上传/写入中的临时文件后缀（如 clip.mp4.part、clip.tmp.mp4），监视模式不处理
+PARTIAL_SUFFIXES = {".tmp", ".part", ".partial", ".crdownload", ".download"}
 TARGET_WIDTH = 1080
 TARGET_HEIGHT = 1920
 MAX_DURATION_SECONDS = 15.0
+CRF = 20
+PRESET = "medium"
+DEFAULT_PROFILE = "final"
+# 编码档位：codec/preset/crf/分辨率/码率/输出后缀。crf 为 None 时按 video_bitrate 定码率编码。
+# 可用 --profiles-file 覆盖或新增（例如 h264_nvenc / h264_videotoolbox 等硬件编码器）；
+# --renditions 可一次解码同时输出多个档位。
+ENCODE_PROFILES: dict[str, dict] = {
+    "final": {
+        "codec": "libx264",
+        "preset": PRESET,
+        "crf": CRF,
+        "video_bitrate": None,
+        "width": TARGET_WIDTH,
+        "height": TARGET_HEIGHT,
+        "audio_bitrate": "192k",
+        "suffix": "_9x16_1080p",
+    },
+    "fast": {
+        "codec": "libx264",
+        "preset": "veryfast",
+        "crf": 26,
+        "video_bitrate": None,
+        "width": TARGET_WIDTH,
+        "height": TARGET_HEIGHT,
+        "audio_bitrate": "128k",
+        "suffix": "_9x16_1080p_fast",
+    },
+    "preview": {
+        "codec": "libx264",
+        "preset": "ultrafast",
+        "crf": None,
+        "video_bitrate": "1200k",
+        "width": 540,
+        "height": 960,
+        "audio_bitrate": "96k",
+        "suffix": "_9x16_540p_preview",
+    },
+    "720p": {
+        "codec": "libx264",
+        "preset": PRESET,
+        "crf": 22,
+        "video_bitrate": None,
+        "width": 720,
+        "height": 1280,
+        "audio_bitrate": "128k",
+        "suffix": "_9x16_720p",
+    },
+    "4x5": {
+        "codec": "libx264",
+        "preset": PRESET,
+        "crf": CRF,
+        "video_bitrate": None,
+        "width": 1080,
+        "height": 1350,
+        "audio_bitrate": "192k",
+        "suffix": "_4x5_1080p",
+    },
+}
+TARGET_FPS = 30
+COPY_PIX_FMT = "yuv420p"
+MANIFEST_NAME = ".transcode_manifest.json"
+PROBE_CACHE_NAME = ".probe_cache.json"
+DEFAULT_PROBE_JOBS = 8
+DEFAULT_SEGMENT_MIN_DURATION = 300.0
+SEGMENT_DURATION_TOLERANCE = 0.25
+FIT_STRATEGIES = ("speed", "trim", "hybrid")
+DEFAULT_MAX_SPEED = 2.0
+METRICS_LOG_NAME = "transcode_metrics.jsonl"
+DEFAULT_PROGRESS_INTERVAL = 5.0
+DEFAULT_POLL_INTERVAL = 2.0
+DEFAULT_SETTLE_SECONDS = 5.0
+CROP_MODES = ("center", "smart")
+CROP_CACHE_NAME = ".smart_crop_cache.json"
+# 智能裁剪分析：低分辨率灰度帧（宽高比无关，只用水平位置的比例），按批读取
+ANALYSIS_WIDTH = 160
+ANALYSIS_HEIGHT = 90
+ANALYSIS_FPS = 4.0
+ANALYSIS_BATCH_FRAMES = 64
+DETAIL_WEIGHT = 0.25
+SMOOTH_SECONDS = 1.5
+MAX_PAN_SPEED = 0.25  # 每秒最多平移源画面宽度的比例
+CROP_KEY_STEP = 0.5
+CROP_KEY_TOLERANCE = 0.002
+# 分析参数变化后旧缓存作废
+CROP_ANALYSIS_VERSION = 3
 
 
 def run_command(cmd: list[str]) -> subprocess.CompletedProcess:
+    job = CURRENT_JOB.get()
+    if job is not None and cmd and cmd[0] == "ffmpeg":
+        return run_ffmpeg_with_progress(cmd, job)
     return subprocess.run(cmd, check=True, text=True, capture_output=True)
 
 
+def run_ffmpeg_with_progress(cmd: list[str], job: JobMetrics) -> subprocess.CompletedProcess:
+    # -progress pipe:1 逐块输出 key=value，以 progress=continue/end 结尾；stderr 落临时文件，避免管道写满阻塞
+    cmd = [cmd[0], "-progress", "pipe:1", "-nostats", *cmd[1:]]
+    key = job.start_process()
+    with tempfile.TemporaryFile(mode="w+", encoding="utf-8", errors="replace") as stderr_file:
+        proc = subprocess.Popen(cmd, stdout=subprocess.PIPE, stderr=stderr_file, text=True)
+        assert proc.stdout is not None
+        block: dict[str, str] = {}
+        for line in proc.stdout:
+            name, _, value = line.strip().partition("=")
+            block[name] = value
+            if name == "progress":
+                job.update(key, block)
+        returncode = proc.wait()
+        stderr_file.seek(0)
+        stderr = stderr_file.read()
+    job.finish_process(key)
+    if returncode != 0:
+        raise subprocess.CalledProcessError(returncode, cmd, output="", stderr=stderr)
+    return subprocess.CompletedProcess(cmd, returncode, "", stderr)
+
+
+def parse_progress_number(value: str | None) -> float:
+    if not value or value == "N/A":
+        return 0.0
+    try:
+        return float(value.rstrip("x"))
+    except ValueError:
+        return 0.0
+
+
+class JobMetrics:
+    """单个任务的实时进度；分段模式下一个任务可同时有多个 ffmpeg 进程。"""
+
+    def __init__(self, name: str, expected_output_seconds: float) -> None:
+        self.name = name
+        self.expected_output_seconds = expected_output_seconds
+        self.started = time.monotonic()
+        self.ended: float | None = None
+        self._lock = threading.Lock()
+        self._next_key = 0
+        self._live: dict[int, dict[str, float]] = {}
+        self._finished = {"frames": 0.0, "bytes": 0.0, "out_time": 0.0}
+
+    def start_process(self) -> int:
+        with self._lock:
+            self._next_key += 1
+            self._live[self._next_key] = {"frames": 0.0, "bytes": 0.0, "out_time": 0.0}
+            return self._next_key
+
+    def update(self, key: int, block: dict[str, str]) -> None:
+        with self._lock:
+            self._live[key] = {
+                "frames": parse_progress_number(block.get("frame")),
+                "bytes": parse_progress_number(block.get("total_size")),
+                # out_time_ms 实际单位也是微秒，优先用 out_time_us
+                "out_time": parse_progress_number(block.get("out_time_us") or block.get("out_time_ms")) / 1e6,
+            }
+
+    def finish_process(self, key: int) -> None:
+        with self._lock:
+            snapshot = self._live.pop(key, {})
+            for name in self._finished:
+                self._finished[name] += snapshot.get(name, 0.0)
+
+    def totals(self) -> dict[str, float]:
+        with self._lock:
+            totals = dict(self._finished)
+            for snapshot in self._live.values():
+                for name in totals:
+                    totals[name] += snapshot[name]
+        elapsed = max((self.ended or time.monotonic()) - self.started, 1e-6)
+        totals["elapsed"] = elapsed
+        totals["fps"] = totals["frames"] / elapsed
+        totals["speed"] = totals["out_time"] / elapsed
+        return totals
+
+
+CURRENT_JOB: contextvars.ContextVar[JobMetrics | None] = contextvars.ContextVar("current_job", default=None)
+
+
+class BatchProgress:
+    """汇总所有任务的 fps/速度/写入字节与队列 ETA，定时打印，并把每个任务写入 JSON-lines 指标日志。"""
+
+    def __init__(self, total_jobs: int, expected_output_seconds: float, metrics_log: Path | None, interval: float) -> None:
+        self.total_jobs = total_jobs
+        self.expected_output_seconds = expected_output_seconds
+        self.metrics_log = metrics_log
+        self.interval = interval
+        self.started = time.monotonic()
+        self.run_id = dt.datetime.now(dt.timezone.utc).strftime("%Y%m%dT%H%M%SZ") + f"-{os.getpid()}"
+        self.host = socket.gethostname()
+        self._lock = threading.Lock()
+        self._active: list[JobMetrics] = []
+        self._done_totals = {"frames": 0.0, "bytes": 0.0, "out_time": 0.0}
+        self._done_expected = 0.0
+        self._done_count = 0
+        self._failed_count = 0
+        self._stop = threading.Event()
+        self._thread: threading.Thread | None = None
+
+    def add_jobs(self, count: int, expected_output_seconds: float) -> None:
+        # 监视模式下任务陆续到达，总量随之增加
+        with self._lock:
+            self.total_jobs += count
+            self.expected_output_seconds += expected_output_seconds
+
+    def start_job(self, name: str, expected_output_seconds: float) -> JobMetrics:
+        job = JobMetrics(name, expected_output_seconds)
+        with self._lock:
+            self._active.append(job)
+        return job
+
+    def finish_job(self, job: JobMetrics, ok: bool, extra: dict) -> dict[str, float]:
+        job.ended = time.monotonic()
+        totals = job.totals()
+        with self._lock:
+            if job in self._active:
+                self._active.remove(job)
+            for name in self._done_totals:
+                self._done_totals[name] += totals[name]
+            self._done_expected += job.expected_output_seconds
+            self._done_count += 1
+            self._failed_count += 0 if ok else 1
+        self.write_record(
+            {
+                "event": "job",
+                "file": job.name,
+                "ok": ok,
+                "wall_seconds": round(totals["elapsed"], 3),
+                "frames": int(totals["frames"]),
+                "fps": round(totals["fps"], 2),
+                "speed": round(totals["speed"], 3),
+                "bytes": int(totals["bytes"]),
+                "output_seconds": round(totals["out_time"], 3),
+                **extra,
+            }
+        )
+        return totals
+
+    def snapshot(self) -> dict[str, float]:
+        with self._lock:
+            totals = dict(self._done_totals)
+            active = list(self._active)
+            done_expected = self._done_expected
+            done_count = self._done_count
+        in_flight = 0.0
+        for job in active:
+            job_totals = job.totals()
+            for name in totals:
+                totals[name] += job_totals[name]
+            in_flight += min(job_totals["out_time"], job.expected_output_seconds)
+        elapsed = max(time.monotonic() - self.started, 1e-6)
+        processed = done_expected + in_flight
+        rate = processed / elapsed
+        remaining = max(self.expected_output_seconds - processed, 0.0)
+        totals.update(
+            {
+                "elapsed": elapsed,
+                "done": done_count,
+                "active": len(active),
+                "fps": totals["frames"] / elapsed,
+                "speed": totals["out_time"] / elapsed,
+                "eta": remaining / rate if rate > 0 else float("nan"),
+            }
+        )
+        return totals
+
+    def format_line(self) -> str:
+        snap = self.snapshot()
+        eta = "--" if snap["eta"] != snap["eta"] else f"{snap['eta']:.0f}s"
+        return (
+            f"进度: {snap['done']:.0f}/{self.total_jobs} 完成，{snap['active']:.0f} 进行中，"
+            f"{snap['fps']:.1f} fps，{snap['speed']:.2f}x 实时，已写 {snap['bytes'] / 1e6:.1f} MB，ETA {eta}"
+        )
+
+    def write_record(self, record: dict) -> None:
+        if self.metrics_log is None:
+            return
+        line = json.dumps(
+            {"run_id": self.run_id, "host": self.host, "time": dt.datetime.now(dt.timezone.utc).isoformat(), **record},
+            ensure_ascii=False,
+        )
+        with self._lock:
+            self.metrics_log.parent.mkdir(parents=True, exist_ok=True)
+            with self.metrics_log.open("a", encoding="utf-8") as f:
+                f.write(line + "\n")
+
+    def _report_loop(self) -> None:
+        while not self._stop.wait(self.interval):
+            print(self.format_line(), flush=True)
+
+    def start(self) -> None:
+        if self.interval > 0:
+            self._thread = threading.Thread(target=self._report_loop, daemon=True)
+            self._thread.start()
+
+    def stop(self, extra: dict) -> None:
+        self._stop.set()
+        if self._thread is not None:
+            self._thread.join()
+        snap = self.snapshot()
+        self.write_record(
+            {
+                "event": "run",
+                "jobs_total": self.total_jobs,
+                "jobs_failed": self._failed_count,
+                "wall_seconds": round(snap["elapsed"], 3),
+                "frames": int(snap["frames"]),
+                "fps": round(snap["fps"], 2),
+                "speed": round(snap["speed"], 3),
+                "bytes": int(snap["bytes"]),
+                "files_per_minute": round(snap["done"] / snap["elapsed"] * 60, 3),
+                **extra,
+            }
+        )
+
+
 def ffprobe_metadata(video_path: Path) -> dict:
     cmd = [
         "ffprobe",
@@ -35,6 +361,106 @@ def ffprobe_metadata(video_path: Path) -> dict:
     return json.loads(result.stdout)
 
 
+def write_json_atomic(path: Path, obj: dict) -> None:
+    path.parent.mkdir(parents=True, exist_ok=True)
+    tmp_path = path.with_name(path.name + ".tmp")
+    tmp_path.write_text(json.dumps(obj, ensure_ascii=False, indent=2), encoding="utf-8")
+    os.replace(tmp_path, path)
+
+
+class ProbeCache:
+    """ffprobe 结果的磁盘缓存，按 路径 + size + mtime 命中。"""
+
+    def __init__(self, path: Path) -> None:
+        self.path = path
+        self.entries: dict[str, dict] = {}
+        if path.exists():
+            try:
+                self.entries = json.loads(path.read_text(encoding="utf-8")).get("entries", {})
+            except (OSError, ValueError):
+                self.entries = {}
+
+    def get(self, video_path: Path) -> dict | None:
+        entry = self.entries.get(str(video_path))
+        if not entry:
+            return None
+        stat = video_path.stat()
+        if entry.get("size") != stat.st_size or entry.get("mtime_ns") != stat.st_mtime_ns:
+            return None
+        return entry.get("metadata")
+
+    def put(self, video_path: Path, metadata: dict) -> None:
+        stat = video_path.stat()
+        self.entries[str(video_path)] = {"size": stat.st_size, "mtime_ns": stat.st_mtime_ns, "metadata": metadata}
+
+    def save(self) -> None:
+        write_json_atomic(self.path, {"version": 1, "entries": self.entries})
+
+
+class CropCache:
+    """智能裁剪轨迹的磁盘缓存，按 路径 + size + mtime + 解码窗口 命中；多个任务线程共用，每次写入即落盘。"""
+
+    def __init__(self, path: Path) -> None:
+        self.path = path
+        self.entries: dict[str, dict] = {}
+        self._lock = threading.Lock()
+        if path.exists():
+            try:
+                data = json.loads(path.read_text(encoding="utf-8"))
+            except (OSError, ValueError):
+                data = {}
+            if data.get("version") == CROP_ANALYSIS_VERSION:
+                self.entries = data.get("entries", {})
+
+    @staticmethod
+    def key(video_path: Path, window: FitWindow) -> str:
+        return f"{video_path}|{window.start:.3f}|{window.span:.3f}"
+
+    def get(self, video_path: Path, window: FitWindow) -> list[tuple[float, float]] | None:
+        with self._lock:
+            entry = self.entries.get(self.key(video_path, window))
+        if not entry:
+            return None
+        stat = video_path.stat()
+        if entry.get("size") != stat.st_size or entry.get("mtime_ns") != stat.st_mtime_ns:
+            return None
+        return [(t, c) for t, c in entry["track"]]
+
+    def put(self, video_path: Path, window: FitWindow, track: list[tuple[float, float]]) -> None:
+        stat = video_path.stat()
+        entry = {"size": stat.st_size, "mtime_ns": stat.st_mtime_ns, "track": [list(p) for p in track]}
+        with self._lock:
+            self.entries[self.key(video_path, window)] = entry
+            write_json_atomic(self.path, {"version": CROP_ANALYSIS_VERSION, "entries": self.entries})
+
+
+def probe_videos(videos: list[Path], cache: ProbeCache, jobs: int = DEFAULT_PROBE_JOBS) -> dict[Path, dict]:
+    # 探测失败的文件不放入结果，编码阶段会重新探测并按原有方式报错
+    metadata_by_path: dict[Path, dict] = {}
+    missing: list[Path] = []
+    for video in videos:
+        cached = cache.get(video)
+        if cached is None:
+            missing.append(video)
+        else:
+            metadata_by_path[video] = cached
+
+    if missing:
+        with ThreadPoolExecutor(max_workers=max(1, jobs)) as pool:
+            futures = {pool.submit(ffprobe_metadata, video): video for video in missing}
+            for future in as_completed(futures):
+                video = futures[future]
+                try:
+                    metadata = future.result()
+                except (subprocess.CalledProcessError, ValueError):
+                    continue
+                cache.put(video, metadata)
+                metadata_by_path[video] = metadata
+        cache.save()
+
+    return metadata_by_path
+
+
 def get_duration_seconds(metadata: dict, file_path: Path) -> float:
     duration_str = metadata.get("format", {}).get("duration")
     if duration_str is None:
@@ -61,64 +487,1035 @@ def build_atempo_filter(speed_factor: float) -> str:
     return ",".join(f"atempo={factor:.8f}" for factor in factors)
 
 
-def process_video(input_path: Path, output_path: Path) -> None:
-    metadata = ffprobe_metadata(input_path)
-    duration = get_duration_seconds(metadata, input_path)
-    audio_exists = has_audio_stream(metadata)
+@dataclass
+class JobResult:
+    input_path: Path
+    targets: list[tuple[dict, Path]]
+    ok: bool = True
+    lines: list[str] = field(default_factory=list)
+    error: str = ""
+
+
+@dataclass
+class EncodeOptions:
+    allow_copy: bool = True
+    segments: int = 0
+    segment_min_duration: float = DEFAULT_SEGMENT_MIN_DURATION
+    fit: str = "speed"
+    trim_start: float = 0.0
+    max_speed: float = DEFAULT_MAX_SPEED
+    crop: str = "center"
+    crop_cache: CropCache | None = None
+
+
+@dataclass
+class FitWindow:
+    start: float
+    span: float
+    speed_factor: float
+    source_duration: float = 0.0
+
+    @property
+    def trimmed(self) -> bool:
+        return self.start > 0.0 or self.span < self.source_duration
 
-    speed_factor = 1.0
+
+def threads_per_job(jobs: int) -> int:
+    cpu_count = os.cpu_count() or 1
+    return max(1, cpu_count // max(1, jobs))
+
+
+def compute_speed_factor(duration: float) -> float:
     if duration > MAX_DURATION_SECONDS:
-        speed_factor = duration / MAX_DURATION_SECONDS
+        return duration / MAX_DURATION_SECONDS
+    return 1.0
+
+
+def fit_window(duration: float, options: EncodeOptions | None = None) -> FitWindow:
+    """按 --fit 策略决定解码的源区间 [start, start+span) 与加速倍数。
+
+    speed: 整段均匀加速；trim: 只截取 MAX_DURATION_SECONDS 的窗口、不加速；
+    hybrid: 加速倍数封顶 max_speed，超出部分截掉。trim/hybrid 只解码所需区间。
+    """
+    options = options or EncodeOptions()
+    if duration <= MAX_DURATION_SECONDS or options.fit == "speed":
+        return FitWindow(0.0, duration, compute_speed_factor(duration), duration)
+
+    speed_factor = 1.0 if options.fit == "trim" else min(duration / MAX_DURATION_SECONDS, max(1.0, options.max_speed))
+    span = min(duration, MAX_DURATION_SECONDS * speed_factor)
+    start = min(max(0.0, options.trim_start), duration - span)
+    return FitWindow(start, span, speed_factor, duration)
+
+
+def seek_args(window: FitWindow) -> list[str]:
+    if not window.trimmed:
+        return []
+    # 输入端 -ss/-t：只解码窗口内的内容
+    return ["-ss", f"{window.start:.6f}", "-t", f"{window.span:.6f}"]
+
+
+def load_profiles(profiles_file: Path | None) -> dict[str, dict]:
+    profiles = {name: dict(profile) for name, profile in ENCODE_PROFILES.items()}
+    if profiles_file is not None:
+        overrides = json.loads(profiles_file.read_text(encoding="utf-8"))
+        for name, values in overrides.items():
+            # 新档位以 final 为基础，只需写出差异字段
+            base = profiles.get(name, profiles[DEFAULT_PROFILE])
+            profiles[name] = {**base, **values}
+            if name not in ENCODE_PROFILES and "suffix" not in values:
+                profiles[name]["suffix"] = f"_{profiles[name]['width']}x{profiles[name]['height']}_{name}"
+    for name, profile in profiles.items():
+        profile["name"] = name
+    return profiles
+
+
+def parse_profile_names(value: str | list[str]) -> list[str]:
+    names = value.split(",") if isinstance(value, str) else value
+    return [name.strip() for name in names if name.strip()]
 
-    vf_chain = [
-        f"scale={TARGET_WIDTH}:{TARGET_HEIGHT}:force_original_aspect_ratio=increase",
-        f"crop={TARGET_WIDTH}:{TARGET_HEIGHT}",
-    ]
-    if speed_factor > 1.0:
-        vf_chain.append(f"setpts=PTS/{speed_factor:.8f}")
 
+def load_profile_map(profile_map_file: Path | None) -> list[tuple[str, list[str]]]:
+    if profile_map_file is None:
+        return []
+    mapping = json.loads(profile_map_file.read_text(encoding="utf-8"))
+    return [(pattern, parse_profile_names(names)) for pattern, names in mapping.items()]
+
+
+def select_profiles(video: Path, default: list[str], profile_map: list[tuple[str, list[str]]]) -> list[str]:
+    # 按文件名通配符逐条匹配，先匹配者优先
+    for pattern, names in profile_map:
+        if fnmatch.fnmatch(video.name, pattern):
+            return names
+    return default
+
+
+def video_codec_args(profile: dict) -> list[str]:
+    args = ["-c:v", profile["codec"]]
+    if profile.get("preset"):
+        args.extend(["-preset", str(profile["preset"])])
+    if profile.get("crf") is not None:
+        args.extend(["-crf", str(profile["crf"])])
+    elif profile.get("video_bitrate"):
+        bitrate = str(profile["video_bitrate"])
+        args.extend(["-b:v", bitrate, "-maxrate", bitrate, "-bufsize", bitrate])
+    return args
+
+
+def codec_family(encoder: str) -> str:
+    encoder = encoder.lower()
+    if encoder in ("libx264", "h264") or encoder.startswith("h264_"):
+        return "h264"
+    if encoder in ("libx265", "hevc") or encoder.startswith("hevc_"):
+        return "hevc"
+    return encoder
+
+
+def parse_frame_rate(value: str | None) -> float | None:
+    if not value:
+        return None
+    try:
+        num, _, den = value.partition("/")
+        return float(num) / float(den or 1)
+    except (ValueError, ZeroDivisionError):
+        return None
+
+
+def first_stream(metadata: dict, codec_type: str) -> dict | None:
+    for stream in metadata.get("streams", []):
+        if stream.get("codec_type") == codec_type:
+            return stream
+    return None
+
+
+def stream_rotation(stream: dict) -> int:
+    rotation = stream.get("tags", {}).get("rotate")
+    for side_data in stream.get("side_data_list", []):
+        if "rotation" in side_data:
+            rotation = side_data["rotation"]
+    try:
+        return int(float(rotation or 0)) % 360
+    except ValueError:
+        return 0
+
+
+def passthrough_mode(metadata: dict, duration: float, profile: dict) -> str | None:
+    """源文件已满足目标规格时返回 "copy"（整体封装复制）或 "audio"（仅重编码音频），否则返回 None。"""
+    if duration > MAX_DURATION_SECONDS:
+        return None
+    video = first_stream(metadata, "video")
+    if video is None:
+        return None
+    fps = parse_frame_rate(video.get("avg_frame_rate")) or parse_frame_rate(video.get("r_frame_rate"))
+    if (
+        video.get("codec_name") != codec_family(profile["codec"])
+        or video.get("width") != profile["width"]
+        or video.get("height") != profile["height"]
+        or video.get("pix_fmt") != COPY_PIX_FMT
+        or fps is None
+        or abs(fps - TARGET_FPS) > 0.01
+        or stream_rotation(video) != 0
+        or video.get("sample_aspect_ratio", "1:1") not in ("1:1", "0:1")
+    ):
+        return None
+    audio = first_stream(metadata, "audio")
+    if audio is None or audio.get("codec_name") == "aac":
+        return "copy"
+    return "audio"
+
+
+def build_copy_command(input_path: Path, output_path: Path, mode: str, profile: dict) -> list[str]:
+    cmd = ["ffmpeg", "-y", "-i", str(input_path), "-map", "0:v:0", "-map", "0:a?", "-c:v", "copy"]
+    if mode == "copy":
+        cmd.extend(["-c:a", "copy"])
+    else:
+        cmd.extend(["-c:a", "aac", "-b:a", str(profile["audio_bitrate"])])
+    cmd.extend(["-movflags", "+faststart", str(output_path)])
+    return cmd
+
+
+def display_aspect(metadata: dict) -> float | None:
+    video = first_stream(metadata, "video")
+    if video is None or not video.get("width") or not video.get("height"):
+        return None
+    width, height = float(video["width"]), float(video["height"])
+    num, _, den = str(video.get("sample_aspect_ratio") or "1:1").partition(":")
+    try:
+        sar = float(num) / float(den)
+    except (ValueError, ZeroDivisionError):
+        sar = 1.0
+    aspect = width * (sar or 1.0) / height
+    # ffmpeg 默认按旋转元数据自动转正，分析与编码看到的都是转正后的画面
+    return 1.0 / aspect if stream_rotation(video) in (90, 270) else aspect
+
+
+def crop_width_fraction(metadata: dict) -> float | None:
+    """按目标宽高比放大铺满后，裁剪窗口占源画面宽度的比例；>= 1 表示不需要水平裁剪。"""
+    aspect = display_aspect(metadata)
+    return TARGET_WIDTH / TARGET_HEIGHT / aspect if aspect else None
+
+
+def decode_analysis_frames(input_path: Path, window: FitWindow) -> Iterator[bytes]:
+    """低分辨率灰度解码 --fit 窗口，按批产出原始帧数据；时间轴与正式编码一致（从窗口起点算 0）。"""
+    frame_size = ANALYSIS_WIDTH * ANALYSIS_HEIGHT
     cmd = [
         "ffmpeg",
-        "-y",
+        "-v",
+        "error",
+        *seek_args(window),
         "-i",
         str(input_path),
-        "-vf",
-        ",".join(vf_chain),
         "-map",
         "0:v:0",
-        "-map",
-        "0:a?",
-        "-c:v",
-        "libx264",
-        "-crf",
-        "20",
-        "-preset",
-        "medium",
+        "-vf",
+        f"fps={ANALYSIS_FPS:g},scale={ANALYSIS_WIDTH}:{ANALYSIS_HEIGHT},format=gray",
+        "-f",
+        "rawvideo",
+        "pipe:1",
+    ]
+    with tempfile.TemporaryFile(mode="w+", encoding="utf-8", errors="replace") as stderr_file:
+        proc = subprocess.Popen(cmd, stdout=subprocess.PIPE, stderr=stderr_file)
+        assert proc.stdout is not None
+        try:
+            while True:
+                chunk = proc.stdout.read(frame_size * ANALYSIS_BATCH_FRAMES)
+                if not chunk:
+                    break
+                yield chunk[: len(chunk) - len(chunk) % frame_size]
+        finally:
+            proc.stdout.close()
+            returncode = proc.wait()
+        if returncode != 0:
+            stderr_file.seek(0)
+            raise subprocess.CalledProcessError(returncode, cmd, output="", stderr=stderr_file.read())
+
+
+def column_scores_numpy(batch: bytes, previous: np.ndarray | None) -> tuple[np.ndarray, np.ndarray]:
+    frames = np.frombuffer(batch, dtype=np.uint8).reshape(-1, ANALYSIS_HEIGHT, ANALYSIS_WIDTH).astype(np.int16)
+    reference = np.concatenate([frames[:1] if previous is None else previous[None], frames[:-1]])
+    motion = np.abs(frames - reference).sum(axis=1, dtype=np.float64)
+    detail = np.zeros_like(motion)
+    detail[:, 1:] = np.abs(np.diff(frames, axis=2)).sum(axis=1)
+    return motion + DETAIL_WEIGHT * detail, frames[-1]
+
+
+def column_scores_python(batch: bytes, previous: bytes | None) -> tuple[list[list[float]], bytes]:
+    width, frame_size = ANALYSIS_WIDTH, ANALYSIS_WIDTH * ANALYSIS_HEIGHT
+    scores = []
+    for offset in range(0, len(batch), frame_size):
+        frame = batch[offset : offset + frame_size]
+        reference = previous if previous is not None else frame
+        column = [0.0] * width
+        for row_start in range(0, frame_size, width):
+            row = frame[row_start : row_start + width]
+            ref_row = reference[row_start : row_start + width]
+            for x in range(width):
+                column[x] += abs(row[x] - ref_row[x])
+            for x in range(1, width):
+                column[x] += DETAIL_WEIGHT * abs(row[x] - row[x - 1])
+        scores.append(column)
+        previous = frame
+    return scores, previous
+
+
+def best_window_center(column: list[float], window_cols: int) -> float | None:
+    """去掉整帧的底噪（列能量的上中位数）后，取能量最大的裁剪窗口，返回窗口内能量质心；无信号时返回 None。
+
+    窗口能量与质心都由前缀和相减得到，运算顺序与 best_window_centers_numpy 一致，两条路径结果逐位相同。
+    """
+    n = len(column)
+    floor = sorted(column)[n // 2]
+    column = [max(0.0, v - floor) for v in column]
+    energy = list(accumulate(column, initial=0.0))
+    moment = list(accumulate((x * v for x, v in enumerate(column)), initial=0.0))
+    best_start = max(range(n - window_cols + 1), key=lambda start: energy[start + window_cols] - energy[start])
+    total = energy[best_start + window_cols] - energy[best_start]
+    if total <= 1e-6:
+        return None
+    centroid = (moment[best_start + window_cols] - moment[best_start]) / total
+    return (centroid + 0.5) / n
+
+
+def best_window_centers_numpy(scores: np.ndarray, window_cols: int) -> list[float | None]:
+    # 与 best_window_center 相同（上中位数、顺序前缀和、并列取最左），整批向量化
+    n = scores.shape[1]
+    scores = np.maximum(scores - np.sort(scores, axis=1)[:, n // 2, None], 0.0)
+    zeros = np.zeros((len(scores), 1))
+    energy = np.concatenate([zeros, np.cumsum(scores, axis=1)], axis=1)
+    moment = np.concatenate([zeros, np.cumsum(scores * np.arange(n), axis=1)], axis=1)
+    sums = energy[:, window_cols:] - energy[:, : n + 1 - window_cols]
+    starts = np.argmax(sums, axis=1)
+    rows = np.arange(len(scores))
+    totals = sums[rows, starts]
+    centroids = (moment[rows, starts + window_cols] - moment[rows, starts]) / np.maximum(totals, 1e-12)
+    return [None if total <= 1e-6 else float((c + 0.5) / n) for c, total in zip(centroids, totals)]
+
+
+def raw_crop_centers(input_path: Path, window: FitWindow, width_fraction: float) -> list[float | None]:
+    # 每个分析帧一个候选中心（占源宽比例），画面无信号的帧为 None
+    window_cols = max(1, min(ANALYSIS_WIDTH, round(width_fraction * ANALYSIS_WIDTH)))
+    centers: list[float | None] = []
+    previous = None
+    for batch in decode_analysis_frames(input_path, window):
+        if np is not None:
+            scores, previous = column_scores_numpy(batch, previous)
+            centers.extend(best_window_centers_numpy(scores, window_cols))
+        else:
+            scores, previous = column_scores_python(batch, previous)
+            centers.extend(best_window_center(column, window_cols) for column in scores)
+    return centers
+
+
+def smooth_crop_track(centers: list[float | None], width_fraction: float) -> list[tuple[float, float]]:
+    """补齐空缺 → 中值滤波去毛刺 → 居中滑动平均 → 限制平移速度 → 按 CROP_KEY_STEP 取关键点并合并近似共线点。"""
+    known = [c for c in centers if c is not None]
+    if not known:
+        return []
+    filled, last = [], known[0]
+    for c in centers:
+        last = c if c is not None else last
+        filled.append(last)
+
+    n = len(filled)
+    median = []
+    for i in range(n):
+        around = sorted(filled[max(0, i - 2) : i + 3])
+        median.append(around[len(around) // 2])
+    radius = max(1, round(SMOOTH_SECONDS * ANALYSIS_FPS / 2))
+    smoothed = []
+    for i in range(n):
+        around = median[max(0, i - radius) : i + radius + 1]
+        smoothed.append(sum(around) / len(around))
+
+    # 正反各一遍，相邻采样的差不超过 max_step，镜头平移不会突然加速
+    max_step = MAX_PAN_SPEED / ANALYSIS_FPS
+    for i in range(1, n):
+        smoothed[i] = min(max(smoothed[i], smoothed[i - 1] - max_step), smoothed[i - 1] + max_step)
+    for i in range(n - 2, -1, -1):
+        smoothed[i] = min(max(smoothed[i], smoothed[i + 1] - max_step), smoothed[i + 1] + max_step)
+
+    half = min(0.5, width_fraction / 2)
+    step = max(1, round(CROP_KEY_STEP * ANALYSIS_FPS))
+    keys = [(i / ANALYSIS_FPS, min(max(smoothed[i], half), 1.0 - half)) for i in sorted({*range(0, n, step), n - 1})]
+    return [(round(t, 4), round(c, 4)) for t, c in simplify_track(keys, CROP_KEY_TOLERANCE)]
+
+
+def simplify_track(keys: list[tuple[float, float]], tolerance: float) -> list[tuple[float, float]]:
+    # Douglas-Peucker（显式栈）：去掉与首尾连线偏差不超过 tolerance 的关键点，匀速平移段只剩两端
+    if len(keys) <= 2:
+        return keys
+    keep = {0, len(keys) - 1}
+    stack = [(0, len(keys) - 1)]
+    while stack:
+        first, last = stack.pop()
+        (t0, c0), (t1, c1) = keys[first], keys[last]
+        worst, worst_error = -1, tolerance
+        for i in range(first + 1, last):
+            t, c = keys[i]
+            error = abs(c0 + (c1 - c0) * (t - t0) / (t1 - t0) - c)
+            if error > worst_error:
+                worst, worst_error = i, error
+        if worst >= 0:
+            keep.add(worst)
+            stack.extend([(first, worst), (worst, last)])
+    return [keys[i] for i in sorted(keep)]
+
+
+def crop_track(input_path: Path, metadata: dict, window: FitWindow, options: EncodeOptions) -> list[tuple[float, float]] | None:
+    """smart 模式下返回 [(窗口内秒数, 裁剪中心占源宽比例)]；无需水平裁剪或画面无信号时返回 None（居中裁剪）。"""
+    if options.crop != "smart":
+        return None
+    width_fraction = crop_width_fraction(metadata)
+    if width_fraction is None or width_fraction >= 0.99:
+        return None
+    cache = options.crop_cache
+    track = cache.get(input_path, window) if cache else None
+    if track is None:
+        track = smooth_crop_track(raw_crop_centers(input_path, window, width_fraction), width_fraction)
+        if cache:
+            cache.put(input_path, window, track)
+    return track or None
+
+
+def track_center(track: list[tuple[float, float]], t: float) -> float:
+    for (a, ca), (b, cb) in zip(track, track[1:]):
+        if t < b:
+            return ca if t <= a else ca + (cb - ca) * (t - a) / (b - a)
+    return track[-1][1]
+
+
+def crop_commands(track: list[tuple[float, float]], offset: float = 0.0) -> str:
+    """把裁剪轨迹写成 sendcmd 命令：每个关键点区间进入时把 crop 的 x 换成该段的线性表达式。
+
+    逐帧只求值一个常数规模的表达式；offset 用于分段编码（每段的 t 从 0 重新计）。表达式里不能有逗号
+    （sendcmd 用逗号分隔命令），越界由 crop 自身钳制，轨迹本身也已限制在画面内。
+    """
+    lines = []
+    for (a, ca), (b, cb) in zip(track, track[1:]):
+        if b - offset <= 0:
+            continue
+        slope = (cb - ca) / (b - a)
+        # 段首之前开始的区间从 0 起，sendcmd 的区间起点不能为负
+        lines.append(
+            f"{max(a - offset, 0.0):.4f}-{b - offset:.4f} [enter] crop x in_w*({ca:.4f}{slope:+.6f}*(t{offset - a:+.4f}))-out_w/2;"
+        )
+    lines.append(f"{max(track[-1][0] - offset, 0.0):.4f} [enter] crop x in_w*{track[-1][1]:.4f}-out_w/2;")
+    return "\n".join(lines) + "\n"
+
+
+def filter_escape(value: str) -> str:
+    # 选项值一层转义（\ ' :）再加滤镜图一层转义（\ ' [ ] , ;）
+    for level in ("\\':", "\\'[],;"):
+        value = "".join("\\" + c if c in level else c for c in value)
+    return value
+
+
+def sendcmd_filter(commands_path: Path) -> str:
+    return f"sendcmd=f={filter_escape(str(commands_path))}"
+
+
+@contextlib.contextmanager
+def crop_command_file(track: list[tuple[float, float]] | None, directory: Path, offset: float = 0.0) -> Iterator[Path | None]:
+    """智能裁剪时把 sendcmd 命令写到临时文件（命令行只带路径，长度与关键点数无关），用完删除。"""
+    if not track:
+        yield None
+        return
+    directory.mkdir(parents=True, exist_ok=True)
+    fd, name = tempfile.mkstemp(prefix=".crop_", suffix=".cmd", dir=directory)
+    path = Path(name)
+    try:
+        with os.fdopen(fd, "w", encoding="utf-8") as f:
+            f.write(crop_commands(track, offset))
+        yield path
+    finally:
+        path.unlink(missing_ok=True)
+
+
+def describe_crop(track: list[tuple[float, float]] | None) -> list[str]:
+    if not track:
+        return []
+    centers = [c for _, c in track]
+    return [f"  - 智能裁剪：{len(track)} 个关键点，水平中心 {min(centers):.2f}–{max(centers):.2f}"]
+
+
+def scale_crop_chain(
+    profile: dict, speed_factor: float, track: list[tuple[float, float]] | None = None, crop_offset: float = 0.0
+) -> list[str]:
+    width, height = profile["width"], profile["height"]
+    crop = f"crop={width}:{height}"
+    if track:
+        # 初始位置取轨迹在段首的中心，之后由 sendcmd 逐段更新；y 仍取默认的垂直居中
+        crop += f":x=in_w*{track_center(track, crop_offset):.4f}-out_w/2"
+    vf_chain = [
+        f"scale={width}:{height}:force_original_aspect_ratio=increase",
+        crop,
+    ]
+    if speed_factor > 1.0:
+        vf_chain.append(f"setpts=PTS/{speed_factor:.8f}")
+    return vf_chain
+
+
+def output_encode_args(profile: dict, threads: int) -> list[str]:
+    return [
+        *video_codec_args(profile),
+        "-threads",
+        str(threads),
         "-r",
-        "30",
+        str(TARGET_FPS),
         "-pix_fmt",
-        "yuv420p",
+        COPY_PIX_FMT,
         "-c:a",
         "aac",
         "-b:a",
-        "192k",
+        str(profile["audio_bitrate"]),
         "-movflags",
         "+faststart",
     ]
 
-    if speed_factor > 1.0 and audio_exists:
-        cmd.extend(["-af", build_atempo_filter(speed_factor)])
 
-    cmd.append(str(output_path))
+def describe_duration(duration: float, window: FitWindow) -> str:
+    trim = f"，截取 {window.start:.2f}s 起 {window.span:.2f}s" if window.trimmed else ""
+    if window.speed_factor > 1.0:
+        return f"  - 原始时长 {duration:.2f}s{trim}，已加速 {window.speed_factor:.4f}x 到 <= {MAX_DURATION_SECONDS:.0f}s"
+    return f"  - 原始时长 {duration:.2f}s{trim}，无需加速"
 
-    print(f"处理: {input_path.name}")
-    if speed_factor > 1.0:
-        print(f"  - 原始时长 {duration:.2f}s，已加速 {speed_factor:.4f}x 到 <= {MAX_DURATION_SECONDS:.0f}s")
+
+def process_video(
+    input_path: Path,
+    output_path: Path,
+    threads: int = 0,
+    metadata: dict | None = None,
+    profile: dict | None = None,
+    options: EncodeOptions | None = None,
+) -> list[str]:
+    profile = profile or ENCODE_PROFILES[DEFAULT_PROFILE]
+    options = options or EncodeOptions()
+    if metadata is None:
+        metadata = ffprobe_metadata(input_path)
+    duration = get_duration_seconds(metadata, input_path)
+    audio_exists = has_audio_stream(metadata)
+
+    copy_mode = passthrough_mode(metadata, duration, profile) if options.allow_copy else None
+    if copy_mode:
+        run_command(build_copy_command(input_path, output_path, copy_mode, profile))
+        label = "直接复制音视频流" if copy_mode == "copy" else "复制视频流，仅重编码音频"
+        return [
+            f"处理: {input_path.name}",
+            f"  - 原始时长 {duration:.2f}s，已符合目标规格，{label}",
+            f"  - 输出: {output_path}\n",
+        ]
+
+    window = fit_window(duration, options)
+    speed_factor = window.speed_factor
+    track = crop_track(input_path, metadata, window, options)
+    lines = [f"处理: {input_path.name}", describe_duration(duration, window), *describe_crop(track)]
+
+    with crop_command_file(track, output_path.parent) as commands:
+        vf_chain = scale_crop_chain(profile, speed_factor, track)
+        if commands is not None:
+            vf_chain.insert(0, sendcmd_filter(commands))
+        cmd = [
+            "ffmpeg",
+            "-y",
+            *seek_args(window),
+            "-i",
+            str(input_path),
+            "-vf",
+            ",".join(vf_chain),
+            "-map",
+            "0:v:0",
+            "-map",
+            "0:a?",
+            *output_encode_args(profile, threads),
+        ]
+
+        if speed_factor > 1.0 and audio_exists:
+            cmd.extend(["-af", build_atempo_filter(speed_factor)])
+
+        cmd.append(str(output_path))
+        run_command(cmd)
+    lines.append(f"  - 输出: {output_path}\n")
+    return lines
+
+
+def build_multi_output_command(
+    input_path: Path,
+    targets: list[tuple[dict, Path]],
+    threads: int,
+    speed_factor: float,
+    audio_exists: bool,
+    seek: tuple[float, float] | None = None,
+    intermediate: bool = False,
+    track: list[tuple[float, float]] | None = None,
+    crop_offset: float = 0.0,
+    crop_commands_path: Path | None = None,
+) -> list[str]:
+    # 单次解码：split/asplit 把同一路解码结果分发给每个档位各自的缩放/裁剪/编码链
+    count = len(targets)
+    # sendcmd 放在 split 之前：按类名 crop 发送，每个档位的裁剪都会收到
+    sendcmd = sendcmd_filter(crop_commands_path) + "," if crop_commands_path is not None else ""
+    graph = [f"[0:v:0]{sendcmd}split=" + str(count) + "".join(f"[s{i}]" for i in range(count))]
+    for i, (profile, _) in enumerate(targets):
+        graph.append(f"[s{i}]{','.join(scale_crop_chain(profile, speed_factor, track, crop_offset))}[v{i}]")
+    if audio_exists:
+        audio_chain = build_atempo_filter(speed_factor) if speed_factor > 1.0 else "anull"
+        graph.append(f"[0:a:0]{audio_chain},asplit={count}" + "".join(f"[a{i}]" for i in range(count)))
+
+    # 编码器线程按输出数均分，避免一个进程里多个编码器超额占用 CPU
+    output_threads = max(1, threads // count) if threads else 0
+    cmd = ["ffmpeg", "-y"]
+    if seek is not None:
+        # 输入端 -ss/-t：只解码该分段
+        cmd.extend(["-ss", f"{seek[0]:.6f}", "-t", f"{seek[1] - seek[0]:.6f}"])
+    cmd.extend(["-i", str(input_path), "-filter_complex", ";".join(graph)])
+    for i, (profile, output_path) in enumerate(targets):
+        cmd.extend(["-map", f"[v{i}]"])
+        if audio_exists:
+            cmd.extend(["-map", f"[a{i}]"])
+        args = output_encode_args(profile, output_threads)
+        if intermediate:
+            # 分段中间文件音频用 PCM，拼接后统一编码 AAC，避免每段的 AAC 前导样本在边界处产生空隙
+            args = args[: args.index("-c:a")] + ["-c:a", "pcm_s16le"]
+        cmd.extend(args)
+        cmd.append(str(output_path))
+    return cmd
+
+
+def probe_keyframe_times(video_path: Path) -> list[float]:
+    # 只读包头（不解码），取视频关键帧时间戳
+    cmd = [
+        "ffprobe",
+        "-v",
+        "error",
+        "-select_streams",
+        "v:0",
+        "-show_entries",
+        "packet=pts_time,flags",
+        "-of",
+        "csv=p=0",
+        str(video_path),
+    ]
+    times = []
+    for line in run_command(cmd).stdout.splitlines():
+        pts_time, _, flags = line.partition(",")
+        if "K" in flags:
+            try:
+                times.append(float(pts_time))
+            except ValueError:
+                continue
+    return sorted(set(times))
+
+
+def plan_segments(duration: float, keyframes: list[float], count: int) -> list[tuple[float, float]]:
+    # 每个理想等分点吸附到最近的关键帧，保证各分段都从关键帧开始解码
+    boundaries = [0.0]
+    for i in range(1, count):
+        target = duration * i / count
+        candidates = [t for t in keyframes if boundaries[-1] < t < duration]
+        if not candidates:
+            break
+        nearest = min(candidates, key=lambda t: abs(t - target))
+        if nearest > boundaries[-1]:
+            boundaries.append(nearest)
+    boundaries.append(duration)
+    return list(zip(boundaries[:-1], boundaries[1:]))
+
+
+def concat_list_line(path: Path) -> str:
+    return "file '" + str(path).replace("'", "'\\''") + "'"
+
+
+def should_segment(duration: float, options: EncodeOptions) -> bool:
+    window = fit_window(duration, options)
+    return options.segments > 1 and window.speed_factor > 1.0 and window.span >= options.segment_min_duration
+
+
+def process_segmented(
+    input_path: Path,
+    targets: list[tuple[dict, Path]],
+    threads: int,
+    metadata: dict,
+    options: EncodeOptions,
+) -> list[str]:
+    duration = get_duration_seconds(metadata, input_path)
+    audio_exists = has_audio_stream(metadata)
+    window = fit_window(duration, options)
+    speed_factor = window.speed_factor
+    track = crop_track(input_path, metadata, window, options)
+
+    # 关键帧时间戳是容器时间，-ss 相对于文件起点，需减去 start_time；分段只覆盖 --fit 选定的窗口
+    start_time = float(metadata.get("format", {}).get("start_time") or 0.0) + window.start
+    keyframes = [t - start_time for t in probe_keyframe_times(input_path)]
+    segments = [
+        (window.start + seg_start, window.start + seg_end)
+        for seg_start, seg_end in plan_segments(window.span, keyframes, options.segments)
+    ]
+
+    # 每个任务独占一个临时目录：clip.mp4 与 clip.mov 并发时不会互相覆盖或删除分段
+    targets[0][1].parent.mkdir(parents=True, exist_ok=True)
+    work_dir = Path(tempfile.mkdtemp(dir=targets[0][1].parent, prefix=f".{targets[0][1].name}.segments-"))
+    segment_threads = max(1, (threads or os.cpu_count() or 1) // len(segments))
+    try:
+        segment_files = [
+            [work_dir / f"{profile['name']}_{index:04d}.mkv" for index in range(len(segments))] for profile, _ in targets
+        ]
+        with ThreadPoolExecutor(max_workers=len(segments)) as pool:
+            futures = []
+            for index, seek in enumerate(segments):
+                segment_targets = [(profile, segment_files[t][index]) for t, (profile, _) in enumerate(targets)]
+                commands_path = None
+                if track:
+                    commands_path = work_dir / f"crop_{index:04d}.cmd"
+                    commands_path.write_text(crop_commands(track, seek[0] - window.start), encoding="utf-8")
+                cmd = build_multi_output_command(
+                    input_path,
+                    segment_targets,
+                    segment_threads,
+                    speed_factor,
+                    audio_exists,
+                    seek=seek,
+                    intermediate=True,
+                    track=track,
+                    crop_offset=seek[0] - window.start,
+                    crop_commands_path=commands_path,
+                )
+                # 复制上下文，让分段 ffmpeg 的进度计入当前任务
+                futures.append(pool.submit(contextvars.copy_context().run, run_command, cmd))
+            for future in futures:
+                future.result()
+
+        expected = window.span / speed_factor
+        tolerance = SEGMENT_DURATION_TOLERANCE + len(segments) / TARGET_FPS
+        lines = [
+            f"处理: {input_path.name}（分 {len(segments)} 段并行）",
+            describe_duration(duration, window),
+            *describe_crop(track),
+        ]
+        for t, (profile, output_path) in enumerate(targets):
+            list_path = work_dir / f"{profile['name']}_concat.txt"
+            list_path.write_text("\n".join(concat_list_line(p) for p in segment_files[t]) + "\n", encoding="utf-8")
+            cmd = ["ffmpeg", "-y", "-f", "concat", "-safe", "0", "-i", str(list_path), "-map", "0:v:0", "-map", "0:a?", "-c:v", "copy"]
+            cmd.extend(["-c:a", "aac", "-b:a", str(profile["audio_bitrate"]), "-movflags", "+faststart", str(output_path)])
+            run_command(cmd)
+
+            actual = get_duration_seconds(ffprobe_metadata(output_path), output_path)
+            if abs(actual - expected) > tolerance:
+                raise ValueError(f"分段拼接后时长 {actual:.2f}s 与目标 {expected:.2f}s 不符: {output_path}")
+            lines.append(f"  - 输出({profile['name']}，{actual:.2f}s): {output_path}")
+    finally:
+        shutil.rmtree(work_dir, ignore_errors=True)
+
+    lines[-1] += "\n"
+    return lines
+
+
+def process_renditions(
+    input_path: Path,
+    targets: list[tuple[dict, Path]],
+    threads: int = 0,
+    metadata: dict | None = None,
+    options: EncodeOptions | None = None,
+) -> list[str]:
+    options = options or EncodeOptions()
+    if metadata is None:
+        metadata = ffprobe_metadata(input_path)
+    duration = get_duration_seconds(metadata, input_path)
+    if should_segment(duration, options):
+        return process_segmented(input_path, targets, threads, metadata, options)
+
+    if len(targets) == 1:
+        profile, output_path = targets[0]
+        return process_video(input_path, output_path, threads, metadata, profile, options)
+
+    audio_exists = has_audio_stream(metadata)
+    window = fit_window(duration, options)
+
+    lines = [f"处理: {input_path.name}（{len(targets)} 个档位）", describe_duration(duration, window)]
+    encode_targets: list[tuple[dict, Path]] = []
+    for profile, output_path in targets:
+        copy_mode = passthrough_mode(metadata, duration, profile) if options.allow_copy else None
+        if copy_mode:
+            run_command(build_copy_command(input_path, output_path, copy_mode, profile))
+            lines.append(f"  - 输出({profile['name']}，直通): {output_path}")
+        else:
+            encode_targets.append((profile, output_path))
+
+    if encode_targets:
+        seek = (window.start, window.start + window.span) if window.trimmed else None
+        track = crop_track(input_path, metadata, window, options)
+        lines.extend(describe_crop(track))
+        with crop_command_file(track, encode_targets[0][1].parent) as commands:
+            cmd = build_multi_output_command(
+                input_path,
+                encode_targets,
+                threads,
+                window.speed_factor,
+                audio_exists,
+                seek=seek,
+                track=track,
+                crop_commands_path=commands,
+            )
+            run_command(cmd)
+        lines.extend(f"  - 输出({profile['name']}): {output_path}" for profile, output_path in encode_targets)
+    lines[-1] += "\n"
+    return lines
+
+
+def expected_output_seconds(metadata: dict | None, options: EncodeOptions | None = None) -> float:
+    duration = metadata_duration(metadata)
+    if duration is None:
+        return 0.0
+    window = fit_window(duration, options)
+    return window.span / window.speed_factor
+
+
+def run_job(
+    input_path: Path,
+    targets: list[tuple[dict, Path]],
+    threads: int,
+    metadata: dict | None = None,
+    options: EncodeOptions | None = None,
+    progress: BatchProgress | None = None,
+) -> JobResult:
+    result = JobResult(input_path=input_path, targets=targets)
+    job = progress.start_job(str(input_path), expected_output_seconds(metadata, options)) if progress else None
+    token = CURRENT_JOB.set(job)
+    try:
+        result.lines = process_renditions(input_path, targets, threads, metadata, options)
+    except subprocess.CalledProcessError as exc:
+        result.ok = False
+        result.error = f"处理失败: {input_path}"
+        if exc.stderr:
+            result.error += f"\n{exc.stderr}"
+    except Exception as exc:  # noqa: BLE001
+        result.ok = False
+        result.error = f"处理失败: {input_path} - {exc}"
+    finally:
+        CURRENT_JOB.reset(token)
+
+    if progress and job:
+        extra = {
+            "profiles": [profile["name"] for profile, _ in targets],
+            "threads": threads,
+            "source_seconds": metadata_duration(metadata),
+        }
+        totals = progress.finish_job(job, result.ok, extra)
+        if result.ok and result.lines:
+            result.lines.insert(
+                -1,
+                f"  - 用时 {totals['elapsed']:.1f}s，{totals['fps']:.1f} fps，{totals['speed']:.2f}x 实时，"
+                f"写入 {totals['bytes'] / 1e6:.1f} MB",
+            )
+    return result
+
+
+def encode_params(profile: dict, options: EncodeOptions | None = None) -> dict:
+    # 只记录影响输出内容的选项；分段数等纯调度参数变化不触发重建
+    options = options or EncodeOptions()
+    return {
+        **profile,
+        "max_duration": MAX_DURATION_SECONDS,
+        "allow_copy": options.allow_copy,
+        "fit": options.fit,
+        "trim_start": options.trim_start,
+        "max_speed": options.max_speed,
+        "crop": options.crop,
+    }
+
+
+def file_sha256(path: Path) -> str:
+    digest = hashlib.sha256()
+    with path.open("rb") as f:
+        for chunk in iter(lambda: f.read(1 << 20), b""):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+
+class TranscodeManifest:
+    """输出目录下的 JSON 清单：记录每个输入的 size/mtime(/sha256) 及其各输出的编码参数，用于跳过未变化的文件。"""
+
+    VERSION = 2
+
+    def __init__(self, path: Path, use_hash: bool = False) -> None:
+        self.path = path
+        self.use_hash = use_hash
+        self.entries: dict[str, dict] = {}
+        if path.exists():
+            try:
+                data = json.loads(path.read_text(encoding="utf-8"))
+            except (OSError, ValueError):
+                data = {}
+            if data.get("version") == self.VERSION:
+                self.entries = data.get("entries", {})
+
+    def signature(self, input_path: Path) -> dict:
+        stat = input_path.stat()
+        sig = {"size": stat.st_size, "mtime_ns": stat.st_mtime_ns}
+        if self.use_hash:
+            previous = self.entries.get(str(input_path), {}).get("input", {})
+            # size/mtime 未变时沿用旧哈希，避免每次全量读文件
+            if previous.get("size") == sig["size"] and previous.get("mtime_ns") == sig["mtime_ns"] and previous.get("sha256"):
+                sig["sha256"] = previous["sha256"]
+            else:
+                sig["sha256"] = file_sha256(input_path)
+        return sig
+
+    def input_unchanged(self, input_path: Path) -> bool:
+        previous = self.entries.get(str(input_path), {}).get("input")
+        if not previous:
+            return False
+        sig = self.signature(input_path)
+        if sig["size"] != previous.get("size"):
+            return False
+        if sig["mtime_ns"] == previous.get("mtime_ns"):
+            return True
+        # 仅 mtime 变化（如重新拷贝）时，开启哈希则按内容判断
+        return self.use_hash and sig.get("sha256") == previous.get("sha256")
+
+    def is_current(self, input_path: Path, output_path: Path, params: dict) -> bool:
+        entry = self.entries.get(str(input_path))
+        if not entry or entry.get("outputs", {}).get(str(output_path)) != params or not output_path.exists():
+            return False
+        return self.input_unchanged(input_path)
+
+    def record(self, input_path: Path, output_path: Path, params: dict, sig: dict) -> None:
+        entry = self.entries.get(str(input_path))
+        if not entry or entry.get("input") != sig:
+            entry = {"input": sig, "outputs": {}}
+            self.entries[str(input_path)] = entry
+        entry["outputs"][str(output_path)] = params
+
+    def save(self) -> None:
+        write_json_atomic(self.path, {"version": self.VERSION, "entries": self.entries})
+
+
+def metadata_duration(metadata: dict | None) -> float | None:
+    try:
+        return float(metadata["format"]["duration"]) if metadata else None
+    except (KeyError, TypeError, ValueError):
+        return None
+
+
+def order_queue(videos: list[Path], metadata_by_path: dict[Path, dict] | None = None) -> list[Path]:
+    # 时长已知的按时长、其余按文件大小，均为最长优先；探测失败的排在最后
+    metadata_by_path = metadata_by_path or {}
+
+    def key(p: Path) -> tuple[int, float]:
+        duration = metadata_duration(metadata_by_path.get(p))
+        if duration is not None:
+            return (2, duration)
+        if metadata_by_path:
+            return (0, p.stat().st_size)
+        return (1, p.stat().st_size)
+
+    return sorted(videos, key=key, reverse=True)
+
+
+def print_plan(
+    videos: list[Path],
+    metadata_by_path: dict[Path, dict],
+    jobs: int,
+    assumed_speed: float,
+    options: EncodeOptions | None = None,
+) -> None:
+    total_duration = 0.0
+    total_decoded = 0.0
+    total_output = 0.0
+    for video in order_queue(videos, metadata_by_path):
+        duration = metadata_duration(metadata_by_path.get(video))
+        if duration is None:
+            print(f"  ? {video.name}: 无法探测时长")
+            continue
+        window = fit_window(duration, options)
+        output = window.span / window.speed_factor
+        total_duration += duration
+        total_decoded += window.span
+        total_output += output
+        trim = f" [{window.start:.2f}s +{window.span:.2f}s]" if window.trimmed else ""
+        print(f"  - {video.name}: {duration:.2f}s{trim} x{window.speed_factor:.4f} -> {output:.2f}s")
+
+    # 粗略估算：每个任务以 assumed_speed 倍实时速度解码所需的源区间，任务间完全并行
+    estimate = total_decoded / max(assumed_speed, 1e-6) / max(1, jobs)
+    print(
+        f"计划: {len(videos)} 个文件，源总时长 {total_duration:.1f}s（需解码 {total_decoded:.1f}s），输出总时长 {total_output:.1f}s，"
+        f"预计耗时约 {estimate:.0f}s（{jobs} 并发，{assumed_speed:g}x 实时）"
+    )
+
+
+def output_path_for(video: Path, output_dir: Path, profile: dict | None = None) -> Path:
+    suffix = (profile or ENCODE_PROFILES[DEFAULT_PROFILE])["suffix"]
+    return output_dir / f"{video.stem}{suffix}{video.suffix.lower()}"
+
+
+def handle_result(
+    result: JobResult,
+    sig: dict,
+    manifest: TranscodeManifest | None,
+    options: EncodeOptions,
+    failures: list[JobResult],
+) -> None:
+    if result.ok:
+        print("\n".join(result.lines))
+        if manifest:
+            for profile, output_path in result.targets:
+                manifest.record(result.input_path, output_path, encode_params(profile, options), sig)
+            manifest.save()
     else:
-        print(f"  - 原始时长 {duration:.2f}s，无需加速")
+        failures.append(result)
+        print(result.error, file=sys.stderr)
+
+
+def plan_targets(
+    video: Path,
+    output_dir: Path,
+    profile_names: list[str],
+    profiles: dict[str, dict],
+    manifest: TranscodeManifest,
+    options: EncodeOptions,
+    force: bool = False,
+) -> tuple[list[tuple[dict, Path]], int]:
+    targets = []
+    skipped = 0
+    for name in profile_names:
+        profile = profiles[name]
+        output_path = output_path_for(video, output_dir, profile)
+        if force or not manifest.is_current(video, output_path, encode_params(profile, options)):
+            targets.append((profile, output_path))
+        else:
+            skipped += 1
+    return targets, skipped
+
+
+def run_batch(
+    targets_by_path: dict[Path, list[tuple[dict, Path]]],
+    jobs: int,
+    manifest: TranscodeManifest | None = None,
+    metadata_by_path: dict[Path, dict] | None = None,
+    options: EncodeOptions | None = None,
+    progress: BatchProgress | None = None,
+) -> list[JobResult]:
+    options = options or EncodeOptions()
+    metadata_by_path = metadata_by_path or {}
+    threads = threads_per_job(jobs) if jobs > 1 else 0
+    failures: list[JobResult] = []
 
-    run_command(cmd)
-    print(f"  - 输出: {output_path}\n")
+    if progress:
+        progress.start()
+    with ThreadPoolExecutor(max_workers=jobs) as pool:
+        futures = {}
+        for video in order_queue(list(targets_by_path), metadata_by_path):
+            # 编码前取签名：编码过程中被改写的输入下次仍会重建
+            sig = manifest.signature(video) if manifest else {}
+            job = pool.submit(run_job, video, targets_by_path[video], threads, metadata_by_path.get(video), options, progress)
+            futures[job] = sig
+        for done, future in enumerate(as_completed(futures), start=1):
+            result = future.result()
+            handle_result(result, futures[future], manifest, options, failures)
+            print(f"[{done}/{len(futures)}] {'完成' if result.ok else '失败'}: {result.input_path.name}", flush=True)
+
+    if progress:
+        progress.stop({"jobs": jobs})
+        print(progress.format_line())
+    return failures
 
 
 def collect_videos(input_dir: Path, recursive: bool) -> list[Path]:
@@ -127,6 +1524,117 @@ def collect_videos(input_dir: Path, recursive: bool) -> list[Path]:
     return sorted(files)
 
 
+def is_partial_file(path: Path) -> bool:
+    return any(suffix.lower() in PARTIAL_SUFFIXES for suffix in path.suffixes)
+
+
+def iter_video_files(directory: Path, recursive: bool, exclude: Path) -> list[tuple[Path, int, int]]:
+    # os.scandir 一次拿到 stat，比 rglob + is_file 少一轮系统调用；跳过输出目录、隐藏目录与临时文件，避免处理自己的产物
+    found: list[tuple[Path, int, int]] = []
+    try:
+        entries = list(os.scandir(directory))
+    except OSError:
+        return found
+    for entry in entries:
+        path = Path(entry.path)
+        try:
+            if entry.is_dir(follow_symlinks=False):
+                if recursive and path.resolve() != exclude.resolve() and not entry.name.startswith("."):
+                    found.extend(iter_video_files(path, recursive, exclude))
+            elif (
+                entry.is_file()
+                and path.suffix.lower() in VIDEO_EXTENSIONS
+                and not entry.name.startswith(".")
+                and not is_partial_file(path)
+            ):
+                stat = entry.stat()
+                found.append((path, stat.st_size, stat.st_mtime_ns))
+        except OSError:
+            continue
+    return found
+
+
+def watch_folder(
+    input_dir: Path,
+    recursive: bool,
+    output_dir: Path,
+    jobs: int,
+    plan: Callable[[Path], list[tuple[dict, Path]]],
+    manifest: TranscodeManifest,
+    probe_cache: ProbeCache,
+    options: EncodeOptions,
+    progress: BatchProgress | None = None,
+    poll_interval: float = DEFAULT_POLL_INTERVAL,
+    settle_seconds: float = DEFAULT_SETTLE_SECONDS,
+) -> list[JobResult]:
+    """常驻监视输入目录：文件大小与 mtime 连续 settle_seconds 不变才视为上传完成，随即提交到任务池。"""
+    threads = threads_per_job(jobs) if jobs > 1 else 0
+    failures: list[JobResult] = []
+    pending: dict[Path, tuple[int, int, float]] = {}
+    handled: dict[Path, tuple[int, int]] = {}
+    # 输出目录在输入目录内时整个跳过；两者相同时按已知输出（清单记录 + 本次计划）跳过自己写出的文件
+    output_root = output_dir.resolve()
+    same_dir = output_root == input_dir.resolve()
+    outputs = {Path(p).resolve() for entry in manifest.entries.values() for p in entry.get("outputs", {})}
+    futures: dict = {}
+
+    def is_output(video: Path) -> bool:
+        resolved = video.resolve()
+        return resolved in outputs or (not same_dir and resolved.is_relative_to(output_root))
+
+    print(f"监视中: {input_dir}（轮询 {poll_interval:g}s，稳定 {settle_seconds:g}s 后处理，Ctrl+C 退出）", flush=True)
+    if progress:
+        progress.start()
+    with ThreadPoolExecutor(max_workers=jobs) as pool:
+        try:
+            while True:
+                now = time.monotonic()
+                for video, size, mtime_ns in iter_video_files(input_dir, recursive, output_dir):
+                    state = (size, mtime_ns)
+                    if handled.get(video) == state or is_output(video):
+                        continue
+                    seen = pending.get(video)
+                    if seen is None or seen[:2] != state:
+                        pending[video] = (size, mtime_ns, now)
+                        continue
+                    if now - seen[2] < settle_seconds:
+                        continue
+
+                    del pending[video]
+                    handled[video] = state
+                    try:
+                        targets = plan(video)
+                        outputs.update(output_path.resolve() for _, output_path in targets)
+                        if not targets:
+                            continue
+                        metadata = probe_videos([video], probe_cache, 1).get(video)
+                        signature = manifest.signature(video)
+                    except OSError as exc:
+                        # 稳定后又被删除或改名：跳过，文件再次出现时会重新等待稳定
+                        print(f"跳过 {video}: {exc}", file=sys.stderr, flush=True)
+                        continue
+                    if progress:
+                        progress.add_jobs(1, expected_output_seconds(metadata, options))
+                    print(f"发现新文件: {video}", flush=True)
+                    job = pool.submit(run_job, video, targets, threads, metadata, options, progress)
+                    futures[job] = signature
+
+                for future in [f for f in futures if f.done()]:
+                    result = future.result()
+                    handle_result(result, futures.pop(future), manifest, options, failures)
+                    print(f"[{'完成' if result.ok else '失败'}] {result.input_path.name}", flush=True)
+                time.sleep(poll_interval)
+        except KeyboardInterrupt:
+            print("\n停止监视，等待进行中的任务完成…", flush=True)
+            for future in as_completed(list(futures)):
+                handle_result(future.result(), futures.pop(future), manifest, options, failures)
+
+    if progress:
+        progress.stop({"jobs": jobs, "mode": "watch"})
+        print(progress.format_line())
+    return failures
+
+
 def ensure_ffmpeg_tools() -> None:
     for tool in ("ffmpeg", "ffprobe"):
         if shutil.which(tool) is None:
@@ -140,6 +1648,63 @@ def main() -> int:
     parser.add_argument("input_dir", nargs="?", default=".", help="输入目录，默认当前目录")
     parser.add_argument("-o", "--output-dir", default="output", help="输出目录，默认 ./output")
     parser.add_argument("-r", "--recursive", action="store_true", help="递归处理子目录")
+    parser.add_argument("-j", "--jobs", type=int, default=1, help="并发 ffmpeg 任务数，CPU 核心在任务间均分，默认 1")
+    parser.add_argument("-f", "--force", action="store_true", help="忽略清单，全部重新编码")
+    parser.add_argument("--hash", action="store_true", help="清单额外记录 SHA-256，mtime 变化但内容相同的文件也跳过")
+    parser.add_argument("--probe-jobs", type=int, default=DEFAULT_PROBE_JOBS, help=f"并发 ffprobe 数，默认 {DEFAULT_PROBE_JOBS}")
+    parser.add_argument("-n", "--dry-run", action="store_true", help="只探测并打印处理计划（时长、加速倍数、预计耗时），不编码")
+    parser.add_argument("-p", "--profile", default=DEFAULT_PROFILE, help=f"编码档位（final/fast/preview/720p/4x5 或自定义），默认 {DEFAULT_PROFILE}")
+    parser.add_argument("--renditions", help="逗号分隔的多个档位，单次解码同时输出，如 final,720p,4x5；覆盖 --profile")
+    parser.add_argument("--profiles-file", help="JSON 文件：覆盖或新增编码档位，如 {\"nvenc\": {\"codec\": \"h264_nvenc\", \"crf\": null, ...}}")
+    parser.add_argument("--profile-map", help="JSON 文件：按文件名通配符指定档位（可为列表），如 {\"*_review*\": \"preview\"}")
+    parser.add_argument("--no-copy", action="store_true", help="禁用直通：即使源文件已符合目标规格也完整重编码")
+    parser.add_argument(
+        "--fit",
+        choices=FIT_STRATEGIES,
+        default="speed",
+        help="超长视频适配方式：speed 整段加速（默认）；trim 只截取一个窗口；hybrid 加速封顶后截取",
+    )
+    parser.add_argument("--trim-start", type=float, default=0.0, help="trim/hybrid 截取窗口的起点（秒），默认 0")
+    parser.add_argument(
+        "--max-speed",
+        type=float,
+        default=DEFAULT_MAX_SPEED,
+        help=f"hybrid 模式的最大加速倍数，默认 {DEFAULT_MAX_SPEED:g}",
+    )
+    parser.add_argument(
+        "--crop",
+        choices=CROP_MODES,
+        default="center",
+        help="裁剪方式：center 居中（默认）；smart 先低分辨率分析画面运动与细节，生成平滑的水平裁剪轨迹跟随主体（结果缓存）",
+    )
+    parser.add_argument("--segments", type=int, default=0, help="长视频按关键帧切成 N 段并行编码后拼接，默认 0（关闭）")
+    parser.add_argument(
+        "--segment-min-duration",
+        type=float,
+        default=DEFAULT_SEGMENT_MIN_DURATION,
+        help=f"启用分段编码的最短源时长（秒），默认 {DEFAULT_SEGMENT_MIN_DURATION:.0f}",
+    )
+    parser.add_argument("--metrics-log", help=f"JSON-lines 指标日志路径，默认 <输出目录>/{METRICS_LOG_NAME}")
+    parser.add_argument(
+        "--progress-interval",
+        type=float,
+        default=DEFAULT_PROGRESS_INTERVAL,
+        help=f"汇总进度打印间隔（秒），0 关闭，默认 {DEFAULT_PROGRESS_INTERVAL:.0f}",
+    )
+    parser.add_argument("-w", "--watch", action="store_true", help="常驻监视输入目录，新文件上传完成后立即处理")
+    parser.add_argument(
+        "--poll-interval",
+        type=float,
+        default=DEFAULT_POLL_INTERVAL,
+        help=f"监视模式轮询间隔（秒），默认 {DEFAULT_POLL_INTERVAL:g}",
+    )
+    parser.add_argument(
+        "--settle-seconds",
+        type=float,
+        default=DEFAULT_SETTLE_SECONDS,
+        help=f"文件大小与 mtime 保持不变多久才视为上传完成（秒），默认 {DEFAULT_SETTLE_SECONDS:g}",
+    )
+    parser.add_argument("--assumed-speed", type=float, default=1.0, help="预计耗时所用的单任务编码速度（实时倍数），默认 1.0")
     args = parser.parse_args()
 
     input_dir = Path(args.input_dir).resolve()
@@ -149,12 +1714,71 @@ def main() -> int:
         print(f"输入目录不存在或不是目录: {input_dir}", file=sys.stderr)
         return 1
 
+    if args.jobs < 1:
+        print(f"--jobs 必须 >= 1: {args.jobs}", file=sys.stderr)
+        return 1
+
+    if args.watch and args.dry_run:
+        print("--watch 不能与 --dry-run 同时使用", file=sys.stderr)
+        return 1
+
+    try:
+        profiles = load_profiles(Path(args.profiles_file) if args.profiles_file else None)
+        profile_map = load_profile_map(Path(args.profile_map) if args.profile_map else None)
+    except (OSError, ValueError) as exc:
+        print(f"无法读取档位配置: {exc}", file=sys.stderr)
+        return 1
+    default_profiles = parse_profile_names(args.renditions or args.profile)
+    unknown = {*default_profiles, *(name for _, names in profile_map for name in names)} - profiles.keys()
+    if unknown:
+        print(f"未知编码档位: {', '.join(sorted(unknown))}（可选: {', '.join(profiles)}）", file=sys.stderr)
+        return 1
+
     try:
         ensure_ffmpeg_tools()
     except EnvironmentError as exc:
         print(str(exc), file=sys.stderr)
         return 1
 
+    options = EncodeOptions(
+        allow_copy=not args.no_copy,
+        segments=args.segments,
+        segment_min_duration=args.segment_min_duration,
+        fit=args.fit,
+        trim_start=args.trim_start,
+        max_speed=args.max_speed,
+        crop=args.crop,
+        crop_cache=CropCache(output_dir / CROP_CACHE_NAME) if args.crop == "smart" else None,
+    )
+    metrics_log = Path(args.metrics_log).resolve() if args.metrics_log else output_dir / METRICS_LOG_NAME
+
+    if args.watch:
+        output_dir.mkdir(parents=True, exist_ok=True)
+        manifest = TranscodeManifest(output_dir / MANIFEST_NAME, use_hash=args.hash)
+
+        def plan(video: Path) -> list[tuple[dict, Path]]:
+            names = select_profiles(video, default_profiles, profile_map)
+            return plan_targets(video, output_dir, names, profiles, manifest, options, args.force)[0]
+
+        failures = watch_folder(
+            input_dir,
+            args.recursive,
+            output_dir,
+            args.jobs,
+            plan,
+            manifest,
+            ProbeCache(output_dir / PROBE_CACHE_NAME),
+            options,
+            BatchProgress(0, 0.0, metrics_log, args.progress_interval),
+            args.poll_interval,
+            args.settle_seconds,
+        )
+        if failures:
+            print(f"\n失败 {len(failures)} 个文件:", file=sys.stderr)
+            for result in failures:
+                print(f"  - {result.input_path}", file=sys.stderr)
+        return 0
+
     videos = collect_videos(input_dir, args.recursive)
     if not videos:
         print("未找到可处理的视频文件。")
@@ -162,18 +1786,38 @@ def main() -> int:
 
     output_dir.mkdir(parents=True, exist_ok=True)
 
+    manifest = TranscodeManifest(output_dir / MANIFEST_NAME, use_hash=args.hash)
+    targets_by_path: dict[Path, list[tuple[dict, Path]]] = {}
+    skipped = 0
     for video in videos:
-        output_name = f"{video.stem}_9x16_1080p{video.suffix.lower()}"
-        output_path = output_dir / output_name
+        names = select_profiles(video, default_profiles, profile_map)
+        targets, skipped_outputs = plan_targets(video, output_dir, names, profiles, manifest, options, args.force)
+        skipped += skipped_outputs
+        if targets:
+            targets_by_path[video] = targets
+    if skipped:
+        print(f"跳过 {skipped} 个未变化的输出（清单: {manifest.path}）")
+    pending = list(targets_by_path)
 
-        try:
-            process_video(video, output_path)
-        except subprocess.CalledProcessError as exc:
-            print(f"处理失败: {video}", file=sys.stderr)
-            if exc.stderr:
-                print(exc.stderr, file=sys.stderr)
-        except Exception as exc:  # noqa: BLE001
-            print(f"处理失败: {video} - {exc}", file=sys.stderr)
+    probe_cache = ProbeCache(output_dir / PROBE_CACHE_NAME)
+    metadata_by_path = probe_videos(pending, probe_cache, args.probe_jobs)
+
+    if args.dry_run:
+        print_plan(pending, metadata_by_path, args.jobs, args.assumed_speed, options)
+        return 0
+
+    progress = BatchProgress(
+        len(pending),
+        sum(expected_output_seconds(metadata_by_path.get(v), options) for v in pending),
+        metrics_log,
+        args.progress_interval,
+    )
+    failures = run_batch(targets_by_path, args.jobs, manifest, metadata_by_path, options, progress)
+
+    if failures:
+        print(f"\n失败 {len(failures)}/{len(pending)} 个文件:", file=sys.stderr)
+        for result in failures:
+            print(f"  - {result.input_path}", file=sys.stderr)
 
     print(f"全部任务完成，输出目录: {output_dir}")
     return 0